@@ -1,7 +1,7 @@
+import atexit
 from datetime import datetime
 from flask import Flask, render_template
 import logging
-from multiprocessing import Process
 from multiprocessing.managers import BaseManager
 import os
 import random
@@ -16,8 +16,21 @@ from ask_sdk_core.dispatch_components import AbstractExceptionHandler
 from flask_ask_sdk.skill_adapter import SkillAdapter
 
 import asknavidrome.subsonic_api as api
+import asknavidrome.catalog as catalog
+import asknavidrome.playlists as playlists
+import asknavidrome.sync as sync
+import asknavidrome.transport as transport
 import asknavidrome.media_queue as queue
 import asknavidrome.controller as controller
+import asknavidrome.deadline as deadline
+import asknavidrome.loader as loader
+import asknavidrome.fuzzy as fuzzy
+import asknavidrome.sessions as sessions
+import asknavidrome.snapshots as snapshots
+import asknavidrome.history as history
+import asknavidrome.smart_shuffle as smart_shuffle
+import asknavidrome.cache as cache
+import asknavidrome.scrobbles as scrobbles
 
 # Create web service
 app = Flask(__name__)
@@ -143,6 +156,153 @@ except NameError as err:
     logger.error(f'The Navidrome API version was not found! {err}')
     raise
 
+# Optional configuration
+navidrome_max_concurrency = 8
+
+if 'NAVI_MAX_CONCURRENCY' in os.environ:
+    # The maximum number of requests which are made to the Subsonic API at the same time
+    navidrome_max_concurrency = int(os.getenv('NAVI_MAX_CONCURRENCY'))
+
+logger.info(f'The maximum number of concurrent API requests is set to: {navidrome_max_concurrency}')
+
+navidrome_http_pool_size = navidrome_max_concurrency
+navidrome_http_connect_timeout = 5
+navidrome_http_read_timeout = 30
+
+if 'NAVI_HTTP_POOL_SIZE' in os.environ:
+    # The number of idle connections to the Subsonic API which are kept open
+    navidrome_http_pool_size = int(os.getenv('NAVI_HTTP_POOL_SIZE'))
+
+if 'NAVI_HTTP_CONNECT_TIMEOUT' in os.environ:
+    navidrome_http_connect_timeout = float(os.getenv('NAVI_HTTP_CONNECT_TIMEOUT'))
+
+if 'NAVI_HTTP_READ_TIMEOUT' in os.environ:
+    navidrome_http_read_timeout = float(os.getenv('NAVI_HTTP_READ_TIMEOUT'))
+
+navidrome_search_cache_size = 256
+navidrome_search_cache_ttl = 300
+
+if 'NAVI_SEARCH_CACHE_SIZE' in os.environ:
+    # The number of search results which are cached
+    navidrome_search_cache_size = int(os.getenv('NAVI_SEARCH_CACHE_SIZE'))
+
+if 'NAVI_SEARCH_CACHE_TTL' in os.environ:
+    # The number of seconds search results are cached for
+    navidrome_search_cache_ttl = float(os.getenv('NAVI_SEARCH_CACHE_TTL'))
+
+logger.info(f'Search cache size: {navidrome_search_cache_size}, TTL: {navidrome_search_cache_ttl}s')
+
+navidrome_catalog_enabled = False
+
+if 'NAVI_CATALOG' in os.environ:
+    # Keep a local catalog of the library to resolve intents without querying the media server
+    navidrome_catalog_enabled = int(os.getenv('NAVI_CATALOG')) == 1
+
+logger.info(f'The local library catalog is enabled: {navidrome_catalog_enabled}')
+
+navidrome_sync_interval = 300
+
+if 'NAVI_SYNC_INTERVAL' in os.environ:
+    # Seconds between checks for library changes, 0 disables synchronisation
+    navidrome_sync_interval = float(os.getenv('NAVI_SYNC_INTERVAL'))
+
+logger.info(f'The library synchronisation interval is set to: {navidrome_sync_interval}s')
+
+navidrome_playlist_cache_ttl = 300
+navidrome_playlist_cache_size = 64
+
+if 'NAVI_PLAYLIST_CACHE_TTL' in os.environ:
+    # Seconds after which the playlist directory is reloaded when it is used, 0 relies on library synchronisation
+    navidrome_playlist_cache_ttl = float(os.getenv('NAVI_PLAYLIST_CACHE_TTL'))
+
+if 'NAVI_PLAYLIST_CACHE_SIZE' in os.environ:
+    # The number of playlists whose entries are cached
+    navidrome_playlist_cache_size = int(os.getenv('NAVI_PLAYLIST_CACHE_SIZE'))
+
+logger.info(f'Playlist cache size: {navidrome_playlist_cache_size}, TTL: {navidrome_playlist_cache_ttl}s')
+
+navidrome_hydration_window = 5
+
+if 'NAVI_HYDRATION_WINDOW' in os.environ:
+    # The number of upcoming tracks in the play queue that are fully prepared
+    navidrome_hydration_window = int(os.getenv('NAVI_HYDRATION_WINDOW'))
+
+logger.info(f'The hydration window is set to: {navidrome_hydration_window} tracks')
+
+navidrome_history_size = 100
+
+if 'NAVI_HISTORY_SIZE' in os.environ:
+    # The number of played tracks kept in memory, older tracks are saved in the data directory
+    navidrome_history_size = int(os.getenv('NAVI_HISTORY_SIZE'))
+
+logger.info(f'The history size is set to: {navidrome_history_size} tracks')
+
+navidrome_smart_shuffle = True
+
+if 'NAVI_SMART_SHUFFLE' in os.environ:
+    # Keep songs by the same artist and from the same album apart when shuffling, 0 uses a plain shuffle
+    navidrome_smart_shuffle = int(os.getenv('NAVI_SMART_SHUFFLE')) == 1
+
+logger.info(f'Smart shuffle is set to: {navidrome_smart_shuffle}')
+
+navidrome_api_key = None
+
+if 'NAVI_API_KEY' in os.environ:
+    # OpenSubsonic API key used to authenticate stream URIs instead of the username and password
+    navidrome_api_key = os.getenv('NAVI_API_KEY')
+
+logger.info(f'Stream URIs are authenticated with an API key: {navidrome_api_key is not None}')
+
+navidrome_response_budget = 7
+
+if 'NAVI_RESPONSE_BUDGET' in os.environ:
+    # Seconds available to respond to Alexa, which waits 8 seconds for a response
+    navidrome_response_budget = float(os.getenv('NAVI_RESPONSE_BUDGET'))
+
+logger.info(f'The response budget is set to: {navidrome_response_budget}s')
+
+navidrome_queue_backend = 'local'
+
+if 'NAVI_QUEUE_BACKEND' in os.environ:
+    # local keeps the play queue in this process, manager shares it through a multiprocessing manager
+    navidrome_queue_backend = os.getenv('NAVI_QUEUE_BACKEND').lower()
+
+logger.info(f'The play queue backend is set to: {navidrome_queue_backend}')
+
+navidrome_max_sessions = 32
+navidrome_session_idle_timeout = 3600
+navidrome_data_dir = None
+navidrome_queue_per_user = False
+
+if 'NAVI_MAX_SESSIONS' in os.environ:
+    # The number of device play queues kept in memory
+    navidrome_max_sessions = int(os.getenv('NAVI_MAX_SESSIONS'))
+
+if 'NAVI_SESSION_IDLE_TIMEOUT' in os.environ:
+    # Seconds after which the play queue of an idle device is evicted from memory, 0 disables this
+    navidrome_session_idle_timeout = float(os.getenv('NAVI_SESSION_IDLE_TIMEOUT'))
+
+navidrome_snapshot_interval = 5
+
+if 'NAVI_DATA_DIR' in os.environ:
+    # Directory used to save play queues so they survive eviction from memory and restarts
+    navidrome_data_dir = os.getenv('NAVI_DATA_DIR')
+
+if 'NAVI_SNAPSHOT_INTERVAL' in os.environ:
+    # Seconds between saving the play queues which have changed, 0 saves them only when they are evicted
+    navidrome_snapshot_interval = float(os.getenv('NAVI_SNAPSHOT_INTERVAL'))
+
+if 'NAVI_QUEUE_PER_USER' in os.environ:
+    # Keep a play queue for each user of a device instead of each device
+    navidrome_queue_per_user = int(os.getenv('NAVI_QUEUE_PER_USER')) == 1
+
+logger.info(f'Play queue sessions: {navidrome_max_sessions}, idle timeout: {navidrome_session_idle_timeout}s, '
+            f'data directory: {navidrome_data_dir}, per user: {navidrome_queue_per_user}, '
+            f'snapshot interval: {navidrome_snapshot_interval}s')
+
+logger.info(f'HTTP connection pool size: {navidrome_http_pool_size}, connect timeout: {navidrome_http_connect_timeout}s, '
+            f'read timeout: {navidrome_http_read_timeout}s')
+
 logger.debug('Configuration has been successfully loaded')
 
 # Set log level based on config value
@@ -175,26 +335,22 @@ if 'NAVI_DEBUG' in os.environ:
         logger.setLevel(logging.WARNING)
         logger.warning('Log level set to WARNING')
 
-# Create a shareable queue than can be updated by multiple threads to enable larger playlists
-# to be returned in the back ground avoiding the Amazon 8 second timeout
-BaseManager.register('MediaQueue', queue.MediaQueue)
-manager = BaseManager()
-manager.start()
-play_queue = manager.MediaQueue()
-logger.debug('MediaQueue object created...')
-
-# Variable to store the additional thread used to populate large playlists
-# this is used to avoid concurrency issues if there is an attempt to load multiple playlists
-# at the same time.
-backgroundProcess = None
+# Connect to Navidrome, connections are kept open and reused between requests
+http_transport = transport.PooledHTTPTransport(navidrome_http_pool_size,
+                                               navidrome_http_connect_timeout,
+                                               navidrome_http_read_timeout)
 
-# Connect to Navidrome
 connection = api.SubsonicConnection(navidrome_url,
                                     navidrome_user,
                                     navidrome_passwd,
                                     navidrome_port,
                                     navidrome_api_location,
-                                    navidrome_api_version)
+                                    navidrome_api_version,
+                                    navidrome_max_concurrency,
+                                    http_transport,
+                                    navidrome_search_cache_size,
+                                    navidrome_search_cache_ttl,
+                                    navidrome_api_key)
 
 try:
     connection.ping()
@@ -202,6 +358,154 @@ try:
 except:
     raise RuntimeError('Could not connect to SubSonic API!')
 
+# Create queues than can be updated by multiple threads to enable larger playlists
+# to be returned in the back ground avoiding the Amazon 8 second timeout.
+# Songs are held as dictionaries and only turned into Track objects shortly before they are played.
+if navidrome_queue_backend == 'manager':
+    # Share the queues through a separate process, every call is sent to the manager
+    BaseManager.register('MediaQueue', queue.MediaQueue)
+    manager = BaseManager()
+    manager.start()
+    queue_factory = manager.MediaQueue
+else:
+    # The queues are locked internally and shared by the threads of this process
+    queue_factory = queue.MediaQueue
+
+# Populate large playlists in the background, a new request cancels the loading of the previous one
+queue_loader = loader.QueueLoader()
+queue_loader.start()
+
+# Play queues are saved to a journal in the data directory and restored when a device
+# next makes a request, so playback can be resumed after a restart
+if navidrome_data_dir:
+    queue_store = snapshots.SnapshotStore(os.path.join(navidrome_data_dir, 'queues.jsonl'))
+else:
+    queue_store = None
+
+
+def create_play_queue(key: str) -> queue.MediaQueue:
+    """Create the play queue of a session
+
+    Played tracks which do not fit in the history are kept in a log in the
+    data directory, when it is set.
+
+    :param str key: The session key
+    :return: An empty play queue
+    :rtype: MediaQueue
+    """
+
+    if navidrome_data_dir:
+        history_log = history.log_path(os.path.join(navidrome_data_dir, 'history'), key)
+    else:
+        history_log = None
+
+    return queue_factory(controller.create_track, navidrome_hydration_window, navidrome_history_size, history_log)
+
+
+def start_song_list(play_queue: queue.MediaQueue, song_list: list, session: str, description: str) -> queue.Track:
+    """Replace a play queue with a list of songs
+
+    The first song becomes the current track.  Further songs are added in
+    batches while less than half of the time left to respond when the call
+    started has been used, the rest are added by the queue loader in the
+    background.  Without a deadline, for example outside a Flask request,
+    only the first song is added now.
+
+    :param MediaQueue play_queue: The play queue to replace
+    :param list song_list: A list of song dictionaries, at least one song long
+    :param str session: The session key of the queue, used to cancel the background loading
+    :param str description: A description of the request used in logs
+    :return: The first track, now the current track of the queue
+    :rtype: Track
+    """
+
+    track_details = controller.replace_queue(play_queue, song_list[:1])
+    position = 1
+
+    request_deadline = deadline.current()
+
+    if request_deadline is not None:
+        # Keep half of the time left to build the response and absorb a slow queue
+        keep = request_deadline.remaining() / 2
+
+        while position < len(song_list) and request_deadline.remaining() > keep:
+            controller.enqueue_song_references(play_queue, song_list[position:position + queue_loader.batch_size])
+            position += queue_loader.batch_size
+
+    if position < len(song_list):
+        logger.debug(f'Added {position} of {len(song_list)} songs, loading the rest in the background')
+        queue_loader.load(play_queue, song_list[position:], session, description=description)
+
+    return track_details
+
+
+def shuffle_songs(song_list: list) -> list:
+    """Shuffle a list of song dictionaries
+
+    Songs by the same artist and from the same album are kept apart when smart
+    shuffle is enabled.
+
+    :param list song_list: A list of song dictionaries
+    :return: The shuffled songs
+    :rtype: list
+    """
+
+    if navidrome_smart_shuffle:
+        return smart_shuffle.smart_shuffle(song_list)
+
+    random.shuffle(song_list)
+
+    return song_list
+
+
+# Each device has its own play queue, loading is cancelled when a queue is evicted from memory
+play_queues = sessions.QueueSessions(create_play_queue,
+                                     navidrome_max_sessions,
+                                     navidrome_session_idle_timeout,
+                                     queue_store,
+                                     navidrome_queue_per_user,
+                                     queue_loader.cancel,
+                                     navidrome_snapshot_interval)
+play_queues.start()
+atexit.register(play_queues.stop)
+logger.debug('QueueSessions object created...')
+
+# Responses enqueuing the next track of each device, prepared when a track starts playing so that
+# PlaybackNearlyFinished can be answered without signing a URI or building the directive
+prepared_responses = cache.TTLCache(2 * navidrome_max_sessions, navidrome_session_idle_timeout or 3600)
+
+# Plays are saved to a spool and scrobbled in batches by a background thread, waiting plays are
+# sent on shutdown and kept in the data directory if the media server cannot be reached
+if navidrome_data_dir:
+    scrobble_spool = scrobbles.ScrobbleSpool(connection, os.path.join(navidrome_data_dir, 'scrobbles.sqlite3'))
+else:
+    scrobble_spool = scrobbles.ScrobbleSpool(connection)
+
+scrobble_spool.start()
+atexit.register(scrobble_spool.stop)
+
+# Names are resolved using the local catalog when it is enabled, otherwise the media server is searched.
+# The catalog passes lookups to the media server until it has been synchronised.
+if navidrome_catalog_enabled:
+    library = catalog.LibraryCatalog(connection)
+    library.start()
+else:
+    library = connection
+
+# Playlists are found by name and their entries reused without listing them on the media server for each request
+playlist_directory = playlists.PlaylistDirectory(connection, navidrome_playlist_cache_ttl, navidrome_playlist_cache_size)
+
+# Keep local views of the library up to date by fetching only what has changed on the media server
+sync_targets = [playlist_directory]
+
+if navidrome_catalog_enabled:
+    sync_targets.append(library)
+
+library_sync = sync.SyncScheduler(sync_targets, navidrome_sync_interval)
+
+if navidrome_sync_interval > 0:
+    library_sync.start()
+
 logger.info('AskNavidrome Web Service is ready to start!')
 
 
@@ -295,20 +599,20 @@ class NaviSonicPlayMusicByArtist(AbstractRequestHandler):
         return is_intent_name('NaviSonicPlayMusicByArtist')(handler_input)
 
     def handle(self, handler_input: HandlerInput) -> Response:
-        global backgroundProcess
         logger.debug('In NaviSonicPlayMusicByArtist')
 
-        # Check if a background process is already running, if it is then terminate the process
-        # in favour of the new process.
-        if backgroundProcess is not None:
-            backgroundProcess.terminate()
-            backgroundProcess.join()
+        # Each device has its own play queue
+        session = play_queues.key_for(handler_input)
+        play_queue = play_queues.get(session)
+
+        # Stop loading the previous request's songs before the queue is replaced
+        queue_loader.cancel(session)
 
         # Get the requested artist
         artist = get_slot_value_v2(handler_input, 'artist')
 
         # Search for an artist
-        artist_lookup = connection.search_artist(artist.value)
+        artist_lookup = library.search_artist(artist.value)
 
         if artist_lookup is None:
             text = sanitise_speech_output(f"I couldn't find the artist {artist.value} in the collection.")
@@ -318,15 +622,14 @@ class NaviSonicPlayMusicByArtist(AbstractRequestHandler):
 
         else:
             # Get a list of albums by the artist
-            artist_album_lookup = connection.albums_by_artist(artist_lookup[0].get('id'))
+            artist_album_lookup = library.albums_by_artist(artist_lookup[0].get('id'))
 
             # Build a list of songs to play
-            song_id_list = connection.build_song_list_from_albums(artist_album_lookup, min_song_count)
-            play_queue.clear()
+            song_list = library.build_song_list_from_albums(artist_album_lookup, min_song_count)
+            random.shuffle(song_list)
 
-            controller.enqueue_songs(connection, play_queue, [song_id_list[0], song_id_list[1]])  # When generating the playlist return the first two tracks.
-            backgroundProcess = Process(target=queue_worker_thread, args=(connection, play_queue, song_id_list[2:]))  # Create a thread to enqueue the remaining tracks
-            backgroundProcess.start()  # Start the additional thread
+            # Songs are added for as long as the response budget allows, the rest in the background
+            track_details = start_song_list(play_queue, song_list, session, get_intent_name(handler_input))
 
             speech = sanitise_speech_output(f'Playing music by: {artist.value}')
             logger.info(speech)
@@ -335,9 +638,7 @@ class NaviSonicPlayMusicByArtist(AbstractRequestHandler):
                     'text': speech
                     }
 
-            play_queue.shuffle()
-            track_details = play_queue.get_next_track()
-            return controller.start_playback('play', speech, card, track_details, handler_input)
+            return controller.start_playback('play', speech, card, track_details, handler_input, connection.signer)
 
 
 class NaviSonicPlayAlbumByArtist(AbstractRequestHandler):
@@ -350,14 +651,14 @@ class NaviSonicPlayAlbumByArtist(AbstractRequestHandler):
         return is_intent_name('NaviSonicPlayAlbumByArtist')(handler_input)
 
     def handle(self, handler_input: HandlerInput) -> Response:
-        global backgroundProcess
         logger.debug('In NaviSonicPlayAlbumByArtist')
 
-        # Check if a background process is already running, if it is then terminate the process
-        # in favour of the new process.
-        if backgroundProcess is not None:
-            backgroundProcess.terminate()
-            backgroundProcess.join()
+        # Each device has its own play queue
+        session = play_queues.key_for(handler_input)
+        play_queue = play_queues.get(session)
+
+        # Stop loading the previous request's songs before the queue is replaced
+        queue_loader.cancel(session)
 
         # Get variables from intent
         artist = get_slot_value_v2(handler_input, 'artist')
@@ -368,7 +669,7 @@ class NaviSonicPlayAlbumByArtist(AbstractRequestHandler):
             logger.debug(f'Searching for the album {album.value} by {artist.value}')
 
             # Search for an artist
-            artist_lookup = connection.search_artist(artist.value)
+            artist_lookup = library.search_artist(artist.value)
 
             if artist_lookup is None:
                 text = sanitise_speech_output(f"I couldn't find the artist {artist.value} in the collection.")
@@ -377,41 +678,37 @@ class NaviSonicPlayAlbumByArtist(AbstractRequestHandler):
                 return handler_input.response_builder.response
 
             else:
-                artist_album_lookup = connection.albums_by_artist(artist_lookup[0].get('id'))
+                artist_album_lookup = library.albums_by_artist(artist_lookup[0].get('id'))
 
-                # Search the list of dictionaries for the requested album
-                # Strings are all converted to lower case to minimise matching errors
-                result = [album_result for album_result in artist_album_lookup if album_result.get('name').lower() == album.value.lower()]
+                # Search the list of dictionaries for the requested album, the closest
+                # name is used to allow for differences in how Alexa transcribes the name
+                match = fuzzy.best_match(album.value, artist_album_lookup, lambda album_result: album_result.get('name'))
 
-                if not result:
+                if match is None:
                     text = sanitise_speech_output(f"I couldn't find an album called {album.value} by {artist.value} in the collection.")
                     handler_input.response_builder.speak(text).ask(text)
 
                     return handler_input.response_builder.response
 
                 # At this point we have found an album that matches
-                song_id_list = connection.build_song_list_from_albums(result, -1)
-                play_queue.clear()
+                song_list = library.build_song_list_from_albums([match], -1)
 
-                # Work around the Amazon / Alexa 8 second timeout.
-                controller.enqueue_songs(connection, play_queue, [song_id_list[0], song_id_list[1]])  # When generating the playlist return the first two tracks.
-                backgroundProcess = Process(target=queue_worker_thread, args=(connection, play_queue, song_id_list[2:]))  # Create a thread to enqueue the remaining tracks
-                backgroundProcess.start()  # Start the additional thread
+                # Songs are added for as long as the response budget allows, the rest in the background
+                track_details = start_song_list(play_queue, song_list, session, get_intent_name(handler_input))
 
                 speech = sanitise_speech_output(f'Playing {album.value} by: {artist.value}')
                 logger.info(speech)
                 card = {'title': 'AskNavidrome',
                         'text': speech
                         }
-                track_details = play_queue.get_next_track()
 
-                return controller.start_playback('play', speech, card, track_details, handler_input)
+                return controller.start_playback('play', speech, card, track_details, handler_input, connection.signer)
 
         elif artist is None and album:
             # Play album method
             logger.debug(f'Searching for the album {album.value}')
 
-            result = connection.search_album(album.value)
+            result = library.search_album(album.value)
 
             if result is None:
                 text = sanitise_speech_output(f"I couldn't find the album {album.value} in the collection.")
@@ -420,22 +717,18 @@ class NaviSonicPlayAlbumByArtist(AbstractRequestHandler):
                 return handler_input.response_builder.response
 
             else:
-                song_id_list = connection.build_song_list_from_albums(result, -1)
-                play_queue.clear()
+                song_list = library.build_song_list_from_albums(result, -1)
 
-                # Work around the Amazon / Alexa 8 second timeout.
-                controller.enqueue_songs(connection, play_queue, [song_id_list[0], song_id_list[1]])  # When generating the playlist return the first two tracks.
-                backgroundProcess = Process(target=queue_worker_thread, args=(connection, play_queue, song_id_list[2:]))  # Create a thread to enqueue the remaining tracks
-                backgroundProcess.start()  # Start the additional thread
+                # Songs are added for as long as the response budget allows, the rest in the background
+                track_details = start_song_list(play_queue, song_list, session, get_intent_name(handler_input))
 
                 speech = sanitise_speech_output(f'Playing {album.value}')
                 logger.info(speech)
                 card = {'title': 'AskNavidrome',
                         'text': speech
                         }
-                track_details = play_queue.get_next_track()
 
-                return controller.start_playback('play', speech, card, track_details, handler_input)
+                return controller.start_playback('play', speech, card, track_details, handler_input, connection.signer)
 
 
 class NaviSonicPlaySongByArtist(AbstractRequestHandler):
@@ -451,6 +744,10 @@ class NaviSonicPlaySongByArtist(AbstractRequestHandler):
     def handle(self, handler_input: HandlerInput) -> Response:
         logger.debug('In NaviSonicPlaySongByArtist')
 
+        # Each device has its own play queue
+        session = play_queues.key_for(handler_input)
+        play_queue = play_queues.get(session)
+
         # Get variables from intent
         artist = get_slot_value_v2(handler_input, 'artist')
         song = get_slot_value_v2(handler_input, 'song')
@@ -458,7 +755,7 @@ class NaviSonicPlaySongByArtist(AbstractRequestHandler):
         logger.debug(f'Searching for the song {song.value} by {artist.value}')
 
         # Search for the artist
-        artist_lookup = connection.search_artist(artist.value)
+        artist_lookup = library.search_artist(artist.value)
 
         if artist_lookup is None:
             text = sanitise_speech_output(f"I couldn't find the artist {artist.value} in the collection.")
@@ -470,10 +767,10 @@ class NaviSonicPlaySongByArtist(AbstractRequestHandler):
             artist_id = artist_lookup[0].get('id')
 
             # Search for song
-            song_list = connection.search_song(song.value)
+            song_list = library.search_song(song.value) or []
 
             # Search for song by given artist.
-            song_dets = [item.get('id') for item in song_list if item.get('artistId') == artist_id]
+            song_dets = [item for item in song_list if item.get('artistId') == artist_id]
 
             if not song_dets:
                 text = sanitise_speech_output(f"I couldn't find a song called {song.value} by {artist.value} in the collection.")
@@ -481,17 +778,17 @@ class NaviSonicPlaySongByArtist(AbstractRequestHandler):
 
                 return handler_input.response_builder.response
 
-            play_queue.clear()
-            controller.enqueue_songs(connection, play_queue, song_dets)
+            # Stop loading the previous request's songs before the queue is replaced
+            queue_loader.cancel(session)
+            track_details = controller.replace_queue(play_queue, song_dets)
 
             speech = sanitise_speech_output(f'Playing {song.value} by {artist.value}')
             logger.info(speech)
             card = {'title': 'AskNavidrome',
                     'text': speech
                     }
-            track_details = play_queue.get_next_track()
 
-            return controller.start_playback('play', speech, card, track_details, handler_input)
+            return controller.start_playback('play', speech, card, track_details, handler_input, connection.signer)
 
 
 class NaviSonicPlayPlaylist(AbstractRequestHandler):
@@ -504,20 +801,20 @@ class NaviSonicPlayPlaylist(AbstractRequestHandler):
         return is_intent_name('NaviSonicPlayPlaylist')(handler_input)
 
     def handle(self, handler_input: HandlerInput) -> Response:
-        global backgroundProcess
         logger.debug('In NaviSonicPlayPlaylist')
 
-        # Check if a background process is already running, if it is then terminate the process
-        # in favour of the new process.
-        if backgroundProcess is not None:
-            backgroundProcess.terminate()
-            backgroundProcess.join()
+        # Each device has its own play queue
+        session = play_queues.key_for(handler_input)
+        play_queue = play_queues.get(session)
+
+        # Stop loading the previous request's songs before the queue is replaced
+        queue_loader.cancel(session)
 
         # Get the requested playlist
         playlist = get_slot_value_v2(handler_input, 'playlist')
 
         # Search for a playlist
-        playlist_id = connection.search_playlist(playlist.value)
+        playlist_id = playlist_directory.search_playlist(playlist.value)
 
         if playlist_id is None:
             text = sanitise_speech_output("I couldn't find the playlist " + str(playlist.value) + ' in the collection.')
@@ -526,22 +823,18 @@ class NaviSonicPlayPlaylist(AbstractRequestHandler):
             return handler_input.response_builder.response
 
         else:
-            song_id_list = connection.build_song_list_from_playlist(playlist_id)
-            play_queue.clear()
+            song_list = playlist_directory.build_song_list_from_playlist(playlist_id)
 
-            # Work around the Amazon / Alexa 8 second timeout.
-            controller.enqueue_songs(connection, play_queue, [song_id_list[0], song_id_list[1]])  # When generating the playlist return the first two tracks.
-            backgroundProcess = Process(target=queue_worker_thread, args=(connection, play_queue, song_id_list[2:]))  # Create a thread to enqueue the remaining tracks
-            backgroundProcess.start()  # Start the additional thread
+            # Songs are added for as long as the response budget allows, the rest in the background
+            track_details = start_song_list(play_queue, song_list, session, get_intent_name(handler_input))
 
             speech = sanitise_speech_output('Playing playlist ' + str(playlist.value))
             logger.info(speech)
             card = {'title': 'AskNavidrome',
                     'text': speech
                     }
-            track_details = play_queue.get_next_track()
 
-            return controller.start_playback('play', speech, card, track_details, handler_input)
+            return controller.start_playback('play', speech, card, track_details, handler_input, connection.signer)
 
 
 class NaviSonicPlayMusicByGenre(AbstractRequestHandler):
@@ -554,43 +847,39 @@ class NaviSonicPlayMusicByGenre(AbstractRequestHandler):
         return is_intent_name('NaviSonicPlayMusicByGenre')(handler_input)
 
     def handle(self, handler_input: HandlerInput) -> Response:
-        global backgroundProcess
         logger.debug('In NaviSonicPlayMusicByGenre')
 
-        # Check if a background process is already running, if it is then terminate the process
-        # in favour of the new process.
-        if backgroundProcess is not None:
-            backgroundProcess.terminate()
-            backgroundProcess.join()
+        # Each device has its own play queue
+        session = play_queues.key_for(handler_input)
+        play_queue = play_queues.get(session)
+
+        # Stop loading the previous request's songs before the queue is replaced
+        queue_loader.cancel(session)
 
         # Get the requested genre
         genre = get_slot_value_v2(handler_input, 'genre')
 
-        song_id_list = connection.build_song_list_from_genre(genre.value, min_song_count)
+        song_list = library.build_song_list_from_genre(genre.value, min_song_count)
 
-        if song_id_list is None:
+        if song_list is None:
             text = sanitise_speech_output(f"I couldn't find any {genre.value} songs in the collection.")
             handler_input.response_builder.speak(text).ask(text)
 
             return handler_input.response_builder.response
 
         else:
-            random.shuffle(song_id_list)
-            play_queue.clear()
+            song_list = shuffle_songs(song_list)
 
-            # Work around the Amazon / Alexa 8 second timeout.
-            controller.enqueue_songs(connection, play_queue, [song_id_list[0], song_id_list[1]])  # When generating the playlist return the first two tracks.
-            backgroundProcess = Process(target=queue_worker_thread, args=(connection, play_queue, song_id_list[2:]))  # Create a thread to enqueue the remaining tracks
-            backgroundProcess.start()  # Start the additional thread
+            # Songs are added for as long as the response budget allows, the rest in the background
+            track_details = start_song_list(play_queue, song_list, session, get_intent_name(handler_input))
 
             speech = sanitise_speech_output(f'Playing {genre.value} music')
             logger.info(speech)
             card = {'title': 'AskNavidrome',
                     'text': speech
                     }
-            track_details = play_queue.get_next_track()
 
-            return controller.start_playback('play', speech, card, track_details, handler_input)
+            return controller.start_playback('play', speech, card, track_details, handler_input, connection.signer)
 
 
 class NaviSonicPlayMusicRandom(AbstractRequestHandler):
@@ -603,40 +892,36 @@ class NaviSonicPlayMusicRandom(AbstractRequestHandler):
         return is_intent_name('NaviSonicPlayMusicRandom')(handler_input)
 
     def handle(self, handler_input: HandlerInput) -> Response:
-        global backgroundProcess
         logger.debug('In NaviSonicPlayMusicRandom')
 
-        # Check if a background process is already running, if it is then terminate the process
-        # in favour of the new process.
-        if backgroundProcess is not None:
-            backgroundProcess.terminate()
-            backgroundProcess.join()
+        # Each device has its own play queue
+        session = play_queues.key_for(handler_input)
+        play_queue = play_queues.get(session)
 
-        song_id_list = connection.build_random_song_list(min_song_count)
+        # Stop loading the previous request's songs before the queue is replaced
+        queue_loader.cancel(session)
 
-        if song_id_list is None:
+        song_list = connection.build_random_song_list(min_song_count)
+
+        if song_list is None:
             text = sanitise_speech_output("I couldn't find any songs in the collection.")
             handler_input.response_builder.speak(text).ask(text)
 
             return handler_input.response_builder.response
 
         else:
-            random.shuffle(song_id_list)
-            play_queue.clear()
+            song_list = shuffle_songs(song_list)
 
-            # Work around the Amazon / Alexa 8 second timeout.
-            controller.enqueue_songs(connection, play_queue, [song_id_list[0], song_id_list[1]])  # When generating the playlist return the first two tracks.
-            backgroundProcess = Process(target=queue_worker_thread, args=(connection, play_queue, song_id_list[2:]))  # Create a thread to enqueue the remaining tracks
-            backgroundProcess.start()  # Start the additional thread
+            # Songs are added for as long as the response budget allows, the rest in the background
+            track_details = start_song_list(play_queue, song_list, session, get_intent_name(handler_input))
 
             speech = sanitise_speech_output('Playing random music')
             logger.info(speech)
             card = {'title': 'AskNavidrome',
                     'text': speech
                     }
-            track_details = play_queue.get_next_track()
 
-            return controller.start_playback('play', speech, card, track_details, handler_input)
+            return controller.start_playback('play', speech, card, track_details, handler_input, connection.signer)
 
 
 class NaviSonicPlayFavouriteSongs(AbstractRequestHandler):
@@ -649,40 +934,36 @@ class NaviSonicPlayFavouriteSongs(AbstractRequestHandler):
         return is_intent_name('NaviSonicPlayFavouriteSongs')(handler_input)
 
     def handle(self, handler_input: HandlerInput) -> Response:
-        global backgroundProcess
         logger.debug('In NaviSonicPlayFavouriteSongs')
 
-        # Check if a background process is already running, if it is then terminate the process
-        # in favour of the new process.
-        if backgroundProcess is not None:
-            backgroundProcess.terminate()
-            backgroundProcess.join()
+        # Each device has its own play queue
+        session = play_queues.key_for(handler_input)
+        play_queue = play_queues.get(session)
 
-        song_id_list = connection.build_song_list_from_favourites()
+        # Stop loading the previous request's songs before the queue is replaced
+        queue_loader.cancel(session)
 
-        if song_id_list is None:
+        song_list = connection.build_song_list_from_favourites()
+
+        if song_list is None:
             text = sanitise_speech_output("You don't have any favourite songs in the collection.")
             handler_input.response_builder.speak(text).ask(text)
 
             return handler_input.response_builder.response
 
         else:
-            random.shuffle(song_id_list)
-            play_queue.clear()
+            song_list = shuffle_songs(song_list)
 
-            # Work around the Amazon / Alexa 8 second timeout.
-            controller.enqueue_songs(connection, play_queue, [song_id_list[0], song_id_list[1]])  # When generating the playlist return the first two tracks.
-            backgroundProcess = Process(target=queue_worker_thread, args=(connection, play_queue, song_id_list[2:]))  # Create a thread to enqueue the remaining tracks
-            backgroundProcess.start()  # Start the additional thread
+            # Songs are added for as long as the response budget allows, the rest in the background
+            track_details = start_song_list(play_queue, song_list, session, get_intent_name(handler_input))
 
             speech = sanitise_speech_output('Playing your favourite tracks.')
             logger.info(speech)
             card = {'title': 'AskNavidrome',
                     'text': speech
                     }
-            track_details = play_queue.get_next_track()
 
-            return controller.start_playback('play', speech, card, track_details, handler_input)
+            return controller.start_playback('play', speech, card, track_details, handler_input, connection.signer)
 
 
 class NaviSonicRandomiseQueue(AbstractRequestHandler):
@@ -697,12 +978,142 @@ class NaviSonicRandomiseQueue(AbstractRequestHandler):
     def handle(self, handler_input: HandlerInput) -> Response:
         logger.debug('In NaviSonicRandomiseQueue Handler')
 
-        play_queue.shuffle()
+        # Each device has its own play queue
+        play_queue = play_queues.get(play_queues.key_for(handler_input))
+
+        # Tracks still being loaded in the background are shuffled in as they arrive
+        play_queue.shuffle(navidrome_smart_shuffle)
         play_queue.sync()
 
         return handler_input.response_builder.response
 
 
+class NaviSonicPlaySongNext(AbstractRequestHandler):
+    """Handle the NaviSonicPlaySongNext intent
+
+    Play the given song by the given artist after the current track
+    """
+
+    def can_handle(self, handler_input: HandlerInput) -> bool:
+        return is_intent_name('NaviSonicPlaySongNext')(handler_input)
+
+    def handle(self, handler_input: HandlerInput) -> Response:
+        logger.debug('In NaviSonicPlaySongNext')
+
+        # Each device has its own play queue
+        session = play_queues.key_for(handler_input)
+        play_queue = play_queues.get(session)
+
+        # Get variables from intent
+        artist = get_slot_value_v2(handler_input, 'artist')
+        song = get_slot_value_v2(handler_input, 'song')
+
+        logger.debug(f'Searching for the song {song.value} by {artist.value}')
+
+        # Search for the artist
+        artist_lookup = library.search_artist(artist.value)
+
+        if artist_lookup is None:
+            text = sanitise_speech_output(f"I couldn't find the artist {artist.value} in the collection.")
+            handler_input.response_builder.speak(text).ask(text)
+
+            return handler_input.response_builder.response
+
+        artist_id = artist_lookup[0].get('id')
+
+        # Search for song by given artist.
+        song_dets = [item for item in library.search_song(song.value) or [] if item.get('artistId') == artist_id]
+
+        if not song_dets:
+            text = sanitise_speech_output(f"I couldn't find a song called {song.value} by {artist.value} in the collection.")
+            handler_input.response_builder.speak(text).ask(text)
+
+            return handler_input.response_builder.response
+
+        current_track = play_queue.get_current_track()
+
+        if not current_track.id:
+            # Nothing is playing, play the song now
+            track_details = controller.replace_queue(play_queue, song_dets[:1])
+            speech = sanitise_speech_output(f'Playing {song.value} by {artist.value}')
+
+            return controller.start_playback('play', speech, None, track_details, handler_input, connection.signer)
+
+        # Add the song after the current track and replace the track Alexa has already enqueued
+        play_queue.insert_tracks(0, [controller.create_track(song_dets[0])])
+        track_details = play_queue.enqueue_after(current_track.id)
+
+        speech = sanitise_speech_output(f'Playing {song.value} by {artist.value} next')
+        logger.info(speech)
+
+        return controller.start_playback('next', speech, None, track_details, handler_input, connection.signer)
+
+
+class NaviSonicQueueAlbum(AbstractRequestHandler):
+    """Handle the NaviSonicQueueAlbum intent
+
+    Add the given album to the end of the play queue
+    """
+
+    def can_handle(self, handler_input: HandlerInput) -> bool:
+        return is_intent_name('NaviSonicQueueAlbum')(handler_input)
+
+    def handle(self, handler_input: HandlerInput) -> Response:
+        logger.debug('In NaviSonicQueueAlbum')
+
+        # Each device has its own play queue
+        session = play_queues.key_for(handler_input)
+        play_queue = play_queues.get(session)
+
+        # Get variables from intent
+        artist = get_slot_value_v2(handler_input, 'artist')
+        album = get_slot_value_v2(handler_input, 'album')
+
+        if artist is not None:
+            logger.debug(f'Searching for the album {album.value} by {artist.value}')
+
+            artist_lookup = library.search_artist(artist.value)
+
+            if artist_lookup is None:
+                result = None
+            else:
+                # The closest name is used to allow for differences in how Alexa transcribes the name
+                artist_album_lookup = library.albums_by_artist(artist_lookup[0].get('id'))
+                match = fuzzy.best_match(album.value, artist_album_lookup, lambda album_result: album_result.get('name'))
+                result = [match] if match is not None else None
+
+        else:
+            logger.debug(f'Searching for the album {album.value}')
+
+            result = library.search_album(album.value)
+
+        if result is None:
+            text = sanitise_speech_output(f"I couldn't find the album {album.value} in the collection.")
+            handler_input.response_builder.speak(text).ask(text)
+
+            return handler_input.response_builder.response
+
+        song_list = library.build_song_list_from_albums(result, -1)
+
+        if not play_queue.get_current_track().id:
+            # Nothing is playing, play the album now
+            queue_loader.cancel(session)
+            track_details = start_song_list(play_queue, song_list, session, get_intent_name(handler_input))
+
+            speech = sanitise_speech_output(f'Playing {album.value}')
+
+            return controller.start_playback('play', speech, None, track_details, handler_input, connection.signer)
+
+        # The songs are added in a single call, they are hydrated when they are reached
+        controller.enqueue_song_references(play_queue, song_list)
+
+        speech = sanitise_speech_output(f'Added {album.value} to the queue')
+        logger.info(speech)
+        handler_input.response_builder.speak(speech).set_should_end_session(True)
+
+        return handler_input.response_builder.response
+
+
 class NaviSonicSongDetails(AbstractRequestHandler):
     """Handle NaviSonicSongDetails Intent
 
@@ -715,6 +1126,9 @@ class NaviSonicSongDetails(AbstractRequestHandler):
     def handle(self, handler_input: HandlerInput) -> Response:
         logger.debug('In NaviSonicSongDetails Handler')
 
+        # Each device has its own play queue
+        play_queue = play_queues.get(play_queues.key_for(handler_input))
+
         current_track = play_queue.get_current_track()
 
         title = sanitise_speech_output(current_track.title)
@@ -739,6 +1153,9 @@ class NaviSonicStarSong(AbstractRequestHandler):
     def handle(self, handler_input: HandlerInput) -> Response:
         logger.debug('In NaviSonicStarSong Handler')
 
+        # Each device has its own play queue
+        play_queue = play_queues.get(play_queues.key_for(handler_input))
+
         current_track = play_queue.get_current_track()
 
         song_id = current_track.id
@@ -759,6 +1176,9 @@ class NaviSonicUnstarSong(AbstractRequestHandler):
     def handle(self, handler_input: HandlerInput) -> Response:
         logger.debug('In NaviSonicUnstarSong Handler')
 
+        # Each device has its own play queue
+        play_queue = play_queues.get(play_queues.key_for(handler_input))
+
         current_track = play_queue.get_current_track()
 
         song_id = current_track.id
@@ -786,6 +1206,24 @@ class PlaybackStartedHandler(AbstractRequestHandler):
         logger.debug('In PlaybackStartedHandler')
         logger.info('Playback started')
 
+        # Each device has its own play queue
+        session = play_queues.key_for(handler_input)
+        play_queue = play_queues.get(session)
+
+        # Move the queue to the track Alexa started, in case an earlier event was missed
+        token = handler_input.request_envelope.request.token
+        play_queue.reconcile(token)
+
+        # Prepare the tracks that will be played next
+        play_queue.hydrate()
+
+        # Prepare the response to the PlaybackNearlyFinished request of this track
+        next_track = play_queue.peek_after(token)
+
+        if next_track is not None:
+            prepared_responses.set((session, next_track.id, next_track.previous_id),
+                                   controller.prepare_enqueue(next_track, connection.signer))
+
         return handler_input.response_builder.response
 
 
@@ -802,11 +1240,22 @@ class PlaybackStoppedHandler(AbstractRequestHandler):
     def handle(self, handler_input: HandlerInput) -> Response:
         logger.debug('In PlaybackStoppedHandler')
 
-        # store the current offset for later resumption
-        play_queue.set_current_track_offset(handler_input.request_envelope.request.offset_in_milliseconds)
+        # Each device has its own play queue
+        play_queue = play_queues.get(play_queues.key_for(handler_input))
 
+        token = handler_input.request_envelope.request.token
         current_track = play_queue.get_current_track()
-        logger.debug(f'Stored track offset of: {current_track.offset} ms for {current_track.title}')
+
+        # Only store the offset against the track which was playing, after a Previous intent
+        # the stopped track has already been returned to the queue
+        if token == current_track.id:
+            # store the current offset for later resumption
+            play_queue.set_current_track_offset(handler_input.request_envelope.request.offset_in_milliseconds)
+            logger.debug(f'Stored track offset of: {handler_input.request_envelope.request.offset_in_milliseconds} ms '
+                         f'for {current_track.title}')
+        else:
+            logger.debug(f'Stopped track {token} is not the current track')
+
         logger.info('Playback stopped')
 
         return handler_input.response_builder.response
@@ -823,10 +1272,26 @@ class PlaybackNearlyFinishedHandler(AbstractRequestHandler):
 
     def handle(self, handler_input: HandlerInput) -> Response:
         logger.debug('In PlaybackNearlyFinishedHandler')
+
+        # Each device has its own play queue
+        session = play_queues.key_for(handler_input)
+        play_queue = play_queues.get(session)
+
+        # Enqueue the track after the one which is playing, a repeated event enqueues the same track again
         logger.info('Queuing next track...')
-        track_details = play_queue.enqueue_next_track()
+        track_details = play_queue.enqueue_after(handler_input.request_envelope.request.token)
+
+        # Use the response prepared when the track started, if the queue has not changed since
+        response = prepared_responses.get((session, track_details.id, track_details.previous_id))
+
+        if response is not None:
+            logger.info(f'Enqueuing prepared track: {track_details.title} by: {track_details.artist}')
 
-        return controller.start_playback('continue', None, None, track_details, handler_input)
+            return response
+
+        play_queue.hydrate()
+
+        return controller.start_playback('continue', None, None, track_details, handler_input, connection.signer)
 
 
 class PlaybackFinishedHandler(AbstractRequestHandler):
@@ -842,11 +1307,22 @@ class PlaybackFinishedHandler(AbstractRequestHandler):
     def handle(self, handler_input: HandlerInput) -> Response:
         logger.debug('In PlaybackFinishedHandler')
 
-        # Generate a timestamp in milliseconds for scrobbling
-        timestamp_ms = datetime.now().timestamp()
+        # Each device has its own play queue
+        play_queue = play_queues.get(play_queues.key_for(handler_input))
+
+        # Generate a timestamp in seconds for scrobbling, the scrobble request sends it in milliseconds
+        timestamp = datetime.now().timestamp()
+        token = handler_input.request_envelope.request.token
         current_track = play_queue.get_current_track()
-        connection.scrobble(current_track.id, timestamp_ms)
-        play_queue.get_next_track()
+
+        # Plays are scrobbled in the background so the response does not wait for the media server
+        if token is None or token == current_track.id:
+            scrobble_spool.record(current_track.id, timestamp)
+            play_queue.get_next_track()
+        else:
+            # The queue has already moved on, for example after a Next intent
+            logger.debug(f'Finished track {token} is not the current track')
+            scrobble_spool.record(token, timestamp)
 
         return handler_input.response_builder.response
 
@@ -864,6 +1340,10 @@ class PausePlaybackHandler(AbstractRequestHandler):
 
     def handle(self, handler_input: HandlerInput) -> Response:
         logger.debug('In PausePlaybackHandler')
+
+        # Each device has its own play queue
+        play_queue = play_queues.get(play_queues.key_for(handler_input))
+
         play_queue.sync()
 
         return controller.stop(handler_input)
@@ -882,6 +1362,9 @@ class ResumePlaybackHandler(AbstractRequestHandler):
     def handle(self, handler_input: HandlerInput) -> Response:
         logger.debug('In ResumePlaybackHandler')
 
+        # Each device has its own play queue
+        play_queue = play_queues.get(play_queues.key_for(handler_input))
+
         current_track = play_queue.get_current_track()
 
         if current_track.offset > 0:
@@ -889,14 +1372,14 @@ class ResumePlaybackHandler(AbstractRequestHandler):
             logger.info('Resuming ' + str(current_track.title))
             logger.info('Offset ' + str(current_track.offset))
 
-            return controller.start_playback('play', None, None, current_track, handler_input)
+            return controller.start_playback('play', None, None, current_track, handler_input, connection.signer)
 
         elif play_queue.get_queue_count() > 0 and current_track.offset == 0:
             # No paused tracks but tracks in queue
             logger.info('Resuming - There was no paused track, getting next track from queue')
             track_details = play_queue.get_next_track()
 
-            return controller.start_playback('play', None, None, track_details, handler_input)
+            return controller.start_playback('play', None, None, track_details, handler_input, connection.signer)
 
 
 class NextPlaybackHandler(AbstractRequestHandler):
@@ -909,12 +1392,15 @@ class NextPlaybackHandler(AbstractRequestHandler):
     def handle(self, handler_input: HandlerInput) -> Response:
         logger.debug('In NextPlaybackHandler')
 
+        # Each device has its own play queue
+        play_queue = play_queues.get(play_queues.key_for(handler_input))
+
         track_details = play_queue.get_next_track()
 
         # Set the offset to 0 as we are skipping we want to start at the beginning
         track_details.offset = 0
 
-        return controller.start_playback('play', None, None, track_details, handler_input)
+        return controller.start_playback('play', None, None, track_details, handler_input, connection.signer)
 
 
 class PreviousPlaybackHandler(AbstractRequestHandler):
@@ -926,12 +1412,15 @@ class PreviousPlaybackHandler(AbstractRequestHandler):
 
     def handle(self, handler_input: HandlerInput) -> Response:
         logger.debug('In PreviousPlaybackHandler')
+
+        # Each device has its own play queue
+        play_queue = play_queues.get(play_queues.key_for(handler_input))
         track_details = play_queue.get_previous_track()
 
         # Set the offset to 0 as we are skipping we want to start at the beginning
         track_details.offset = 0
 
-        return controller.start_playback('play', None, None, track_details, handler_input)
+        return controller.start_playback('play', None, None, track_details, handler_input, connection.signer)
 
 
 class PlaybackFailedEventHandler(AbstractRequestHandler):
@@ -946,20 +1435,24 @@ class PlaybackFailedEventHandler(AbstractRequestHandler):
     def handle(self, handler_input: HandlerInput) -> Response:
         logger.debug('In PlaybackFailedHandler')
 
-        current_track = play_queue.get_current_track()
-        song_id = current_track.id
+        # Each device has its own play queue
+        play_queue = play_queues.get(play_queues.key_for(handler_input))
+
+        # The failed track may be one that was enqueued, not the current track
+        token = handler_input.request_envelope.request.token
+        song_id = token or play_queue.get_current_track().id
 
         # Log failure and track ID
         logger.error(f'Playback Failed: {handler_input.request_envelope.request.error}')
         logger.error(f'Failed playing track with ID: {song_id}')
 
-        # Skip to the next track instead of stopping
-        track_details = play_queue.get_next_track()
+        # Skip to the track after the failed one instead of stopping
+        track_details = play_queue.skip_failed(token)
 
         # Set the offset to 0 as we are skipping we want to start at the beginning
         track_details.offset = 0
 
-        return controller.start_playback('play', None, None, track_details, handler_input)
+        return controller.start_playback('play', None, None, track_details, handler_input, connection.signer)
 
 
 #
@@ -967,6 +1460,37 @@ class PlaybackFailedEventHandler(AbstractRequestHandler):
 #
 
 
+class TimeoutExceptionHandler(AbstractExceptionHandler):
+    """Handle requests which ran out of time
+
+    The media server did not respond before the deadline of the request,
+    answer before Alexa gives up instead of failing silently.
+    """
+
+    def can_handle(self, handler_input: HandlerInput, exception: Exception) -> bool:
+        return isinstance(exception, TimeoutError)
+
+    def handle(self, handler_input: HandlerInput, exception: Exception) -> Response:
+        logger.debug('In TimeoutExceptionHandler')
+
+        request_deadline = deadline.current()
+
+        logger.error(f'Timeout Exception: {exception}')
+        logger.error(f'Request Type Was: {get_request_type(handler_input)}')
+
+        if request_deadline is not None:
+            logger.error(f'Time spent on the request: {request_deadline.elapsed():.2f}s')
+
+        if navidrome_catalog_enabled and not library.ready:
+            speech = sanitise_speech_output('Your music library is still loading, please try again in a moment.')
+        else:
+            speech = sanitise_speech_output('Your media server is taking too long to respond, please try again.')
+
+        handler_input.response_builder.speak(speech)
+
+        return handler_input.response_builder.response
+
+
 class SystemExceptionHandler(AbstractExceptionHandler):
     """Handle System.ExceptionEncountered
 
@@ -1082,26 +1606,6 @@ def sanitise_speech_output(speech_string: str) -> str:
     return speech_string
 
 
-def queue_worker_thread(connection: object, play_queue: object, song_id_list: list) -> None:
-    """Media queue worker
-
-    This function allows media queues to be populated in the background enabling multithreading
-    and increasing skill response times.
-
-    :param connection: A SubSonic API connection object
-    :type connection: object
-    :param play_queue: A MediaQueue object
-    :type play_queue: object
-    :param song_id_list: A list containing Navidrome song IDs
-    :type song_id_list: list
-    """
-
-    logger.debug('In playlist processing thread!')
-    controller.enqueue_songs(connection, play_queue, song_id_list)
-    play_queue.sync()
-    logger.debug('Finished playlist processing!')
-
-
 # Register Intent Handlers
 sb.add_request_handler(LaunchRequestHandler())
 sb.add_request_handler(CheckAudioInterfaceHandler())
@@ -1115,6 +1619,8 @@ sb.add_request_handler(NaviSonicPlayFavouriteSongs())
 sb.add_request_handler(NaviSonicPlayMusicByGenre())
 sb.add_request_handler(NaviSonicPlayMusicRandom())
 sb.add_request_handler(NaviSonicRandomiseQueue())
+sb.add_request_handler(NaviSonicPlaySongNext())
+sb.add_request_handler(NaviSonicQueueAlbum())
 sb.add_request_handler(NaviSonicSongDetails())
 sb.add_request_handler(NaviSonicStarSong())
 sb.add_request_handler(NaviSonicUnstarSong())
@@ -1132,6 +1638,7 @@ sb.add_request_handler(PlaybackFailedEventHandler())
 
 
 # Register Exception Handlers
+sb.add_exception_handler(TimeoutExceptionHandler())
 sb.add_exception_handler(SystemExceptionHandler())
 sb.add_exception_handler(GeneralExceptionHandler())
 
@@ -1143,18 +1650,40 @@ if navidrome_log_level >= 2:
 sa = SkillAdapter(skill=sb.create(), skill_id='test', app=app)
 sa.register(app=app, route='/')
 
+
+@app.before_request
+def start_deadline() -> None:
+    """Start the deadline of the request
+
+    Requests to the media server made while the request is handled are
+    limited to the time left in the response budget.
+    """
+
+    deadline.start(navidrome_response_budget)
+
+
+@app.teardown_request
+def finish_deadline(exception: Exception = None) -> None:
+    """Remove the deadline once the request has been handled"""
+
+    deadline.finish()
+
+
 # Enable queue and history diagnostics
 if navidrome_log_level == 3:
     logger.warning('AskNavidrome debugging has been enabled, this should only be used when testing!')
-    logger.warning('The /buffer, /queue and /history http endpoints are available publicly!')
+    logger.warning('The /buffer, /queue, /history and /stats http endpoints are available publicly!')
 
     @app.route('/queue')
     def view_queue():
         """View the contents of play_queue.queue
 
-        Creates a tabulated page containing the contents of the play_queue.queue deque.
+        Creates a tabulated page containing the contents of the play_queue.queue deque
+        of the most recently used device.
         """
 
+        # Show the queue of the device which made the most recent request
+        play_queue = play_queues.latest() or queue.MediaQueue()
         current_track = play_queue.get_current_track()
 
         return render_template('table.html', title='AskNavidrome - Queued Tracks',
@@ -1167,6 +1696,8 @@ if navidrome_log_level == 3:
         Creates a tabulated page containing the contents of the play_queue.history deque.
         """
 
+        # Show the queue of the device which made the most recent request
+        play_queue = play_queues.latest() or queue.MediaQueue()
         current_track = play_queue.get_current_track()
 
         return render_template('table.html', title='AskNavidrome - Track History',
@@ -1174,16 +1705,39 @@ if navidrome_log_level == 3:
 
     @app.route('/buffer')
     def view_buffer():
-        """View the contents of play_queue.buffer
+        """View the buffered tracks
 
-        Creates a tabulated page containing the contents of the play_queue.buffer deque.
+        Creates a tabulated page containing the tracks in play_queue still to be enqueued.
         """
 
+        # Show the queue of the device which made the most recent request
+        play_queue = play_queues.latest() or queue.MediaQueue()
         current_track = play_queue.get_current_track()
 
         return render_template('table.html', title='AskNavidrome - Buffered Tracks',
                                tracks=play_queue.get_buffer(), current=current_track)
 
+    @app.route('/stats')
+    def view_stats():
+        """View cache statistics
+
+        Returns the hit and miss counts of the search, playlist and prepared
+        response caches, the progress of background queue loading, the number
+        of play queue sessions, the scrobble spool and the result of the last
+        library synchronisation as JSON.
+        """
+
+        last_sync = library_sync.last_report
+
+        return {'search_cache': connection.search_cache_stats(),
+                'playlist_cache': playlist_directory.stats(),
+                'loader': queue_loader.progress(),
+                'sessions': play_queues.stats(),
+                'snapshots': queue_store.stats() if queue_store else None,
+                'prepared_responses': prepared_responses.stats(),
+                'scrobbles': scrobble_spool.stats(),
+                'last_sync': str(last_sync) if last_sync else None}
+
 
 # Run web app by default when file is executed.
 if __name__ == '__main__':
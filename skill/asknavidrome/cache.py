@@ -0,0 +1,124 @@
+from collections import OrderedDict
+from typing import Any, Hashable
+import threading
+import time
+
+
+class TTLCache:
+    """A bounded, thread safe cache with expiring entries
+
+    Entries are evicted when they are older than ttl seconds, or when the
+    cache is full, in which case the least recently used entry is removed.
+    Hit and miss counters are kept to help tune the size and TTL.
+    """
+
+    def __init__(self, maxsize: int = 256, ttl: float = 300) -> None:
+        """
+        :param int maxsize: The maximum number of entries to hold. Defaults to 256
+        :param float ttl: The number of seconds an entry is valid for. Defaults to 300
+        :return: None
+        """
+
+        self.maxsize = max(1, int(maxsize))
+        self.ttl = float(ttl)
+
+        self.hits: int = 0
+        """Number of lookups that found a valid entry"""
+
+        self.misses: int = 0
+        """Number of lookups that did not find a valid entry"""
+
+        self.stale_hits: int = 0
+        """Number of fallback lookups that returned an expired entry"""
+
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None, allow_expired: bool = False) -> Any:
+        """Get a value from the cache
+
+        Expired entries are kept until they are replaced or evicted, so that
+        they can still be used when a fresh value cannot be obtained in time.
+        Such a fallback read follows a lookup which has already been counted,
+        so it is not counted as a hit or a miss, only as a stale hit when it
+        returns a value.
+
+        :param Hashable key: The key to look up
+        :param Any default: Returned if the key is not cached or has expired. Defaults to None
+        :param bool allow_expired: Return the value even if it has expired, as a fallback. Defaults to False
+        :return: The cached value or default
+        :rtype: Any
+        """
+
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is not None:
+                expires, value = entry
+
+                if allow_expired or expires > time.monotonic():
+                    # Mark the entry as the most recently used
+                    self._entries.move_to_end(key)
+
+                    if allow_expired:
+                        self.stale_hits += 1
+                    else:
+                        self.hits += 1
+
+                    return value
+
+            if not allow_expired:
+                self.misses += 1
+
+            return default
+
+    def set(self, key: Hashable, value: Any) -> None:
+        """Add a value to the cache
+
+        :param Hashable key: The key to store the value under
+        :param Any value: The value to store
+        :return: None
+        """
+
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.maxsize:
+                # Remove the least recently used entry
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key: Hashable) -> None:
+        """Remove a value from the cache
+
+        :param Hashable key: The key to remove
+        :return: None
+        """
+
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        """Remove all values from the cache
+
+        :return: None
+        """
+
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        """Get cache statistics
+
+        :return: A dictionary containing the size, hits, misses, stale hits and hit ratio of the cache
+        :rtype: dict
+        """
+
+        with self._lock:
+            lookups = self.hits + self.misses
+
+            return {'size': len(self._entries),
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'stale_hits': self.stale_hits,
+                    'hit_ratio': self.hits / lookups if lookups else 0.0}
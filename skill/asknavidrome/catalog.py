@@ -0,0 +1,613 @@
+from typing import Union
+import heapq
+import logging
+import random
+import re
+import sys
+import threading
+import time
+
+from .fuzzy import FuzzyIndex
+from .subsonic_api import SubsonicConnection, normalise_term
+from .sync import SyncReport
+
+
+SONG_KEYS = ('id', 'title', 'artist', 'artistId', 'album', 'albumId', 'track',
+             'discNumber', 'year', 'genre', 'duration', 'bitRate')
+"""Song dictionary keys which are kept in the catalog, these are the keys needed to build a Track"""
+
+INTERNED_KEYS = ('artist', 'artistId', 'album', 'albumId', 'genre')
+"""Song dictionary keys with values that are shared by many songs"""
+
+
+def album_changed(album: dict) -> str:
+    """Get the time an album was last changed
+
+    :param dict album: An album dictionary
+    :return: The changed timestamp of the album, or the created timestamp if the server does not provide one
+    :rtype: str
+    """
+
+    return album.get('changed') or album.get('created') or ''
+
+
+def name_words(name: str) -> 'list[str]':
+    """Split a name into normalised words
+
+    :param str name: An artist, album or song name
+    :return: A list of the words in the name
+    :rtype: list[str]
+    """
+
+    return re.findall(r'\w+', name.casefold())
+
+
+class CatalogIndex:
+    """In memory indexes of the contents of a media server
+
+    Every entity is indexed by its ID, by its normalised name and in a
+    FuzzyIndex, songs are also indexed by album and genre.  Indexes are built once and then only
+    read, a CatalogIndex is replaced as a whole when the catalog is synchronised.  Changes are
+    made to a copy of the index, which then replaces the one being read.
+    """
+
+    def __init__(self) -> None:
+        """
+        :return: None
+        """
+
+        self.artists_by_id: dict = {}
+        self.artists_by_name: dict = {}
+        self.artist_words: dict = {}
+        self.artist_fuzzy = FuzzyIndex()
+
+        self.albums_by_id: dict = {}
+        self.albums_by_name: dict = {}
+        self.album_words: dict = {}
+        self.album_fuzzy = FuzzyIndex()
+        self.albums_by_artist_id: dict = {}
+
+        self.songs_by_id: dict = {}
+        self.songs_by_name: dict = {}
+        self.song_words: dict = {}
+        self.song_fuzzy = FuzzyIndex()
+        self.songs_by_album_id: dict = {}
+        self.songs_by_genre: dict = {}
+
+    def copy(self) -> 'CatalogIndex':
+        """Copy the index so that the copy can be changed while the original is read
+
+        Entity dictionaries are shared, the lists, sets and dictionaries indexing them are copied.
+
+        :return: A new CatalogIndex
+        :rtype: CatalogIndex
+        """
+
+        index = CatalogIndex()
+
+        index.artists_by_id = dict(self.artists_by_id)
+        index.artists_by_name = self._copy_lists(self.artists_by_name)
+        index.artist_words = self._copy_sets(self.artist_words)
+        index.artist_fuzzy = self.artist_fuzzy.copy()
+
+        index.albums_by_id = dict(self.albums_by_id)
+        index.albums_by_name = self._copy_lists(self.albums_by_name)
+        index.album_words = self._copy_sets(self.album_words)
+        index.album_fuzzy = self.album_fuzzy.copy()
+        index.albums_by_artist_id = self._copy_lists(self.albums_by_artist_id)
+
+        index.songs_by_id = dict(self.songs_by_id)
+        index.songs_by_name = self._copy_lists(self.songs_by_name)
+        index.song_words = self._copy_sets(self.song_words)
+        index.song_fuzzy = self.song_fuzzy.copy()
+        index.songs_by_album_id = self._copy_lists(self.songs_by_album_id)
+        index.songs_by_genre = self._copy_lists(self.songs_by_genre)
+
+        return index
+
+    def add_artist(self, artist: dict) -> None:
+        self.artists_by_id[artist.get('id')] = artist
+        self.artist_fuzzy.add(artist.get('name'), artist)
+        self._add_name(self.artists_by_name, self.artist_words, artist.get('name'), artist)
+
+    def add_album(self, album: dict) -> None:
+        self.albums_by_id[album.get('id')] = album
+        self.albums_by_artist_id.setdefault(album.get('artistId'), []).append(album)
+        self.album_fuzzy.add(album.get('name'), album)
+        self._add_name(self.albums_by_name, self.album_words, album.get('name'), album)
+
+    def add_song(self, song: dict) -> None:
+        # Keep only what is needed to build a Track and share repeated strings between songs
+        song = {key: song[key] for key in SONG_KEYS if key in song}
+
+        for key in INTERNED_KEYS:
+            if isinstance(song.get(key), str):
+                song[key] = sys.intern(song[key])
+
+        self.songs_by_id[song['id']] = song
+        self.songs_by_album_id.setdefault(song.get('albumId'), []).append(song)
+
+        if song.get('genre'):
+            self.songs_by_genre.setdefault(normalise_term(song['genre']), []).append(song)
+
+        self.song_fuzzy.add(song.get('title'), song)
+        self._add_name(self.songs_by_name, self.song_words, song.get('title'), song)
+
+    def remove_artist(self, id: str) -> None:
+        artist = self.artists_by_id.pop(id, None)
+
+        if artist is not None:
+            self.artist_fuzzy.remove(artist)
+            self._remove_name(self.artists_by_name, self.artist_words, artist.get('name'), artist)
+
+    def remove_album(self, id: str) -> None:
+        """Remove an album and all of its songs"""
+
+        album = self.albums_by_id.pop(id, None)
+
+        if album is not None:
+            self.album_fuzzy.remove(album)
+            self._remove_item(self.albums_by_artist_id, album.get('artistId'), album)
+            self._remove_name(self.albums_by_name, self.album_words, album.get('name'), album)
+
+        for song in self.songs_by_album_id.pop(id, []):
+            del self.songs_by_id[song['id']]
+            self.song_fuzzy.remove(song)
+
+            if song.get('genre'):
+                self._remove_item(self.songs_by_genre, normalise_term(song['genre']), song)
+
+            self._remove_name(self.songs_by_name, self.song_words, song.get('title'), song)
+
+    def finalise(self, album_ids: Union[list, None] = None) -> None:
+        """Sort album song lists into track order
+
+        :param list album_ids: The albums to sort, if None all albums are sorted. Defaults to None
+        :return: None
+        """
+
+        if album_ids is None:
+            album_ids = list(self.songs_by_album_id)
+
+        for album_id in album_ids:
+            self.songs_by_album_id.get(album_id, []).sort(key=lambda song: (song.get('discNumber') or 0, song.get('track') or 0))
+
+    @staticmethod
+    def _copy_lists(lists: dict) -> dict:
+        return {key: list(items) for key, items in lists.items()}
+
+    @staticmethod
+    def _copy_sets(sets: dict) -> dict:
+        return {key: set(items) for key, items in sets.items()}
+
+    @staticmethod
+    def _add_name(by_name: dict, words: dict, name: Union[str, None], entity: dict) -> None:
+        if not name:
+            return
+
+        name = sys.intern(normalise_term(name))
+        by_name.setdefault(name, []).append(entity)
+
+        for word in set(name_words(name)):
+            words.setdefault(sys.intern(word), set()).add(name)
+
+    @staticmethod
+    def _remove_name(by_name: dict, words: dict, name: Union[str, None], entity: dict) -> None:
+        if not name:
+            return
+
+        name = normalise_term(name)
+
+        if not CatalogIndex._remove_item(by_name, name, entity):
+            # Other entities still have this name
+            return
+
+        for word in set(name_words(name)):
+            names = words.get(word)
+
+            if names is not None:
+                names.discard(name)
+
+                if not names:
+                    del words[word]
+
+    @staticmethod
+    def _remove_item(lists: dict, key: str, item: dict) -> bool:
+        """Remove an item from a dictionary of lists
+
+        :return: True if the list for key is now empty and has been removed
+        :rtype: bool
+        """
+
+        items = lists.get(key)
+
+        if items is None:
+            return False
+
+        # Compare identity, entities with the same content are still different entries
+        items[:] = [existing for existing in items if existing is not item]
+
+        if not items:
+            del lists[key]
+
+            return True
+
+        return False
+
+
+class LibraryCatalog:
+    """Local catalog of the media server's library
+
+    Synchronises artists, albums and songs into a CatalogIndex so that voice
+    intents can be resolved without calling the media server.  Playlists are
+    held by a PlaylistDirectory.
+    The lookup methods have the same names and return the same data as the
+    SubsonicConnection methods they replace, until the first synchronisation
+    has completed the calls are passed to the SubsonicConnection.
+    """
+
+    def __init__(self, connection: SubsonicConnection, page_size: int = 500) -> None:
+        """
+        :param SubsonicConnection connection: The connection used to synchronise the catalog
+        :param int page_size: The number of albums or songs requested at a time. Defaults to 500
+        :return: None
+        """
+
+        self.logger = logging.getLogger(__name__)
+
+        self.connection = connection
+        self.page_size = page_size
+
+        self.index: CatalogIndex = CatalogIndex()
+        """The current catalog index"""
+
+        self.ready: bool = False
+        """True once the catalog has been synchronised"""
+
+        self.last_sync: float = 0
+        """UNIX timestamp of the last completed synchronisation"""
+
+        self.indexes_modified: float = 0
+        """The lastModified time of the artist indexes when the catalog was last synchronised"""
+
+        self._sync_lock = threading.Lock()
+
+    #
+    # Synchronisation
+    #
+
+    def sync(self) -> None:
+        """Synchronise the whole library
+
+        Builds a new index from the media server and replaces the current one.
+
+        :return: None
+        """
+
+        self.logger.debug('In sync()')
+
+        with self._sync_lock:
+            started = time.monotonic()
+            index = CatalogIndex()
+
+            # Record the change markers first so that changes made during the sync are picked up by sync_changes()
+            indexes_modified, _ = self.connection.get_indexes_modified()
+
+            for artist in self.connection.get_artists():
+                index.add_artist(artist)
+
+            for album in self._pages(self.connection.get_album_page):
+                index.add_album(album)
+
+            for song in self._pages(self.connection.get_song_page):
+                index.add_song(song)
+
+            if not index.songs_by_id and index.albums_by_id:
+                # The server does not support empty search queries, get the songs album by album
+                self.logger.warning('Songs could not be listed with search3, requesting each album instead')
+
+                for song in self.connection.build_song_list_from_albums(list(index.albums_by_id.values()), -1):
+                    index.add_song(song)
+
+            index.finalise()
+
+            # Replace the whole index at once so lookups never see a partial catalog
+            self.index = index
+            self.ready = True
+            self.last_sync = time.time()
+            self.indexes_modified = indexes_modified
+
+            self.logger.info(f'Catalog synchronised in {time.monotonic() - started:.1f}s: {len(index.artists_by_id)} artists, '
+                             f'{len(index.albums_by_id)} albums and {len(index.songs_by_id)} songs')
+
+    def sync_changes(self) -> SyncReport:
+        """Synchronise the changes made since the last synchronisation
+
+        Nothing is fetched while the media server is scanning.  Otherwise the
+        lastModified time of the artist indexes is checked, and only if it has
+        moved are the artists and the album list requested, and the albums
+        which have been added or changed requested in full.  If the catalog
+        has not been synchronised yet a full synchronisation is performed.
+
+        :return: A report of the number of artists and albums updated
+        :rtype: SyncReport
+        """
+
+        self.logger.debug('In sync_changes()')
+
+        if not self.ready:
+            if self._sync_lock.locked():
+                # The first synchronisation is still running
+                return SyncReport(skipped=True)
+
+            self.sync()
+            index = self.index
+
+            return SyncReport(len(index.artists_by_id), len(index.albums_by_id))
+
+        if self.connection.get_scan_status().get('scanning'):
+            # The library is changing, wait for the scan to finish
+            self.logger.debug('The media server is scanning, skipping synchronisation')
+
+            return SyncReport(skipped=True)
+
+        with self._sync_lock:
+            report = SyncReport()
+
+            indexes_modified, modified = self.connection.get_indexes_modified(self.indexes_modified)
+
+            if modified:
+                # Lookups keep reading the current index while the changes are made to a copy
+                index = self.index.copy()
+
+                report.artists = self._sync_artists(index)
+                report.albums = self._sync_albums(index)
+
+                self.index = index
+                self.indexes_modified = indexes_modified
+
+            self.last_sync = time.time()
+
+        return report
+
+    def _sync_artists(self, index: CatalogIndex) -> int:
+        """Update artists which have been added, changed or removed
+
+        :return: The number of artists updated
+        :rtype: int
+        """
+
+        updated = 0
+        artists = {artist.get('id'): artist for artist in self.connection.get_artists()}
+
+        for artist_id in set(index.artists_by_id) - set(artists):
+            index.remove_artist(artist_id)
+            updated += 1
+
+        for artist_id, artist in artists.items():
+            if index.artists_by_id.get(artist_id) != artist:
+                index.remove_artist(artist_id)
+                index.add_artist(artist)
+                updated += 1
+
+        return updated
+
+    def _sync_albums(self, index: CatalogIndex) -> int:
+        """Update albums which have been added, changed or removed
+
+        Every album is listed and its changed timestamp compared with the
+        album in the index, only albums which are new or have changed are
+        requested in full.  The album lists of the Subsonic API are not
+        ordered by the changed timestamp, so the whole list is read.  Servers
+        which do not return a changed timestamp fall back to the created
+        timestamp, on these only added and removed albums are picked up, and
+        edits to existing albums wait for the next full synchronisation.
+
+        :return: The number of albums updated
+        :rtype: int
+        """
+
+        listed = {album.get('id'): album for album in self._pages(self.connection.get_album_page)}
+
+        removed_ids = set(index.albums_by_id) - set(listed)
+
+        for album_id in removed_ids:
+            index.remove_album(album_id)
+
+        album_ids = [album_id for album_id, album in listed.items()
+                     if album_id not in index.albums_by_id or album_changed(album) != album_changed(index.albums_by_id[album_id])]
+
+        for album_id, (album, error) in zip(album_ids, self.connection.fan_out(self.connection.get_album, album_ids)):
+            if error is not None:
+                self.logger.error(f'Could not synchronise album {album_id}: {error}')
+                continue
+
+            songs = album.pop('song', [])
+
+            index.remove_album(album_id)
+            index.add_album(album)
+
+            for song in songs:
+                index.add_song(song)
+
+        index.finalise(album_ids)
+
+        return len(removed_ids) + len(album_ids)
+
+    def start(self) -> threading.Thread:
+        """Synchronise the library in a background thread
+
+        :return: The thread performing the synchronisation
+        :rtype: threading.Thread
+        """
+
+        def run():
+            try:
+                self.sync()
+            except Exception as e:
+                self.logger.error(f'Catalog synchronisation failed: {e}')
+
+        thread = threading.Thread(target=run, name='catalog-sync', daemon=True)
+        thread.start()
+
+        return thread
+
+    def _pages(self, get_page):
+        """Yield every item from a paged API method"""
+
+        offset = 0
+
+        while True:
+            page = get_page(offset, self.page_size)
+
+            yield from page
+
+            if len(page) < self.page_size:
+                break
+
+            offset += len(page)
+
+    #
+    # Lookups
+    #
+
+    def _find(self, by_name: dict, words: dict, fuzzy: FuzzyIndex, term: str, limit: int = 20) -> list:
+        """Find entities by name
+
+        Exact matches on the normalised name are returned first, followed by
+        entities whose name contains every word of the search term.  As with
+        search3 at most limit names are matched.  If nothing matches, the
+        names most similar to the search term are returned, best match first.
+        """
+
+        term = normalise_term(term)
+        result = list(by_name.get(term, []))
+
+        term_words = name_words(term)
+
+        if term_words:
+            # Start from the word with the fewest names to keep the intersection small
+            postings = sorted((words.get(word, set()) for word in term_words), key=len)
+            names = postings[0].intersection(*postings[1:]) if len(postings) > 1 else postings[0]
+
+            # Shorter names are closer to the search term
+            closest = [name for name in heapq.nsmallest(limit + 1, names, key=len) if name != term]
+
+            for name in closest[:limit]:
+                result.extend(by_name[name])
+
+        if not result:
+            # Tolerate transcription differences such as "the beatles" for "Beatles, The"
+            matches = fuzzy.search(term, limit)
+            self.logger.debug(f'Fuzzy matches for {term}: {[(round(score, 2), entity.get("name", entity.get("title"))) for score, entity in matches]}')
+
+            result = [entity for _, entity in matches]
+
+        return result
+
+    def search_artist(self, term: str) -> Union['list[dict]', None]:
+        """Search the catalog for the given artist
+
+        :param str term: The name of the artist
+        :return: A list of artists or None if no results are found
+        :rtype: list[dict] | None
+        """
+
+        if not self.ready:
+            return self.connection.search_artist(term)
+
+        index = self.index
+
+        return self._find(index.artists_by_name, index.artist_words, index.artist_fuzzy, term) or None
+
+    def search_album(self, term: str) -> Union['list[dict]', None]:
+        """Search the catalog for the given album
+
+        :param str term: The name of the album
+        :return: A list of albums or None if no results are found
+        :rtype: list[dict] | None
+        """
+
+        if not self.ready:
+            return self.connection.search_album(term)
+
+        index = self.index
+
+        return self._find(index.albums_by_name, index.album_words, index.album_fuzzy, term) or None
+
+    def search_song(self, term: str) -> Union['list[dict]', None]:
+        """Search the catalog for the given song
+
+        :param str term: The name of the song
+        :return: A list of songs or None if no results are found
+        :rtype: list[dict] | None
+        """
+
+        if not self.ready:
+            return self.connection.search_song(term)
+
+        index = self.index
+
+        return self._find(index.songs_by_name, index.song_words, index.song_fuzzy, term) or None
+
+    def albums_by_artist(self, id: str) -> 'list[dict]':
+        """Get the albums for a given artist
+
+        :param str id: The artist ID
+        :return: A shuffled list of albums
+        :rtype: list[dict]
+        """
+
+        if not self.ready:
+            return self.connection.albums_by_artist(id)
+
+        album_list = list(self.index.albums_by_artist_id.get(id, []))
+
+        # Shuffle the album list to keep generic requests fresh
+        random.shuffle(album_list)
+
+        return album_list
+
+    def build_song_list_from_albums(self, albums: 'list[dict]', length: int) -> 'list[dict]':
+        """Get a list of songs from given albums
+
+        :param list[dict] albums: A list of dictionaries containing album information
+        :param int length: The minimum number of songs that should be returned, if -1 there is no limit
+        :return: A list of song dictionaries
+        :rtype: list[dict]
+        """
+
+        if not self.ready:
+            return self.connection.build_song_list_from_albums(albums, length)
+
+        songs_by_album_id = self.index.songs_by_album_id
+        song_list = []
+
+        for album in albums:
+            if length != -1 and len(song_list) >= int(length):
+                # We have enough songs, stop iterating
+                break
+
+            song_list.extend(songs_by_album_id.get(album.get('id'), []))
+
+        return song_list
+
+    def build_song_list_from_genre(self, genre: str, count: int) -> Union['list[dict]', None]:
+        """Build a list of songs from the given genre
+
+        :param str genre: The genre
+        :param int count: The number of songs to return
+        :return: A list of song dictionaries or None if no tracks are found.
+        :rtype: list[dict] | None
+        """
+
+        if not self.ready:
+            return self.connection.build_song_list_from_genre(genre, count)
+
+        songs = self.index.songs_by_genre.get(normalise_term(genre), [])
+
+        if len(songs) == 0:
+            return None
+
+        return random.sample(songs, min(int(count), len(songs)))
+
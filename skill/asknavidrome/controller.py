@@ -9,18 +9,26 @@ from ask_sdk_model.interfaces.audioplayer import (
     StopDirective)
 from ask_sdk_model.interfaces import display
 
-from .track import Track
-from .subsonic_api import SubsonicConnection
+from .track import Track, intern_string
+from .subsonic_api import StreamSigner
 from .media_queue import MediaQueue
 
 logger = logging.getLogger(__name__)
 
+TRACK_KEYS = ('id', 'title', 'artist', 'artistId', 'album', 'albumId', 'track',
+              'year', 'genre', 'duration', 'bitRate')
+"""Song dictionary keys used to create a Track"""
+
+SHARED_KEYS = frozenset(('artist', 'artistId', 'album', 'albumId', 'genre'))
+"""Song dictionary keys whose values are repeated between songs and are interned"""
+
 #
 # Functions
 #
 
 
-def start_playback(mode: str, text: str, card_data: dict, track_details: Track, handler_input: HandlerInput) -> Response:
+def start_playback(mode: str, text: str, card_data: dict, track_details: Track, handler_input: HandlerInput,
+                   signer: StreamSigner) -> Response:
     """Function to play audio.
 
     Begin playing audio when:
@@ -33,28 +41,19 @@ def start_playback(mode: str, text: str, card_data: dict, track_details: Track,
        - https://developer.amazon.com/docs/custom-skills/audioplayer-interface-reference.html#play
            - REPLACE_ALL: Immediately begin playback of the specified stream,
              and replace current and enqueued streams.
+           - ENQUEUE: Add the specified stream to the end of the current queue.
+           - REPLACE_ENQUEUED: Replace all streams in the queue, without
+             impacting the currently playing stream.
 
-    :param str mode: play | continue - Play immediately or enqueue a track
+    :param str mode: play | continue | next - Play immediately, enqueue a track or replace the enqueued track
     :param str text: Text which should be spoken before playback starts
     :param dict card_data: Data to display on a card
     :param Track track_details: A Track object containing details of the track to use
     :param HandlerInput handler_input: The Amazon Alexa HandlerInput object
+    :param StreamSigner signer: Creates the stream URI if the track does not have one
     :return: Amazon Alexa Response class
     :rtype: Response
     """
-    metadata = AudioItemMetadata(
-        title=track_details.title,
-        subtitle=track_details.artist,
-        art=display.Image(
-                content_description=track_details.title,
-                sources=[
-                    display.ImageInstance(
-                        url='https://github.com/navidrome/navidrome/raw/master/resources/logo-192x192.png'
-                    )
-                ]
-            )                                                              
-    )
-    
     if mode == 'play':
         # Starting playback
         logger.debug('In start_playback() - play mode')
@@ -71,17 +70,7 @@ def start_playback(mode: str, text: str, card_data: dict, track_details: Track,
             )
 
         handler_input.response_builder.add_directive(
-            PlayDirective(
-                play_behavior=PlayBehavior.REPLACE_ALL,
-                audio_item=AudioItem(
-                    stream=Stream(
-                        token=track_details.id,
-                        url=track_details.uri,
-                        offset_in_milliseconds=track_details.offset,
-                        expected_previous_token=None),
-                    metadata=metadata
-                )
-            )
+            create_play_directive(PlayBehavior.REPLACE_ALL, track_details, signer, track_details.offset, None)
         ).set_should_end_session(True)
 
         if text:
@@ -92,25 +81,22 @@ def start_playback(mode: str, text: str, card_data: dict, track_details: Track,
         logger.debug(f'Track Previous ID: {track_details.previous_id}')
         logger.info(f'Playing track: {track_details.title} by: {track_details.artist}')
 
-    elif mode == 'continue':
-        # Continuing Playback
-        logger.debug('In start_playback() - continue mode')
+    elif mode == 'continue' or mode == 'next':
+        # Continuing Playback, in next mode the track replaces the track already enqueued
+        logger.debug(f'In start_playback() - {mode} mode')
 
-        handler_input.response_builder.add_directive(
-            PlayDirective(
-                play_behavior=PlayBehavior.ENQUEUE,
-                audio_item=AudioItem(
-                    stream=Stream(
-                        token=track_details.id,
-                        url=track_details.uri,
-                        # Offset is 0 to allow playing of the next track from the beginning
-                        # if the Previous intent is used
-                        offset_in_milliseconds=0,
-                        expected_previous_token=track_details.previous_id),
-                    metadata=metadata
-                )
-            )
-        ).set_should_end_session(True)
+        # Offset is 0 to allow playing of the next track from the beginning
+        # if the Previous intent is used
+        if mode == 'next':
+            # Alexa only accepts an expected previous token with ENQUEUE
+            directive = create_play_directive(PlayBehavior.REPLACE_ENQUEUED, track_details, signer, 0, None)
+        else:
+            directive = create_play_directive(PlayBehavior.ENQUEUE, track_details, signer, 0, track_details.previous_id)
+
+        handler_input.response_builder.add_directive(directive).set_should_end_session(True)
+
+        if text:
+            handler_input.response_builder.speak(text)
 
         logger.debug(f'Track ID: {track_details.id}')
         logger.debug(f'Track Previous ID: {track_details.previous_id}')
@@ -119,6 +105,67 @@ def start_playback(mode: str, text: str, card_data: dict, track_details: Track,
     return handler_input.response_builder.response
 
 
+def create_play_directive(play_behavior: PlayBehavior, track_details: Track, signer: StreamSigner, offset: int,
+                          expected_previous_token: Union[str, None]) -> PlayDirective:
+    """Create a directive playing a track
+
+    :param PlayBehavior play_behavior: How the track is added to the queue of the Alexa device
+    :param Track track_details: A Track object containing details of the track to play
+    :param StreamSigner signer: Creates the stream URI if the track does not have one
+    :param int offset: The position in the track to start playing from in milliseconds
+    :param str expected_previous_token: The token of the track playing before this one, only used with ENQUEUE, otherwise None
+    :return: An Amazon PlayDirective object
+    :rtype: PlayDirective
+    """
+
+    # Stream URIs are only created for tracks which are actually sent to Alexa
+    stream_uri = track_details.uri or signer.sign(track_details.id)
+
+    metadata = AudioItemMetadata(
+        title=track_details.title,
+        subtitle=track_details.artist,
+        art=display.Image(
+                content_description=track_details.title,
+                sources=[
+                    display.ImageInstance(
+                        url='https://github.com/navidrome/navidrome/raw/master/resources/logo-192x192.png'
+                    )
+                ]
+            )
+    )
+
+    return PlayDirective(
+        play_behavior=play_behavior,
+        audio_item=AudioItem(
+            stream=Stream(
+                token=track_details.id,
+                url=stream_uri,
+                offset_in_milliseconds=offset,
+                expected_previous_token=expected_previous_token),
+            metadata=metadata
+        )
+    )
+
+
+def prepare_enqueue(track_details: Track, signer: StreamSigner) -> Response:
+    """Prepare the response enqueuing a track
+
+    Builds the response start_playback() gives in continue mode ahead of
+    time, so that a PlaybackNearlyFinished request can be answered without
+    building it.  The response holds no speech or card and can be returned
+    for any request enqueuing the same track after the same previous track.
+
+    :param Track track_details: A Track object containing details of the track to enqueue
+    :param StreamSigner signer: Creates the stream URI if the track does not have one
+    :return: Amazon Alexa Response class
+    :rtype: Response
+    """
+
+    directive = create_play_directive(PlayBehavior.ENQUEUE, track_details, signer, 0, track_details.previous_id)
+
+    return Response(directives=[directive], should_end_session=True)
+
+
 def stop(handler_input: HandlerInput) -> Response:
     """Stop playback
 
@@ -172,36 +219,76 @@ def add_screen_background(card_data: dict) -> Union[AudioItemMetadata, None]:
         return None
 
 
-def enqueue_songs(api: SubsonicConnection, queue: MediaQueue, song_id_list: list) -> None:
-    """Enqueue songs
+def create_track(song_details: dict) -> Track:
+    """Create a Track object
+
+    Build a Track object from a song dictionary as returned by the Subsonic API,
+    song dictionaries are included in the responses to getAlbum, getPlaylist,
+    getStarred2, getSongsByGenre, getRandomSongs, search3 and getSong.  The
+    stream URI is left empty, it is created by start_playback().
+
+    :param dict song_details: A dictionary of details about a song
+    :return: A Track object
+    :rtype: Track
+    """
+
+    new_track = Track(song_details.get('id'),
+                      song_details.get('title'),
+                      song_details.get('artist'),
+                      song_details.get('artistId'),
+                      song_details.get('album'),
+                      song_details.get('albumId'),
+                      song_details.get('track'),
+                      song_details.get('year'),
+                      song_details.get('genre'),
+                      song_details.get('duration'),
+                      song_details.get('bitRate'),
+                      '',
+                      0,
+                      None)
+
+    return new_track
+
+
+def enqueue_tracks(queue: MediaQueue, song_list: 'list[dict]') -> None:
+    """Enqueue tracks
+
+    Add Track objects built from the given song dictionaries to the queue deque.
+    No requests are made to the Navidrome API.
+
+    :param MediaQueue queue: A MediaQueue object
+    :param list[dict] song_list: A list of song dictionaries to enqueue
+    :return: None
+    """
+
+    queue.add_tracks([create_track(song_details) for song_details in song_list])
+
+
+def replace_queue(queue: MediaQueue, song_list: 'list[dict]') -> Track:
+    """Replace the contents of the queue and start playing it
+
+    :param MediaQueue queue: A MediaQueue object
+    :param list[dict] song_list: A list of song dictionaries to play
+    :return: The first track, now the current track of the queue
+    :rtype: Track
+    """
+
+    return queue.replace([create_track(song_details) for song_details in song_list])
+
+
+def enqueue_song_references(queue: MediaQueue, song_list: 'list[dict]') -> None:
+    """Enqueue song references
 
-    Add Track objects to the queue deque
+    Add song dictionaries to the queue, these are turned into Track objects by
+    the queue as they approach the front of the queue.  Only the keys needed
+    to create a Track are kept, and the strings repeated between songs are
+    interned.
 
-    :param SubsonicConnection api: A SubsonicConnection object to allow access to the Navidrome API
     :param MediaQueue queue: A MediaQueue object
-    :param list song_id_list: A list of song IDs to enqueue
+    :param list[dict] song_list: A list of song dictionaries to enqueue
     :return: None
     """
 
-    for song_id in song_id_list:
-        song_details = api.get_song_details(song_id)
-        song_uri = api.get_song_uri(song_id)
-
-        # Create track object from song details
-        new_track = Track(song_details.get('song').get('id'),
-                          song_details.get('song').get('title'),
-                          song_details.get('song').get('artist'),
-                          song_details.get('song').get('artistId'),
-                          song_details.get('song').get('album'),
-                          song_details.get('song').get('albumId'),
-                          song_details.get('song').get('track'),
-                          song_details.get('song').get('year'),
-                          song_details.get('song').get('genre'),
-                          song_details.get('song').get('duration'),
-                          song_details.get('song').get('bitRate'),
-                          song_uri,
-                          0,
-                          None)
-
-        # Add track object to queue
-        queue.add_track(new_track)
+    queue.add_songs([{key: intern_string(song_details[key]) if key in SHARED_KEYS else song_details[key]
+                      for key in TRACK_KEYS if key in song_details}
+                     for song_details in song_list])
@@ -0,0 +1,121 @@
+from contextvars import ContextVar
+from typing import Union
+import time
+
+
+class DeadlineExceeded(TimeoutError):
+    """Raised when there is no time left to make a request"""
+
+
+class Deadline:
+    """The time left to respond to a request
+
+    Alexa waits 8 seconds for a response, a Deadline is started when a
+    request arrives so that API calls can be limited to the time that is
+    left and handlers can give a shorter answer before the time runs out.
+    """
+
+    def __init__(self, budget: float = 7, margin: float = 0.5) -> None:
+        """
+        :param float budget: Seconds available to respond. Defaults to 7
+        :param float margin: Seconds kept back to build and send the response. Defaults to 0.5
+        :return: None
+        """
+
+        self.budget = float(budget)
+        self.margin = float(margin)
+        self.started = time.monotonic()
+        self.expires = self.started + self.budget
+
+    def elapsed(self) -> float:
+        """Get the time since the deadline was started
+
+        :return: The elapsed time in seconds
+        :rtype: float
+        """
+
+        return time.monotonic() - self.started
+
+    def remaining(self) -> float:
+        """Get the time left, less the margin, for work such as API calls
+
+        :return: The remaining time in seconds, 0 once the time has run out
+        :rtype: float
+        """
+
+        return max(0.0, self.expires - self.margin - time.monotonic())
+
+    def expired(self) -> bool:
+        """Check if the time has run out
+
+        :return: True if there is no time left
+        :rtype: bool
+        """
+
+        return self.remaining() <= 0
+
+    def has(self, seconds: float) -> bool:
+        """Check if there is time left for a task
+
+        :param float seconds: The expected length of the task
+        :return: True if the task should complete in the time left
+        :rtype: bool
+        """
+
+        return self.remaining() >= seconds
+
+    def timeout(self, default: float) -> float:
+        """Limit a timeout to the time left
+
+        :param float default: The timeout to use if there is more time left
+        :raises DeadlineExceeded: If there is no time left
+        :return: The smaller of default and the remaining time in seconds
+        :rtype: float
+        """
+
+        remaining = self.remaining()
+
+        if remaining <= 0:
+            raise DeadlineExceeded(f'The deadline of {self.budget}s expired {self.elapsed() - self.budget + self.margin:.2f}s ago')
+
+        return min(default, remaining)
+
+
+_current: ContextVar = ContextVar('deadline', default=None)
+
+
+def start(budget: float = 7, margin: float = 0.5) -> Deadline:
+    """Start a deadline for the current request
+
+    The deadline applies to the current thread, and to the threads used by
+    SubsonicConnection.fan_out(), until finish() is called.
+
+    :param float budget: Seconds available to respond. Defaults to 7
+    :param float margin: Seconds kept back to build and send the response. Defaults to 0.5
+    :return: The new deadline
+    :rtype: Deadline
+    """
+
+    deadline = Deadline(budget, margin)
+    _current.set(deadline)
+
+    return deadline
+
+
+def current() -> Union[Deadline, None]:
+    """Get the deadline of the current request
+
+    :return: The deadline or None if there is no deadline, for example in a background thread
+    :rtype: Deadline | None
+    """
+
+    return _current.get()
+
+
+def finish() -> None:
+    """Remove the deadline of the current request
+
+    :return: None
+    """
+
+    _current.set(None)
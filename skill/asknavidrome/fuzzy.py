@@ -0,0 +1,312 @@
+from array import array
+from collections import Counter
+from typing import Any, Callable, Iterable
+import heapq
+import re
+import unicodedata
+
+
+ARTICLES = ('the', 'a', 'an')
+"""Leading articles which are ignored when matching names"""
+
+_SOUNDEX_CODES = str.maketrans('bfpvcgjkqsxzdtlmnraeiouyhw', '11112222222233455600000000')
+
+
+def match_key(name: str) -> str:
+    """Reduce a name to the form used for fuzzy matching
+
+    Accents, punctuation and leading articles are removed, & becomes and and
+    "Beatles, The" is treated as "The Beatles".  Alexa transcriptions such as
+    "the beatles" or "AC DC" then produce the same key as the names in the
+    library, "Beatles, The" and "AC/DC".
+
+    :param str name: The name to process
+    :return: The words of the name separated by single spaces
+    :rtype: str
+    """
+
+    name = unicodedata.normalize('NFKD', name)
+    name = ''.join(char for char in name if not unicodedata.combining(char)).casefold()
+    name = name.replace('&', ' and ').replace('+', ' and ')
+
+    words = re.findall(r'[^\W_]+', name)
+
+    # Names filed as "Beatles, The"
+    if len(words) > 1 and words[-1] in ARTICLES and re.search(r',\s*\w+\s*$', name):
+        words = words[:-1]
+
+    if len(words) > 1 and words[0] in ARTICLES:
+        words = words[1:]
+
+    return ' '.join(words)
+
+
+def soundex(word: str) -> str:
+    """Get the Soundex code of a word
+
+    Numbers are returned unchanged so that names such as Blink 182 still match.
+
+    :param str word: A single word
+    :return: The four character Soundex code
+    :rtype: str
+    """
+
+    if not word.isalpha():
+        return word
+
+    codes = word.translate(_SOUNDEX_CODES)
+    result = word[0]
+    previous = codes[0]
+
+    for char, code in zip(word[1:], codes[1:]):
+        if code != '0' and code != previous:
+            result += code
+
+        # Letters separated by h or w are coded once
+        if char not in 'hw':
+            previous = code
+
+    return (result + '000')[:4]
+
+
+def phonetic_key(key: str) -> str:
+    """Get the phonetic key of a match key
+
+    :param str key: A key returned by match_key()
+    :return: The Soundex codes of each word
+    :rtype: str
+    """
+
+    return ' '.join(soundex(word) for word in key.split())
+
+
+def trigrams(key: str) -> 'set[str]':
+    """Get the trigrams of a match key
+
+    Spaces are removed so that "ac dc" and "acdc" produce the same trigrams.
+
+    :param str key: A key returned by match_key()
+    :return: The set of trigrams
+    :rtype: set[str]
+    """
+
+    padded = f'${key.replace(" ", "")}$'
+
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def similarity(first: str, second: str) -> float:
+    """Score the similarity of two names
+
+    :param str first: A name
+    :param str second: Another name
+    :return: A score between 0 and 1, 1 is an exact match
+    :rtype: float
+    """
+
+    first_key = match_key(first)
+    second_key = match_key(second)
+
+    if first_key.replace(' ', '') == second_key.replace(' ', ''):
+        return 1.0
+
+    first_grams = trigrams(first_key)
+    second_grams = trigrams(second_key)
+    score = 2 * len(first_grams & second_grams) / (len(first_grams) + len(second_grams))
+
+    if phonetic_key(first_key) == phonetic_key(second_key):
+        score = min(0.99, score + FuzzyIndex.phonetic_bonus)
+
+    return score
+
+
+def rank(term: str, candidates: Iterable, name: Callable[[Any], str], min_score: float = 0.5) -> list:
+    """Sort a short list of candidates by their similarity to a search term
+
+    Use a FuzzyIndex for large lists.
+
+    :param str term: The search term
+    :param Iterable candidates: The candidates to rank
+    :param Callable name: A function returning the name of a candidate
+    :param float min_score: Candidates scoring less than this are removed. Defaults to 0.5
+    :return: The candidates scoring at least min_score, best match first
+    :rtype: list
+    """
+
+    scored = [(similarity(term, name(candidate) or ''), position, candidate) for position, candidate in enumerate(candidates)]
+
+    return [candidate for score, _, candidate in sorted(scored, key=lambda item: (-item[0], item[1])) if score >= min_score]
+
+
+def best_match(term: str, candidates: Iterable, name: Callable[[Any], str], min_score: float = 0.5) -> Any:
+    """Find the candidate most similar to a search term
+
+    A match is only returned when it scores strictly better than the runner
+    up, two equally close names cannot be told apart.
+
+    :param str term: The search term
+    :param Iterable candidates: The candidates to search
+    :param Callable name: A function returning the name of a candidate
+    :param float min_score: Candidates scoring less than this are ignored. Defaults to 0.5
+    :return: The best matching candidate or None if there is no single best match
+    :rtype: Any
+    """
+
+    scored = sorted(((similarity(term, name(candidate) or ''), candidate) for candidate in candidates),
+                    key=lambda item: item[0], reverse=True)
+
+    if not scored or scored[0][0] < min_score:
+        return None
+
+    if len(scored) > 1 and scored[1][0] >= scored[0][0]:
+        return None
+
+    return scored[0][1]
+
+
+class FuzzyIndex:
+    """Precomputed fuzzy name index
+
+    Names are reduced with match_key() and their trigrams and phonetic keys
+    are stored in posting lists.  A search only scores the names sharing a
+    trigram with the search term, so matching stays fast on large libraries.
+    """
+
+    phonetic_bonus = 0.15
+    """Added to the score of names that sound the same as the search term"""
+
+    max_posting_ratio = 0.05
+    """Trigrams found in more than this fraction of names are not used to find candidates"""
+
+    def __init__(self) -> None:
+        """
+        :return: None
+        """
+
+        self.values: list = []
+        """The value stored for each name, None once removed"""
+
+        self.sizes = array('H')
+        """The number of trigrams in each name"""
+
+        self.exact: dict = {}
+        self.phonetic: dict = {}
+        self.postings: dict = {}
+
+        # Entries of each value, keyed by id() as values such as dictionaries are not hashable
+        self._entries: dict = {}
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def add(self, name: str, value: Any) -> None:
+        """Add a name to the index
+
+        :param str name: The name to index
+        :param Any value: The value returned when the name matches
+        :return: None
+        """
+
+        key = match_key(name or '')
+
+        if not key:
+            return
+
+        entry = len(self.values)
+        grams = trigrams(key)
+
+        self.values.append(value)
+        self.sizes.append(min(len(grams), 65535))
+        self._entries.setdefault(id(value), []).append(entry)
+
+        self.exact.setdefault(key.replace(' ', ''), array('L')).append(entry)
+        self.phonetic.setdefault(phonetic_key(key), array('L')).append(entry)
+
+        for gram in grams:
+            self.postings.setdefault(gram, array('L')).append(entry)
+
+    def copy(self) -> 'FuzzyIndex':
+        """Copy the index so that the copy can be changed while the original is searched
+
+        The values are shared, only the index structures are copied.
+
+        :return: A new FuzzyIndex
+        :rtype: FuzzyIndex
+        """
+
+        index = FuzzyIndex()
+        index.values = list(self.values)
+        index.sizes = array('H', self.sizes)
+        index.exact = {key: array('L', entries) for key, entries in self.exact.items()}
+        index.phonetic = {key: array('L', entries) for key, entries in self.phonetic.items()}
+        index.postings = {gram: array('L', entries) for gram, entries in self.postings.items()}
+        index._entries = {key: list(entries) for key, entries in self._entries.items()}
+
+        return index
+
+    def remove(self, value: Any) -> None:
+        """Remove every name with the given value
+
+        Entries are only marked as removed, posting lists are not rebuilt.
+
+        :param Any value: The value to remove
+        :return: None
+        """
+
+        for entry in self._entries.pop(id(value), []):
+            self.values[entry] = None
+
+    def search(self, term: str, limit: int = 5, min_score: float = 0.5) -> 'list[tuple[float, Any]]':
+        """Find the names most similar to the search term
+
+        :param str term: The search term
+        :param int limit: The maximum number of results to return. Defaults to 5
+        :param float min_score: Results scoring less than this are not returned. Defaults to 0.5
+        :return: A list of (score, value) tuples, best match first
+        :rtype: list[tuple[float, Any]]
+        """
+
+        key = match_key(term or '')
+
+        if not key:
+            return []
+
+        scores = {entry: 1.0 for entry in self.exact.get(key.replace(' ', ''), ())}
+
+        if len(scores) < limit:
+            grams = trigrams(key)
+
+            # Very common trigrams add little except work, unless there is nothing else to go on
+            max_postings = max(1000, int(len(self.values) * self.max_posting_ratio))
+            postings = [self.postings[gram] for gram in grams if gram in self.postings]
+            selective = [posting for posting in postings if len(posting) <= max_postings] or postings
+
+            overlaps = Counter()
+
+            for posting in selective:
+                overlaps.update(posting)
+
+            sounds_like = set(self.phonetic.get(phonetic_key(key), ()))
+            sizes = self.sizes
+            query_size = len(grams)
+
+            for entry, overlap in overlaps.items():
+                if entry in scores:
+                    continue
+
+                score = 2 * overlap / (query_size + sizes[entry])
+
+                if entry in sounds_like:
+                    score = min(0.99, score + self.phonetic_bonus)
+
+                if score >= min_score:
+                    scores[entry] = score
+
+            for entry in sounds_like:
+                # Names which sound the same but share few trigrams
+                scores.setdefault(entry, min_score)
+
+        values = self.values
+        best = heapq.nlargest(limit * 2, scores.items(), key=lambda item: item[1])
+
+        return [(score, values[entry]) for entry, score in best if values[entry] is not None][:limit]
@@ -0,0 +1,139 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+
+
+def log_path(directory: str, key: str) -> str:
+    """Get the path of the history log of a session
+
+    :param str directory: The directory holding history logs
+    :param str key: The session key
+    :return: The path of the log file
+    :rtype: str
+    """
+
+    # Device IDs are long and contain characters which are not valid in file names
+    name = hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+    return os.path.join(directory, f'history-{name}.jsonl')
+
+
+class HistoryLog:
+    """Stack of history records kept in a file
+
+    Holds the tracks which no longer fit in the history of a MediaQueue.
+    Records are appended as JSON lines and read back from the end of the file,
+    the file is truncated as records are removed.
+    """
+
+    def __init__(self, path: str, chunk_size: int = 4096) -> None:
+        """
+        :param str path: The log file, created if it does not exist
+        :param int chunk_size: The number of bytes read at a time when searching backwards for a record. Defaults to 4096
+        :return: None
+        """
+
+        self.logger = logging.getLogger(__name__)
+
+        self.path = path
+        self.chunk_size = chunk_size
+
+        self.count: int = 0
+        """Number of records in the log"""
+
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(self.path)
+
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        if os.path.exists(self.path):
+            with open(self.path, 'rb') as f:
+                self.count = sum(1 for line in f if line.endswith(b'\n'))
+
+    def push(self, records: list) -> None:
+        """Add records to the end of the log
+
+        :param list records: History records, lists of simple values
+        :return: None
+        """
+
+        if not records:
+            return
+
+        data = ''.join(json.dumps(record, separators=(',', ':')) + '\n' for record in records)
+
+        with self._lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(data)
+
+            self.count += len(records)
+
+    def pop(self, count: int = 1) -> list:
+        """Remove records from the end of the log
+
+        :param int count: The maximum number of records to remove. Defaults to 1
+        :return: The records, oldest first
+        :rtype: list
+        """
+
+        with self._lock:
+            if self.count == 0:
+                return []
+
+            with open(self.path, 'rb+') as f:
+                end = f.seek(0, os.SEEK_END)
+                start = self._find_start(f, end, min(count, self.count))
+
+                f.seek(start)
+                lines = f.read(end - start).splitlines()
+
+                f.truncate(start)
+
+            self.count -= len(lines)
+
+            return [json.loads(line) for line in lines]
+
+    def clear(self) -> None:
+        """Remove all records
+
+        :return: None
+        """
+
+        with self._lock:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+            self.count = 0
+
+    def _find_start(self, f, end: int, count: int) -> int:
+        """Find the offset of the count-th line from the end of the file"""
+
+        position = end
+        # The file ends with a newline, which does not start a record
+        newlines = -1
+
+        while position > 0:
+            size = min(self.chunk_size, position)
+            position -= size
+
+            f.seek(position)
+            chunk = f.read(size)
+
+            index = len(chunk)
+
+            while True:
+                index = chunk.rfind(b'\n', 0, index)
+
+                if index < 0:
+                    break
+
+                newlines += 1
+
+                if newlines == count:
+                    return position + index + 1
+
+        return 0
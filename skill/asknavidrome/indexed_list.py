@@ -0,0 +1,345 @@
+from bisect import bisect_right
+from itertools import chain
+from typing import Iterable, Iterator
+
+
+class IndexedList:
+    """List supporting fast inserts and removals at any position
+
+    Entries are held in blocks of up to block_size entries.  Finding an
+    entry by position is a binary search over the block offsets, O(log n).
+    An insert or removal moves the entries of one block and shifts the
+    offsets of the blocks after it, O(block_size + n / block_size), where a
+    deque or list would move every entry after the position.  Removing the
+    first entry, which the play queue does on every track, leaves the offsets
+    in place and is O(1) until its block is emptied.  Adding or removing a
+    block rebuilds the offsets on the next lookup, O(n / block_size), which
+    happens at most once per block_size removals from the front.
+
+    The position of an entry object is found through a map of entries to
+    their block.  Each entry object should be added to the list only once.
+    """
+
+    def __init__(self, entries: Iterable = (), block_size: int = 256) -> None:
+        """
+        :param Iterable entries: The initial entries. Defaults to ()
+        :param int block_size: The number of entries in a full block. Defaults to 256
+        :return: None
+        """
+
+        self.block_size = max(8, int(block_size))
+
+        self._blocks: list = []
+        self._len: int = 0
+
+        # The block holding each entry, keyed by id() of the entry
+        self._block_of: dict = {}
+
+        # The position of the first entry of each block plus _shift and the index of each block keyed
+        # by id() of the block, rebuilt when they are needed after blocks have been added or removed.
+        # Removing the first entry adds one to _shift instead of moving every offset.
+        self._offsets: list = []
+        self._block_index: dict = {}
+        self._shift: int = 0
+        self._dirty: bool = False
+
+        self.extend(entries)
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __iter__(self) -> Iterator:
+        return chain.from_iterable(self._blocks)
+
+    def __getitem__(self, position: int):
+        block, offset = self._locate(position)
+
+        return block[offset]
+
+    def __setitem__(self, position: int, entry) -> None:
+        block, offset = self._locate(position)
+
+        del self._block_of[id(block[offset])]
+        block[offset] = entry
+        self._block_of[id(entry)] = block
+
+    def __delitem__(self, position: int) -> None:
+        self.pop(position)
+
+    def append(self, entry) -> None:
+        """Add an entry to the end of the list
+
+        :param entry: The entry
+        :return: None
+        """
+
+        if not self._blocks or len(self._blocks[-1]) >= self.block_size:
+            self._blocks.append([])
+
+            if not self._dirty:
+                # A block added at the end does not move the other blocks
+                self._block_index[id(self._blocks[-1])] = len(self._offsets)
+                self._offsets.append(self._len + self._shift)
+
+        block = self._blocks[-1]
+        block.append(entry)
+
+        self._block_of[id(entry)] = block
+        self._len += 1
+
+    def appendleft(self, entry) -> None:
+        """Add an entry to the start of the list
+
+        :param entry: The entry
+        :return: None
+        """
+
+        if not self._blocks or len(self._blocks[0]) >= self.block_size:
+            self._blocks.insert(0, [])
+            self._dirty = True
+
+        block = self._blocks[0]
+        block.insert(0, entry)
+
+        self._block_of[id(entry)] = block
+        self._len += 1
+
+        if not self._dirty:
+            # The first block starts one position earlier, the positions of the other blocks move with _shift
+            self._offsets[0] -= 1
+            self._shift -= 1
+
+    def extend(self, entries: Iterable) -> None:
+        """Add entries to the end of the list
+
+        :param Iterable entries: The entries
+        :return: None
+        """
+
+        for entry in entries:
+            self.append(entry)
+
+    def insert(self, position: int, entry) -> None:
+        """Insert an entry before the given position
+
+        :param int position: The position, positions past the end of the list add the entry to the end
+        :param entry: The entry
+        :return: None
+        """
+
+        self.insert_many(position, [entry])
+
+    def insert_many(self, position: int, entries: Iterable) -> None:
+        """Insert entries before the given position
+
+        :param int position: The position, positions past the end of the list add the entries to the end
+        :param Iterable entries: The entries, in the order they will appear in the list
+        :return: None
+        """
+
+        entries = list(entries)
+
+        if position < 0:
+            position = max(0, position + self._len)
+
+        if position >= self._len:
+            self.extend(entries)
+            return
+
+        if not entries:
+            return
+
+        block, offset = self._locate(position)
+        index = self._block_index[id(block)]
+
+        if len(block) + len(entries) <= self.block_size:
+            block[offset:offset] = entries
+
+            for entry in entries:
+                self._block_of[id(entry)] = block
+
+            self._move_offsets(index + 1, len(entries))
+
+        else:
+            # Split the block at the position and add blocks for the new entries
+            tail = block[offset:]
+            del block[offset:]
+
+            new_blocks = [entries[start:start + self.block_size] for start in range(0, len(entries), self.block_size)]
+            new_blocks.append(tail)
+
+            for new_block in new_blocks:
+                for entry in new_block:
+                    self._block_of[id(entry)] = new_block
+
+            self._blocks[index + 1:index + 1] = new_blocks
+
+            if not block:
+                del self._blocks[index]
+
+            self._dirty = True
+
+        self._len += len(entries)
+
+    def pop(self, position: int = -1):
+        """Remove and return the entry at the given position
+
+        :param int position: The position. Defaults to -1, the last entry
+        :raises IndexError: If the position is outside the list
+        :return: The entry
+        """
+
+        block, offset = self._locate(position)
+        index = self._block_index[id(block)]
+
+        entry = block.pop(offset)
+        del self._block_of[id(entry)]
+        self._len -= 1
+
+        self._move_offsets(index + 1, -1)
+        self._merge(index)
+
+        return entry
+
+    def popleft(self):
+        """Remove and return the first entry
+
+        :raises IndexError: If the list is empty
+        :return: The entry
+        """
+
+        if not self._len:
+            raise IndexError('pop from an empty IndexedList')
+
+        block = self._blocks[0]
+
+        entry = block.pop(0)
+        del self._block_of[id(entry)]
+        self._len -= 1
+
+        if not self._dirty:
+            # The first block starts one position later, the positions of the other blocks move with _shift
+            self._offsets[0] += 1
+            self._shift += 1
+
+        self._merge(0)
+
+        return entry
+
+    def index_of(self, entry) -> int:
+        """Get the position of an entry object
+
+        :param entry: An entry in the list
+        :raises ValueError: If the entry is not in the list
+        :return: The position of the entry
+        :rtype: int
+        """
+
+        block = self._block_of.get(id(entry))
+
+        if block is None:
+            raise ValueError('The entry is not in the list')
+
+        self._update()
+
+        for offset, candidate in enumerate(block):
+            if candidate is entry:
+                return self._offsets[self._block_index[id(block)]] - self._shift + offset
+
+        raise ValueError('The entry is not in the list')
+
+    def clear(self) -> None:
+        """Remove all entries
+
+        :return: None
+        """
+
+        self._blocks = []
+        self._block_of = {}
+        self._len = 0
+        self._dirty = True
+
+    def _merge(self, index: int) -> None:
+        """Merge a block which has fallen below half of block_size into a neighbouring block
+
+        Without this, removals would leave many small blocks and make finding
+        a position slower.  An empty block is removed.  A block is only
+        merged into a neighbour with room for all of its entries.
+
+        :param int index: The index of the block entries were removed from
+        :return: None
+        """
+
+        block = self._blocks[index]
+
+        if len(block) >= self.block_size // 2:
+            return
+
+        if not block:
+            del self._blocks[index]
+            self._dirty = True
+            return
+
+        for neighbour_index in (index + 1, index - 1):
+            has_room = 0 <= neighbour_index < len(self._blocks) and len(self._blocks[neighbour_index]) + len(block) <= self.block_size
+
+            if has_room:
+                break
+        else:
+            return
+
+        neighbour = self._blocks[neighbour_index]
+
+        if neighbour_index > index:
+            neighbour[0:0] = block
+        else:
+            neighbour.extend(block)
+
+        for entry in block:
+            self._block_of[id(entry)] = neighbour
+
+        del self._blocks[index]
+        self._dirty = True
+
+    def _locate(self, position: int) -> tuple:
+        """Find the block and offset in the block of a position"""
+
+        if position < 0:
+            position += self._len
+
+        if position < 0 or position >= self._len:
+            raise IndexError('IndexedList index out of range')
+
+        self._update()
+
+        position += self._shift
+        index = bisect_right(self._offsets, position) - 1
+
+        return self._blocks[index], position - self._offsets[index]
+
+    def _move_offsets(self, index: int, change: int) -> None:
+        """Move the offsets of the blocks from index onwards after entries were added or removed before them"""
+
+        if not self._dirty and index < len(self._offsets):
+            offsets = self._offsets
+            offsets[index:] = [offset + change for offset in offsets[index:]]
+
+    def _update(self) -> None:
+        """Rebuild the block offsets after the blocks have changed"""
+
+        if not self._dirty:
+            return
+
+        offsets = []
+        block_index = {}
+        total = 0
+
+        for index, block in enumerate(self._blocks):
+            offsets.append(total)
+            block_index[id(block)] = index
+            total += len(block)
+
+        self._offsets = offsets
+        self._block_index = block_index
+        self._shift = 0
+        self._dirty = False
@@ -0,0 +1,305 @@
+from queue import PriorityQueue
+import itertools
+import logging
+import threading
+
+from . import controller
+from .media_queue import MediaQueue
+
+PRIORITY_NEXT_TRACKS = 0
+"""Priority of the first batch of a job, these tracks will be played soon"""
+
+PRIORITY_BACKFILL = 10
+"""Priority of the remaining batches of a job"""
+
+
+class CancellationToken:
+    """Signal that a job should stop
+
+    Jobs check the token between batches, so a cancelled job never stops
+    part way through updating a queue.
+    """
+
+    def __init__(self) -> None:
+        """
+        :return: None
+        """
+
+        self._cancelled = threading.Event()
+
+    def cancel(self) -> None:
+        """Request cancellation
+
+        :return: None
+        """
+
+        self._cancelled.set()
+
+    @property
+    def cancelled(self) -> bool:
+        """True once cancellation has been requested"""
+
+        return self._cancelled.is_set()
+
+
+class LoadJob:
+    """A list of songs to add to a MediaQueue
+
+    The songs are added in batches by a QueueLoader.
+    """
+
+    def __init__(self, media_queue: MediaQueue, song_list: 'list[dict]', batch_size: int = 200, description: str = '') -> None:
+        """
+        :param MediaQueue media_queue: The queue to add the songs to
+        :param list[dict] song_list: The song dictionaries to add
+        :param int batch_size: The number of songs added at a time. Defaults to 200
+        :param str description: A description of the job used in logs and progress reports. Defaults to ''
+        :return: None
+        """
+
+        self.media_queue = media_queue
+        self.song_list = song_list
+        self.batch_size = max(1, int(batch_size))
+        self.description = description
+
+        self.token = CancellationToken()
+        """Cancels the job"""
+
+        self.loaded: int = 0
+        """Number of songs added to the queue"""
+
+        self.total: int = len(song_list)
+        """Number of songs in the job"""
+
+        self.error: Exception = None
+        """The exception which stopped the job, if any"""
+
+        self.done = threading.Event()
+        """Set when the job has finished, failed or been cancelled"""
+
+        # Held while a batch is added so that cancel() can wait for the queue to be consistent
+        self._batch_lock = threading.Lock()
+
+    @property
+    def priority(self) -> int:
+        """The priority of the next batch, lower values run first"""
+
+        return PRIORITY_NEXT_TRACKS if self.loaded == 0 else PRIORITY_BACKFILL
+
+    def run_batch(self) -> bool:
+        """Add the next batch of songs to the queue
+
+        :return: True if the job has finished
+        :rtype: bool
+        """
+
+        with self._batch_lock:
+            if self.token.cancelled:
+                return True
+
+            batch = self.song_list[self.loaded:self.loaded + self.batch_size]
+            first_batch = self.loaded == 0
+
+            controller.enqueue_song_references(self.media_queue, batch)
+            self.loaded += len(batch)
+
+            finished = self.loaded >= self.total
+
+            if first_batch:
+                # Prepare the tracks that will be played next
+                self.media_queue.hydrate()
+
+            if finished:
+                self.song_list = []
+                self.done.set()
+
+            return finished
+
+    def fail(self, error: Exception) -> None:
+        """Stop the job after an error
+
+        :param Exception error: The error
+        :return: None
+        """
+
+        self.error = error
+        self.song_list = []
+        self.done.set()
+
+    def cancel(self) -> None:
+        """Cancel the job
+
+        Waits for a batch which is being added to complete, the job makes no
+        further changes to the queue once this returns.
+
+        :return: None
+        """
+
+        self.token.cancel()
+
+        with self._batch_lock:
+            self.song_list = []
+            self.done.set()
+
+    def progress(self) -> dict:
+        """Get the progress of the job
+
+        :return: A dictionary containing the description, songs loaded, total songs and state of the job
+        :rtype: dict
+        """
+
+        if self.error is not None:
+            state = 'failed'
+        elif self.loaded >= self.total and self.done.is_set():
+            state = 'finished'
+        elif self.token.cancelled:
+            state = 'cancelled'
+        else:
+            state = 'loading'
+
+        return {'description': self.description, 'loaded': self.loaded, 'total': self.total, 'state': state}
+
+
+class QueueLoader:
+    """Long lived service which fills play queues in the background
+
+    Handlers add the first tracks to the queue themselves and pass the rest
+    of the song list to the loader.  Jobs are split into batches, the first
+    batch of a job runs before the backfill batches of older jobs.  Starting
+    a new job for a queue cancels the jobs already running for it.
+    """
+
+    def __init__(self, workers: int = 1, batch_size: int = 200) -> None:
+        """
+        :param int workers: The number of loader threads. Defaults to 1
+        :param int batch_size: The number of songs added to a queue at a time. Defaults to 200
+        :return: None
+        """
+
+        self.logger = logging.getLogger(__name__)
+
+        self.workers = max(1, int(workers))
+        self.batch_size = batch_size
+
+        self._jobs: PriorityQueue = PriorityQueue()
+        self._sequence = itertools.count()
+        self._active: dict = {}
+        self._lock = threading.Lock()
+        self._threads: list = []
+
+    def start(self) -> None:
+        """Start the loader threads
+
+        :return: None
+        """
+
+        if self._threads:
+            return
+
+        for number in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f'queue-loader-{number}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self) -> None:
+        """Cancel all jobs and stop the loader threads
+
+        :return: None
+        """
+
+        for key in list(self._active):
+            self.cancel(key)
+
+        for _ in self._threads:
+            # Sentinels sort after every job
+            self._jobs.put((float('inf'), next(self._sequence), None))
+
+        for thread in self._threads:
+            thread.join()
+
+        self._threads = []
+
+    def load(self, media_queue: MediaQueue, song_list: 'list[dict]', key: str = 'default', description: str = '') -> LoadJob:
+        """Add songs to a queue in the background
+
+        Jobs already running with the same key are cancelled first.
+
+        :param MediaQueue media_queue: The queue to add the songs to
+        :param list[dict] song_list: The song dictionaries to add
+        :param str key: Identifies the queue, for example the device playing it. Defaults to 'default'
+        :param str description: A description used in logs and progress reports. Defaults to ''
+        :return: The new job
+        :rtype: LoadJob
+        """
+
+        self.cancel(key)
+
+        job = LoadJob(media_queue, song_list, self.batch_size, description)
+
+        with self._lock:
+            self._active[key] = job
+
+        self.logger.debug(f'Loading {job.total} songs for {key}: {description}')
+        self._schedule(job)
+
+        return job
+
+    def cancel(self, key: str = 'default') -> bool:
+        """Cancel the job running for a queue
+
+        Returns once the job will make no further changes to the queue, so the
+        queue can be cleared safely.
+
+        :param str key: Identifies the queue. Defaults to 'default'
+        :return: True if a job was cancelled
+        :rtype: bool
+        """
+
+        with self._lock:
+            job = self._active.pop(key, None)
+
+        if job is None or job.done.is_set():
+            return False
+
+        job.cancel()
+        self.logger.debug(f'Cancelled loading for {key} after {job.loaded} of {job.total} songs')
+
+        return True
+
+    def progress(self) -> dict:
+        """Get the progress of the most recent job for each queue
+
+        :return: A dictionary of job progress keyed by queue
+        :rtype: dict
+        """
+
+        with self._lock:
+            return {key: job.progress() for key, job in self._active.items()}
+
+    def _schedule(self, job: LoadJob) -> None:
+        self._jobs.put((job.priority, next(self._sequence), job))
+
+    def _run(self) -> None:
+        while True:
+            _, _, job = self._jobs.get()
+
+            if job is None:
+                break
+
+            if job.done.is_set():
+                continue
+
+            try:
+                finished = job.run_batch()
+
+            except Exception as e:
+                self.logger.error(f'Loading {job.description} failed after {job.loaded} of {job.total} songs: {e}')
+                job.fail(e)
+                continue
+
+            if finished:
+                if not job.token.cancelled:
+                    self.logger.debug(f'Finished loading {job.total} songs: {job.description}')
+            else:
+                # Requeue the job so that more urgent batches can run first
+                self._schedule(job)
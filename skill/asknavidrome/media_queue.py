@@ -1,45 +1,205 @@
 from collections import deque
-from copy import deepcopy
+from functools import wraps
+from itertools import islice
+from typing import Callable, Iterable, Union
 import logging
 import random
+import threading
 
+from .history import HistoryLog
+from .indexed_list import IndexedList
+from .smart_shuffle import smart_shuffle
 from .track import Track
 
+HISTORY_FIELDS = ('id', 'title', 'artist', 'artist_id', 'album', 'album_id',
+                  'track_no', 'year', 'genre', 'duration', 'bitrate')
+"""Track attributes kept in the history, the stream URI and offset are not needed to replay a track"""
+
+
+def synchronised(method: Callable) -> Callable:
+    """Decorator holding the queue lock while a method runs"""
+
+    @wraps(method)
+    def locked(self, *args, **kwargs):
+        with self._lock:
+            return method(self, *args, **kwargs)
+
+    return locked
+
+
+def modifies(method: Callable) -> Callable:
+    """Decorator counting changes to the queue, used inside synchronised"""
+
+    @wraps(method)
+    def counted(self, *args, **kwargs):
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            self.version += 1
+
+    return counted
+
+
+def restructures(method: Callable) -> Callable:
+    """Decorator for methods changing the entries of the queue, not only moving through it
+
+    The next snapshot of the queue has to hold the whole queue instead of a delta.
+    """
+
+    @wraps(method)
+    def rebased(self, *args, **kwargs):
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            self._rebase()
+
+    return rebased
+
+
+def _entry_id(entry) -> str:
+    """Get the ID of a queue entry, a Track or song dictionary"""
+
+    if isinstance(entry, dict):
+        return entry.get('id')
+
+    return entry.id
+
+
+def _encode_entry(entry) -> dict:
+    """Convert a queue entry to a dictionary which can be saved as JSON"""
+
+    if isinstance(entry, dict):
+        return {'song': entry}
+
+    return {'track': entry.to_dict()}
+
+
+def _decode_entry(entry: dict):
+    """Convert a dictionary created by _encode_entry() back to a queue entry"""
+
+    if 'song' in entry:
+        return entry['song']
+
+    return Track.from_dict(entry['track'])
+
+
+def _history_record(track: Track) -> tuple:
+    """Convert a track to a compact history record"""
+
+    return tuple(getattr(track, field) for field in HISTORY_FIELDS)
+
+
+def _history_track(record) -> Track:
+    """Convert a history record back to a track"""
+
+    return Track(**dict(zip(HISTORY_FIELDS, record)))
+
+
+def _link(previous_id: str, tracks: list) -> str:
+    """Set the previous_id of each Track in a list
+
+    Song dictionaries are linked when they are hydrated.
+
+    :param str previous_id: The ID of the entry before the first track
+    :param list tracks: Track objects or song dictionaries
+    :return: The ID of the last entry
+    :rtype: str
+    """
+
+    for track in tracks:
+        if not isinstance(track, dict):
+            track.previous_id = previous_id
+
+        previous_id = _entry_id(track)
+
+    return previous_id
+
 
 class MediaQueue:
     """ The MediaQueue class
 
-    This class provides a queue based on a Python deque.  This is used to store
-    the tracks in the current play queue
+    This class provides a queue based on an IndexedList, which allows tracks to
+    be inserted and removed at any position.  This is used to store the tracks
+    in the current play queue
+
+    The queue can hold song dictionaries as well as Track objects.  Song
+    dictionaries are hydrated, turned into Track objects by the hydrator, when
+    they come within hydration_window tracks of the front of the queue.  This
+    keeps large play queues small and avoids creating tracks that are never
+    reached.
+
+    The history holds at most history_size tracks as compact records, older
+    records are moved to the history log, if one is given, and read back when
+    playback goes back past the start of the history.
+
+    Every method holds the queue lock, so a queue can be shared by the
+    request handlers and the background loader in one process.  Methods such
+    as get_next_track() and replace() update the queue and return the result
+    in a single step.
     """
 
-    def __init__(self) -> None:
+    def __init__(self, hydrator: Callable[[dict], Track] = None, hydration_window: int = 5,
+                 history_size: int = 100, history_log: str = None) -> None:
         """
+        :param Callable hydrator: A function creating a Track object from a song dictionary,
+                                  required if song dictionaries are added to the queue. Defaults to None
+        :param int hydration_window: The number of tracks at the front of the queue that are kept hydrated. Defaults to 5
+        :param int history_size: The number of played tracks kept in memory. Defaults to 100
+        :param str history_log: File older played tracks are moved to, None discards them. Defaults to None
         :return: None
         """
 
         self.logger = logging.getLogger(__name__)
         """Logger"""
 
-        self.queue: deque = deque()
-        """Deque containing tracks still to be played"""
+        self.queue: IndexedList = IndexedList()
+        """IndexedList containing tracks still to be played"""
+
+        self.history: deque = deque(maxlen=max(1, int(history_size)))
+        """Deque to hold history records of the most recent tracks that have already been played"""
 
-        self.history: deque = deque()
-        """Deque to hold tracks that have already been played"""
+        self.history_log: HistoryLog = HistoryLog(history_log) if history_log else None
+        """Log holding history records which no longer fit in self.history"""
 
-        self.buffer: deque = deque()
-        """Deque to contain the list of tracks to be enqueued
+        self.buffer_position: int = 0
+        """The number of tracks at the front of the queue already sent to Amazon
 
-        This deque is created from self.queue when actions such as next or
-        previous are performed.  This is because Amazon can send the
-        PlaybackNearlyFinished request early.  Without self.buffer, this would
-        change self.current_track causing us to lose the real position of the
+        The buffer is the part of self.queue after this position, the tracks
+        still to be enqueued.  Amazon can send the PlaybackNearlyFinished
+        request early, so enqueuing a track moves this position instead of
+        changing self.current_track, which would lose the real position of the
         queue.
         """
 
         self.current_track: Track = Track()
         """Property to hold the current track object"""
 
+        # Queue entries keyed by token, the ID used as the Alexa stream token.  The queue
+        # finds the position of an entry, so the index is unchanged when tracks move.
+        # Tokens found more than once hold a list of entries.
+        self._index: dict = {}
+
+        self.hydrator = hydrator
+        """Function used to create Track objects from song dictionaries"""
+
+        self.hydration_window: int = max(1, int(hydration_window))
+        """The number of tracks at the front of the queue that are kept hydrated"""
+
+        self.shuffled: bool = False
+        """True after shuffle() until the queue is cleared, new tracks are added in random positions"""
+
+        self.version: int = 0
+        """Incremented each time the queue is changed, used to find queues which need to be saved"""
+
+        # Snapshots after the first hold a delta from the state returned by get_state(), the number of
+        # entries taken from the front of that queue and the number of entries put back in front of it
+        self._base: int = 0
+        self._base_skip: int = 0
+        self._base_head: int = 0
+
+        self._lock = threading.RLock()
+
+    @synchronised
     def get_current_track(self) -> Track:
         """Method to return current_track attribute
 
@@ -52,6 +212,8 @@ class MediaQueue:
         """
         return self.current_track
 
+    @synchronised
+    @modifies
     def set_current_track_offset(self, offset: int) -> None:
         """Method to set the offset of the current track in milliseconds
 
@@ -65,105 +227,340 @@ class MediaQueue:
 
         self.current_track.offset = offset
 
+    @synchronised
     def get_current_queue(self) -> deque:
         """Get the current queue
 
-        Returns a deque containing the current queue of music to be played
+        Returns a copy of the current queue of music to be played
 
         :return: The current queue
         :rtype: deque
         """
 
-        return self.queue
+        return deque(self.queue)
 
+    @synchronised
     def get_buffer(self) -> deque:
         """Get the buffer
 
-        Returns a deque containing the current buffer
+        Returns a copy of the current buffer
 
         :return: The current buffer
         :rtype: deque
         """
 
-        return self.buffer
+        return deque(islice(self.queue, self.buffer_position, None))
 
+    @synchronised
     def get_history(self) -> deque:
         """Get history
 
-        Returns a deque of tracks that have already been played
+        Returns a copy of the tracks that have already been played
 
         :return: A deque container tracks that have already been played
         :rtype: deque
         """
 
-        return self.history
+        return deque(_history_track(record) for record in self.history)
 
+    @synchronised
     def add_track(self, track: Track) -> None:
         """Add tracks to the queue
 
+        Use add_tracks() to add more than one track.
+
         :param Track track: A Track object containing details of the track to be played
         :return: None
         """
 
         self.logger.debug('In add_track()')
 
-        if not self.queue:
-            # This is the first track in the queue
-            self.queue.append(track)
+        self.add_tracks([track])
+
+    @synchronised
+    @modifies
+    @restructures
+    def add_tracks(self, tracks: Iterable) -> int:
+        """Add tracks to the end of the queue
+
+        The previous_id of each track is linked in a single pass, and the
+        tracks are added with a single call so a shared queue is only locked,
+        or contacted through a manager, once per batch.
+
+        :param Iterable tracks: Track objects or song dictionaries
+        :return: The number of tracks added
+        :rtype: int
+        """
+
+        self.logger.debug('In add_tracks()')
+
+        tracks = list(tracks)
+
+        if self.shuffled:
+            self._shuffle_in(tracks)
+            self.logger.debug(f'In add_tracks() - shuffled in {len(tracks)} tracks')
+
+            return len(tracks)
+
+        if self.queue:
+            previous_id = _entry_id(self.queue[-1])
         else:
-            # There are already tracks in the queue, ensure previous_id is set
+            # The first track in the queue follows the current track
+            previous_id = self.current_track.id
+
+        _link(previous_id, tracks)
+
+        for entry in tracks:
+            self._index_add(_entry_id(entry), entry)
+
+        self.queue.extend(tracks)
 
-            # Get the last track from the deque
-            prev_track = self.queue.pop()
+        self.logger.debug(f'In add_tracks() - there are {len(self.queue)} tracks in the queue')
 
-            # Set the previous_id attribute
-            track.previous_id = prev_track.id
+        return len(tracks)
 
-            # Return the previous track to the deque
-            self.queue.append(prev_track)
+    @synchronised
+    def extend_left(self, tracks: Iterable) -> int:
+        """Add tracks to the front of the queue
 
-            # Add the new track to the deque
-            self.queue.append(track)
+        The tracks are played next, in the order given.
 
-        self.logger.debug(f'In add_track() - there are {len(self.queue)} tracks in the queue')
+        :param Iterable tracks: Track objects or song dictionaries
+        :return: The number of tracks added
+        :rtype: int
+        """
+
+        self.logger.debug('In extend_left()')
+
+        return self.insert_tracks(0, tracks)
+
+    @synchronised
+    @modifies
+    @restructures
+    def insert_tracks(self, position: int, tracks: Iterable) -> int:
+        """Insert tracks into the queue
+
+        The inserted tracks and the track after them are linked in a single
+        pass.  When the tracks are inserted before the buffer cursor the
+        buffer is moved back to the insert position, so the new tracks are
+        enqueued next.
+
+        :param int position: The position in the queue to insert the tracks at, 0 is the next track
+        :param Iterable tracks: Track objects or song dictionaries
+        :return: The number of tracks added
+        :rtype: int
+        """
 
-    def shuffle(self) -> None:
+        self.logger.debug('In insert_tracks()')
+
+        tracks = list(tracks)
+        position = max(0, min(position, len(self.queue)))
+
+        if not tracks:
+            return 0
+
+        if position > 0:
+            previous_id = _entry_id(self.queue[position - 1])
+        else:
+            previous_id = self.current_track.id
+
+        previous_id = _link(previous_id, tracks)
+
+        if position < len(self.queue):
+            # Link the track which now follows the inserted tracks
+            _link(previous_id, [self.queue[position]])
+
+        for entry in tracks:
+            self._index_add(_entry_id(entry), entry)
+
+        self.queue.insert_many(position, tracks)
+
+        self.buffer_position = min(self.buffer_position, position)
+
+        self.logger.debug(f'In insert_tracks() - there are {len(self.queue)} tracks in the queue')
+
+        return len(tracks)
+
+    @synchronised
+    @modifies
+    @restructures
+    def add_songs(self, song_list: 'list[dict]') -> None:
+        """Add song dictionaries to the queue
+
+        The songs are hydrated as they approach the front of the queue, adding
+        them in a single call avoids a round trip to the queue for every track.
+
+        :param list[dict] song_list: Song dictionaries as returned by the Subsonic API
+        :return: None
+        """
+
+        self.logger.debug('In add_songs()')
+
+        if self.shuffled:
+            self._shuffle_in(list(song_list))
+        else:
+            for entry in song_list:
+                self._index_add(entry.get('id'), entry)
+
+            self.queue.extend(song_list)
+
+        self.logger.debug(f'In add_songs() - there are {len(self.queue)} tracks in the queue')
+
+    @synchronised
+    def hydrate(self) -> int:
+        """Hydrate the tracks within the hydration window
+
+        Called as playback advances so that the next tracks are ready
+        before they are requested.
+
+        :return: The number of tracks hydrated
+        :rtype: int
+        """
+
+        self.logger.debug('In hydrate()')
+
+        # The window starts at the next track to be enqueued
+        hydrated = self._hydrate_window(self.queue, self.buffer_position + self.hydration_window)
+
+        if hydrated:
+            self.logger.debug(f'In hydrate() - hydrated {hydrated} tracks')
+
+        return hydrated
+
+    def _hydrate_window(self, entries: IndexedList, count: int) -> int:
+        """Replace song dictionaries at the front of the queue with Track objects
+
+        The previous_id of each new track is the ID of the entry before it, or
+        of the current track for the first entry.
+
+        :param IndexedList entries: The queue
+        :param int count: The number of entries to hydrate
+        :return: The number of tracks hydrated
+        :rtype: int
+        """
+
+        hydrated = 0
+        previous_id = self.current_track.id
+
+        for position in range(min(count, len(entries))):
+            entry = entries[position]
+
+            if isinstance(entry, dict):
+                song = entry
+                entry = self.hydrator(song)
+                entry.previous_id = previous_id
+                entries[position] = entry
+                self._index_replace(song.get('id'), song, entry)
+                hydrated += 1
+
+            previous_id = entry.id
+
+        return hydrated
+
+    @synchronised
+    def replace(self, tracks: list) -> Track:
+        """Replace the queue and start playing it
+
+        Clears the queue, history and buffer, adds the given tracks and moves
+        to the first one as a single step.
+
+        :param list tracks: Track objects or song dictionaries to play
+        :return: The first track, now the current track
+        :rtype: Track
+        """
+
+        self.logger.debug('In replace()')
+
+        self.clear()
+        self.add_tracks(tracks)
+
+        return self.get_next_track()
+
+    @synchronised
+    @modifies
+    @restructures
+    def shuffle(self, smart: bool = False) -> None:
         """Shuffle the queue
 
-        Shuffles the queue and resets the previous track IDs required for the ENQUEUE PlayBehaviour
+        Shuffles the tracks still to be enqueued and resets the previous track IDs required for the
+        ENQUEUE PlayBehaviour.  Tracks already sent to Amazon stay at the front of the queue.
+        The queue stays in shuffle mode until it is cleared, tracks added later are
+        inserted at random positions among the tracks still to be enqueued.
 
+        :param bool smart: Keep songs by the same artist and from the same album apart. Defaults to False
         :return: None
         """
 
-        self.logger.debug('In shuffle()')
+        self.logger.debug(f'In shuffle() - smart: {smart}')
+
+        # Shuffling a list avoids indexing into the middle of the queue
+        enqueued = list(islice(self.queue, self.buffer_position))
+        entries = list(islice(self.queue, self.buffer_position, None))
+
+        if smart:
+            entries = smart_shuffle(entries)
+        else:
+            random.shuffle(entries)
 
-        # Copy the original queue
-        orig = self.queue
-        new_queue = deque()
+        _link(_entry_id(enqueued[-1]) if enqueued else self.current_track.id, entries)
+        self.queue = IndexedList(enqueued + entries)
 
-        # Randomise the queue
-        random.shuffle(orig)
+        self.shuffled = True
 
-        track_id = None
+    def _shuffle_in(self, entries: list) -> None:
+        """Insert entries at random positions in the buffer
+
+        Each entry is appended and swapped with a random entry after the buffer
+        cursor, an incremental Fisher-Yates shuffle which keeps the tracks still
+        to be enqueued in a uniformly random order however late they arrive.
+
+        :param list entries: Track objects or song dictionaries
+        :return: None
+        """
 
-        for t in orig:
-            if not new_queue:
-                # This is the first track, get the ID and add it
-                track_id = t.id
-                new_queue.append(t)
+        start = self.buffer_position
+
+        for entry in entries:
+            end = len(self.queue)
+            position = random.randint(min(start, end), end)
+
+            if position == end:
+                self.queue.append(entry)
             else:
-                # Set the tracks previous_id
-                t.previous_id = track_id
+                # Move the entry at the position to the end
+                moved = self.queue[position]
+                self.queue[position] = entry
+                self.queue.append(moved)
+
+                self._relink(position)
+                self._relink(position + 1)
+
+            self._index_add(_entry_id(entry), entry)
+            self._relink(end)
+
+    def _relink(self, position: int) -> None:
+        """Set the previous_id of the track at a position in the queue
+
+        :param int position: The position in the queue
+        :return: None
+        """
+
+        if position >= len(self.queue):
+            return
 
-                # Get the track ID to use as the next previous_id
-                track_id = t.id
+        entry = self.queue[position]
 
-                # Add the track to the queue
-                new_queue.append(t)
+        if isinstance(entry, dict):
+            # Song dictionaries are linked when they are hydrated
+            return
 
-        # Replace the original queue with the new shuffled one
-        self.queue = new_queue
+        if position > 0:
+            entry.previous_id = _entry_id(self.queue[position - 1])
+        else:
+            entry.previous_id = self.current_track.id
 
+    @synchronised
+    @modifies
     def get_next_track(self) -> Track:
         """Get the next track
 
@@ -175,19 +572,24 @@ class MediaQueue:
 
         self.logger.debug('In get_next_track()')
 
+        # Playback may have moved past the hydration window
+        self._hydrate_window(self.queue, 1)
+
         if self.current_track.id == '' or self.current_track.id is None:
             # This is the first track
-            self.current_track = self.queue.popleft()
+            self.current_track = self._pop_front()
         else:
             # This is not the first track
-            self.history.append(self.current_track)
-            self.current_track = self.queue.popleft()
+            self._add_history(self.current_track)
+            self.current_track = self._pop_front()
 
         # Set the buffer to match the queue
         self.sync()
 
         return self.current_track
 
+    @synchronised
+    @modifies
     def get_previous_track(self) -> Track:
         """Get the previous track
 
@@ -200,17 +602,28 @@ class MediaQueue:
 
         self.logger.debug('In get_previous_track()')
 
+        if not self.history and self.history_log is not None:
+            # Page older tracks back in from the log
+            self.history.extend(tuple(record) for record in self.history_log.pop(self.history.maxlen // 2 or 1))
+
+        previous_track = _history_track(self.history.pop())
+
         # Return the current track to the queue
+        self._index_add(self.current_track.id, self.current_track)
         self.queue.appendleft(self.current_track)
+        self._base_head += 1
 
         # Set the new current track
-        self.current_track = self.history.pop()
+        self.current_track = previous_track
+        _link(self.current_track.id, [self.queue[0]])
 
         # Set the buffer to match the queue
         self.sync()
 
         return self.current_track
 
+    @synchronised
+    @modifies
     def enqueue_next_track(self) -> Track:
         """Get the next buffered track
 
@@ -218,16 +631,357 @@ class MediaQueue:
         attribute.  This allows Amazon to send the PlaybackNearlyFinished
         request early to queue the next track while maintaining the playlist
 
+        :raises IndexError: If there are no tracks left in the buffer
         :return: The next track to be played
         :rtype: Track
         """
 
         self.logger.debug('In enqueue_next_track()')
 
-        return self.buffer.popleft()
+        if self.buffer_position >= len(self.queue):
+            raise IndexError('The buffer is empty')
+
+        self._hydrate_window(self.queue, self.buffer_position + 1)
+
+        track = self.queue[self.buffer_position]
+        self.buffer_position += 1
+
+        return track
+
+    @synchronised
+    def find(self, token: str) -> int:
+        """Find the position of a track in the queue
+
+        When the token is in the queue more than once the first position is returned.
 
+        :param str token: The stream token of the track, its ID
+        :return: The position in the queue, 0 is the next track, -1 if it is the current track
+                 and None if the track is not in the queue
+        :rtype: int | None
+        """
+
+        if token and token == self.current_track.id:
+            return -1
+
+        entries = self._index.get(token)
+
+        if entries is None:
+            return None
+
+        if isinstance(entries, list):
+            return min(self.queue.index_of(entry) for entry in entries)
+
+        return self.queue.index_of(entries)
+
+    @synchronised
+    @modifies
+    def jump_to(self, token: str) -> Track:
+        """Make the track with the given token the current track
+
+        Tracks before it are moved to the history as if they had been played.
+
+        :param str token: The stream token of the track, its ID
+        :raises KeyError: If the track is not in the queue
+        :return: The new current track
+        :rtype: Track
+        """
+
+        self.logger.debug('In jump_to()')
+
+        position = self.find(token)
+
+        if position is None:
+            raise KeyError(f'Track {token} is not in the queue')
+
+        if position < 0:
+            return self.current_track
+
+        return self.jump_to_position(position)
+
+    @synchronised
+    @modifies
+    def jump_to_position(self, position: int) -> Track:
+        """Make the track at the given position the current track
+
+        Tracks before it are moved to the history as if they had been played.
+
+        :param int position: The position in the queue, 0 is the next track
+        :raises IndexError: If the position is outside the queue
+        :return: The new current track
+        :rtype: Track
+        """
+
+        self.logger.debug('In jump_to_position()')
+
+        if position < 0 or position >= len(self.queue):
+            raise IndexError(f'There is no track at position {position} in the queue')
+
+        for _ in range(position):
+            # Skipped tracks are hydrated so they can be added to the history
+            self._hydrate_window(self.queue, 1)
+
+            if self.current_track.id:
+                self._add_history(self.current_track)
+
+            self.current_track = self._pop_front()
+
+        return self.get_next_track()
+
+    @synchronised
+    @modifies
+    @restructures
+    def remove_at(self, position: int):
+        """Remove the track at the given position
+
+        The track after it is linked to the track before it.
+
+        :param int position: The position in the queue, 0 is the next track
+        :raises IndexError: If the position is outside the queue
+        :return: The removed Track object or song dictionary
+        """
+
+        self.logger.debug('In remove_at()')
+
+        entry = self.queue.pop(position)
+        self._index_remove(_entry_id(entry), entry)
+
+        if position < 0:
+            position += len(self.queue) + 1
+
+        self._relink(position)
+
+        if position < self.buffer_position:
+            self.buffer_position -= 1
+
+        return entry
+
+    @synchronised
+    @modifies
+    def reconcile(self, token: str) -> Track:
+        """Move the queue to the track an AudioPlayer event says is playing
+
+        Used by PlaybackStarted and PlaybackNearlyFinished, which are sent for
+        the track that is playing.  When the token belongs to a track which
+        has already been enqueued on the device, because a PlaybackFinished
+        event was missed, the queue is moved forward to it.  Tokens of tracks
+        which have not been sent to the device never move the queue, so
+        events for a track returned to the queue by get_previous_track() or
+        for a later copy of the same song are ignored.
+
+        :param str token: The stream token from the event
+        :return: The current track
+        :rtype: Track
+        """
+
+        self.logger.debug('In reconcile()')
+
+        if not token or token == self.current_track.id:
+            return self.current_track
+
+        position = self._find_enqueued(token)
+
+        if position is None:
+            self.logger.warning(f'Track {token} from the AudioPlayer event has not been enqueued')
+
+            return self.current_track
+
+        self.logger.info(f'Moving the queue forward {position + 1} tracks to match playback')
+
+        # Tracks enqueued after the one playing are still held by the device
+        enqueued = self.buffer_position - position - 1
+        self.jump_to_position(position)
+        self.buffer_position = enqueued
+
+        return self.current_track
+
+    @synchronised
+    @modifies
+    def skip_failed(self, token: str) -> Track:
+        """Move the queue past a track which failed to play
+
+        Used by PlaybackFailed, which may be sent for a track already enqueued
+        on the device rather than the current track.  The queue is first moved
+        to the failed track, as reconcile() does, and then to the track after
+        it.  A token which is neither the current track nor enqueued leaves
+        the queue where it is, so that no track is skipped.
+
+        :param str token: The stream token from the event, the current track is assumed if it is empty
+        :return: The track to play instead
+        :rtype: Track
+        """
+
+        self.logger.debug('In skip_failed()')
+
+        if token and token != self.current_track.id:
+            position = self._find_enqueued(token)
+
+            if position is None:
+                self.logger.warning(f'Failed track {token} is not the current or an enqueued track')
+
+                return self.current_track
+
+            self.jump_to_position(position)
+
+        return self.get_next_track()
+
+    def _find_enqueued(self, token: str) -> Union[int, None]:
+        """Find the first position of a token among the tracks already sent to Amazon
+
+        :param str token: The stream token of the track, its ID
+        :return: The position in the queue or None if the track has not been enqueued
+        :rtype: int | None
+        """
+
+        entries = self._index.get(token)
+
+        if entries is None:
+            return None
+
+        if not isinstance(entries, list):
+            entries = [entries]
+
+        positions = [position for position in map(self.queue.index_of, entries) if position < self.buffer_position]
+
+        return min(positions) if positions else None
+
+    @synchronised
+    def enqueue_after(self, token: str) -> Track:
+        """Get the track to enqueue after the track with the given token
+
+        Used by PlaybackNearlyFinished, which asks for the track after the one
+        playing.  A repeated event returns the same track again instead of
+        moving further through the buffer.
+
+        :param str token: The stream token of the track which is playing
+        :raises IndexError: If there are no tracks left in the queue
+        :return: The next track to be played
+        :rtype: Track
+        """
+
+        self.logger.debug('In enqueue_after()')
+
+        self.reconcile(token)
+
+        if token and token == self.current_track.id:
+            # The next track follows the current track
+            self.sync()
+
+        return self.enqueue_next_track()
+
+    @synchronised
+    def peek_after(self, token: str) -> Union[Track, None]:
+        """Get the track enqueue_after() will return for a token without changing the queue
+
+        Used to prepare the track to be enqueued while the track with the
+        given token is playing.
+
+        :param str token: The stream token of the track which is playing
+        :return: The next track to be played, or None if the token is not the current track or the queue is empty
+        :rtype: Track | None
+        """
+
+        if not token or token != self.current_track.id or not self.queue:
+            return None
+
+        self._hydrate_window(self.queue, 1)
+
+        return self.queue[0]
+
+    @synchronised
+    def get_version(self) -> int:
+        """Get the version of the queue
+
+        Added to allow access to the version while using BaseManager.
+
+        :return: A number incremented each time the queue is changed
+        :rtype: int
+        """
+
+        return self.version
+
+    @synchronised
+    def get_state(self) -> dict:
+        """Get the state of the queue
+
+        The state holds only dictionaries, lists and simple values so it can be
+        saved as JSON and passed through a manager.
+
+        Changes made afterwards are returned by get_delta().
+
+        :return: The base of later deltas, current track, queue, history, buffer position and shuffle mode
+        :rtype: dict
+        """
+
+        self._rebase()
+
+        return {'base': self._base,
+                'current_track': self.current_track.to_dict(),
+                'queue': [_encode_entry(entry) for entry in self.queue],
+                'history': [list(record) for record in self.history],
+                'buffer_position': self.buffer_position,
+                'shuffled': self.shuffled}
+
+    @synchronised
+    def get_delta(self, base: int) -> Union[dict, None]:
+        """Get the changes made since a state was returned by get_state()
+
+        Moving through the queue only takes entries from its front, and the
+        previous track puts them back, so the delta holds the position of the
+        queue instead of its entries.  Each delta replaces the one before.
+
+        :param int base: The base of the last state saved, the value of its base key
+        :return: The delta, or None if the entries have changed and the whole state has to be saved
+        :rtype: dict | None
+        """
+
+        if base != self._base:
+            return None
+
+        return {'base': self._base,
+                'skip': self._base_skip,
+                'head': [_encode_entry(entry) for entry in islice(self.queue, self._base_head)],
+                'current_track': self.current_track.to_dict(),
+                'history': [list(record) for record in self.history],
+                'buffer_position': self.buffer_position,
+                'shuffled': self.shuffled}
+
+    @synchronised
+    @modifies
+    @restructures
+    def set_state(self, state: dict) -> None:
+        """Restore a state created by get_state()
+
+        :param dict state: The state of a queue, with the latest delta from get_delta() under the delta key
+        :return: None
+        """
+
+        queue = [_decode_entry(entry) for entry in state.get('queue', [])]
+        delta = state.get('delta')
+
+        if delta is not None and delta.get('base') == state.get('base'):
+            queue = [_decode_entry(entry) for entry in delta.get('head', [])] + queue[delta.get('skip', 0):]
+            state = dict(state, **{key: value for key, value in delta.items() if key not in ('head', 'skip')})
+
+        self.current_track = Track.from_dict(state.get('current_track', {}))
+        self.queue = IndexedList(queue)
+        self.history.clear()
+
+        for record in state.get('history', []):
+            if isinstance(record, dict):
+                # States saved before history records were introduced
+                record = _history_record(_decode_entry(record))
+
+            self._add_history(tuple(record))
+
+        self.buffer_position = min(int(state.get('buffer_position', 0)), len(self.queue))
+        self.shuffled = bool(state.get('shuffled', False))
+        self._rebuild_index()
+
+    @synchronised
+    @modifies
+    @restructures
     def clear(self) -> None:
-        """Clear queue, history and buffer deques
+        """Clear queue, history and buffer
 
         :return: None
         """
@@ -235,8 +989,15 @@ class MediaQueue:
         self.logger.debug('In clear()')
         self.queue.clear()
         self.history.clear()
-        self.buffer.clear()
+        self.buffer_position = 0
+        self._index.clear()
+
+        if self.history_log is not None:
+            self.history_log.clear()
 
+        self.shuffled = False
+
+    @synchronised
     def get_queue_count(self) -> int:
         """Get the number of tracks in the queue
 
@@ -247,26 +1008,104 @@ class MediaQueue:
         self.logger.debug('In get_queue_count()')
         return len(self.queue)
 
+    @synchronised
     def get_history_count(self) -> int:
         """Get the number of tracks in the history deque
 
-        :return: The number of tracks in the history deque
+        :return: The number of tracks in the history deque and history log
         :rtype: int
         """
 
         self.logger.debug('In get_history_count()')
+
+        if self.history_log is not None:
+            return len(self.history) + self.history_log.count
+
         return len(self.history)
 
+    def _pop_front(self) -> Track:
+        """Remove the entry at the front of the queue and return it"""
+
+        track = self.queue.popleft()
+        self._index_remove(_entry_id(track), track)
+
+        if self._base_head:
+            self._base_head -= 1
+        else:
+            self._base_skip += 1
+
+        return track
+
+    def _rebase(self) -> None:
+        """Start a new base for snapshot deltas"""
+
+        self._base += 1
+        self._base_skip = 0
+        self._base_head = 0
+
+    def _index_add(self, token: str, entry) -> None:
+        entries = self._index.get(token)
+
+        if entries is None:
+            self._index[token] = entry
+        elif isinstance(entries, list):
+            entries.append(entry)
+        else:
+            self._index[token] = [entries, entry]
+
+    def _index_remove(self, token: str, entry) -> None:
+        entries = self._index.get(token)
+
+        if isinstance(entries, list):
+            entries[:] = [candidate for candidate in entries if candidate is not entry]
+
+            if len(entries) == 1:
+                self._index[token] = entries[0]
+
+        elif entries is entry:
+            del self._index[token]
+
+    def _index_replace(self, token: str, old, new) -> None:
+        entries = self._index.get(token)
+
+        if isinstance(entries, list):
+            entries[:] = [new if candidate is old else candidate for candidate in entries]
+
+        elif entries is old:
+            self._index[token] = new
+
+    def _rebuild_index(self) -> None:
+        self._index = {}
+
+        for entry in self.queue:
+            self._index_add(_entry_id(entry), entry)
+
+    def _add_history(self, entry) -> None:
+        """Add a track or history record to the history
+
+        The oldest record is moved to the history log when the history is full.
+
+        :param entry: A Track object or history record
+        :return: None
+        """
+
+        if len(self.history) == self.history.maxlen and self.history_log is not None:
+            self.history_log.push([list(self.history.popleft())])
+
+        self.history.append(entry if isinstance(entry, tuple) else _history_record(entry))
+
+    @synchronised
+    @modifies
     def sync(self) -> None:
         """Synchronise the buffer with the queue
 
-        Overwrite the buffer with the current queue.
+        Reset the buffer to the start of the current queue.
         This is useful when pausing or stopping to ensure
         the resulting PlaybackNearlyFinished request gets
-        the correct.  In practice this will have already
-        queued and there for missing from the current buffer
+        the correct track.  In practice this will have already
+        been queued and therefore missing from the current buffer
 
         :return: None
         """
 
-        self.buffer = deepcopy(self.queue)
+        self.buffer_position = 0
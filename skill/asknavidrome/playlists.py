@@ -0,0 +1,243 @@
+from collections import OrderedDict
+from typing import Union
+import logging
+import threading
+import time
+
+from .fuzzy import FuzzyIndex
+from .subsonic_api import SubsonicConnection, normalise_term
+from .sync import SyncReport
+
+
+def playlist_marker(playlist: dict) -> tuple:
+    """Get the values which change when a playlist is edited
+
+    :param dict playlist: A playlist dictionary
+    :return: The changed timestamp and song count of the playlist
+    :rtype: tuple
+    """
+
+    return playlist.get('changed'), playlist.get('songCount')
+
+
+class PlaylistDirectory:
+    """Cached directory of the playlists on the media server
+
+    Playlists are indexed by their normalised name so a playlist can be found
+    without downloading and scanning the list of playlists on every request.
+    The entries of played playlists are cached as well and are only requested
+    again when the changed timestamp of the playlist moves.
+
+    The directory is refreshed by a SyncScheduler, or when it is used and
+    is older than ttl seconds.
+    """
+
+    def __init__(self, connection: SubsonicConnection, ttl: float = 300, max_cached_playlists: int = 64) -> None:
+        """
+        :param SubsonicConnection connection: The connection used to list playlists and their entries
+        :param float ttl: Seconds after which the directory is refreshed when it is used, 0 disables this. Defaults to 300
+        :param int max_cached_playlists: The maximum number of playlist entry lists to cache. Defaults to 64
+        :return: None
+        """
+
+        self.logger = logging.getLogger(__name__)
+
+        self.connection = connection
+        self.ttl = float(ttl)
+        self.max_cached_playlists = max(1, int(max_cached_playlists))
+
+        self.playlists_by_id: dict = {}
+        self.playlists_by_name: dict = {}
+        self.playlist_fuzzy = FuzzyIndex()
+
+        self.last_refresh: float = 0
+        """time.monotonic() value of the last refresh, 0 if the directory has not been loaded"""
+
+        self.hits: int = 0
+        """Number of playlists whose entries were served from the cache"""
+
+        self.misses: int = 0
+        """Number of playlists whose entries were requested from the media server"""
+
+        # Entry lists keyed by playlist ID, each holding the marker of the playlist when it was fetched
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+
+    def refresh(self) -> int:
+        """Reload the list of playlists
+
+        Cached entry lists of playlists which have been changed or removed are dropped.
+
+        :return: The number of playlists added, changed or removed
+        :rtype: int
+        """
+
+        self.logger.debug('In refresh()')
+
+        with self._refresh_lock:
+            playlists = self.connection.get_playlists()
+
+            playlists_by_id = {}
+            playlists_by_name = {}
+            playlist_fuzzy = FuzzyIndex()
+
+            for playlist in playlists:
+                playlists_by_id[playlist.get('id')] = playlist
+                playlists_by_name.setdefault(normalise_term(playlist.get('name', '')), []).append(playlist)
+                playlist_fuzzy.add(playlist.get('name'), playlist)
+
+            previous = self.playlists_by_id
+            updated = len(set(previous) - set(playlists_by_id))
+
+            for playlist_id, playlist in playlists_by_id.items():
+                current = previous.get(playlist_id)
+
+                if current is None or playlist_marker(current) != playlist_marker(playlist) or current.get('name') != playlist.get('name'):
+                    updated += 1
+
+            with self._lock:
+                for playlist_id in list(self._entries):
+                    playlist = playlists_by_id.get(playlist_id)
+
+                    if playlist is None or playlist_marker(playlist) != self._entries[playlist_id][0]:
+                        del self._entries[playlist_id]
+
+                # Replace the indexes together so lookups never see a partial directory
+                self.playlists_by_id = playlists_by_id
+                self.playlists_by_name = playlists_by_name
+                self.playlist_fuzzy = playlist_fuzzy
+
+            self.last_refresh = time.monotonic()
+
+        self.logger.debug(f'Playlist directory refreshed: {len(playlists_by_id)} playlists, {updated} updated')
+
+        return updated
+
+    def sync_changes(self) -> SyncReport:
+        """Refresh the directory, called by a SyncScheduler
+
+        :return: A report of the number of playlists updated
+        :rtype: SyncReport
+        """
+
+        return SyncReport(playlists=self.refresh())
+
+    def _ensure_fresh(self) -> None:
+        """Refresh the directory if it has not been loaded or is older than ttl seconds"""
+
+        if self.last_refresh and (self.ttl <= 0 or time.monotonic() - self.last_refresh < self.ttl):
+            return
+
+        try:
+            self.refresh()
+
+        except Exception as e:
+            if not self.last_refresh:
+                raise
+
+            # A stale directory is more useful than none
+            self.logger.error(f'Could not refresh the playlist directory: {e}')
+
+    def search_playlist(self, term: str) -> Union[str, None]:
+        """Search the directory for the given playlist
+
+        :param str term: The name of the playlist
+        :return: The ID of the playlist or None if the playlist is not found
+        :rtype: str | None
+        """
+
+        self.logger.debug('In function search_playlist()')
+
+        self._ensure_fresh()
+
+        playlists = self.playlists_by_name.get(normalise_term(term), [])
+
+        if not playlists:
+            # Use the closest name, allowing for differences in how Alexa transcribes the name
+            matches = self.playlist_fuzzy.search(term, 2)
+
+            if len(matches) == 1 or (len(matches) > 1 and matches[0][0] > matches[1][0]):
+                self.logger.debug(f'Playlist {term} matched {matches[0][1].get("name")} with a score of {matches[0][0]:.2f}')
+                playlists = [matches[0][1]]
+
+        if len(playlists) == 1:
+            # We have matched the playlist return it
+            self.logger.debug(f'Found playlist {playlists[0].get("id")}')
+
+            return playlists[0].get('id')
+
+        elif len(playlists) > 1:
+            self.logger.error(f'More than one playlist called {term} was found, multiple playlists with the same name are not supported')
+
+        else:
+            self.logger.error(f'No playlist matching the name {term} was found!')
+
+        return None
+
+    def build_song_list_from_playlist(self, id: str) -> 'list[dict]':
+        """Build a list of songs from a given playlist
+
+        The entries are served from the cache while the playlist is unchanged.
+
+        :param str id: The playlist ID
+        :return: A list of song dictionaries
+        :rtype: list[dict]
+        """
+
+        self.logger.debug('In function build_song_list_from_playlist()')
+
+        self._ensure_fresh()
+
+        playlist = self.playlists_by_id.get(id)
+
+        with self._lock:
+            cached = self._entries.get(id)
+
+            if cached is not None and playlist is not None and cached[0] == playlist_marker(playlist):
+                self._entries.move_to_end(id)
+                self.hits += 1
+
+                # Callers may reorder the list, the cached copy is left untouched
+                return list(cached[1])
+
+            self.misses += 1
+
+        details = self.connection.get_playlist(id)
+        entries = details.get('entry', [])
+
+        # Compare against the directory listing, the marker is checked against it when the directory is refreshed
+        marker = playlist_marker(playlist if playlist is not None else details)
+
+        with self._lock:
+            self._entries[id] = (marker, entries)
+            self._entries.move_to_end(id)
+
+            while len(self._entries) > self.max_cached_playlists:
+                # Remove the least recently played playlist
+                self._entries.popitem(last=False)
+
+        return list(entries)
+
+    def invalidate(self, id: str) -> None:
+        """Drop the cached entries of a playlist
+
+        :param str id: The playlist ID
+        :return: None
+        """
+
+        with self._lock:
+            self._entries.pop(id, None)
+
+    def stats(self) -> dict:
+        """Get directory statistics
+
+        :return: A dictionary containing the number of playlists, cached entry lists, hits and misses
+        :rtype: dict
+        """
+
+        with self._lock:
+            return {'playlists': len(self.playlists_by_id),
+                    'cached_playlists': len(self._entries),
+                    'hits': self.hits,
+                    'misses': self.misses}
@@ -0,0 +1,294 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from libsonic.errors import DataNotFoundError, ParameterError
+
+
+class ScrobbleSpool:
+    """Durable queue of plays waiting to be scrobbled
+
+    Plays are written to an SQLite database and submitted to the media server
+    by a background thread, so recording a play never waits for the network.
+    Up to batch_size plays are sent in one scrobble request.  A batch which
+    fails is retried after an exponential backoff, and dropped after
+    max_attempts failures.  When the media server rejects a batch, for
+    example because a track has been deleted, the batch is split until the
+    rejected plays are found and only those are dropped.
+
+    A play of a track within dedup_window seconds of an earlier play of the
+    same track is treated as a repeated event and ignored.  Plays which have
+    been sent are kept for dedup_window seconds for this reason.
+    """
+
+    def __init__(self, connection: object, path: str = None, batch_size: int = 50, max_attempts: int = 10,
+                 backoff: float = 5, max_backoff: float = 900, dedup_window: float = 30) -> None:
+        """
+        :param SubsonicConnection connection: The connection plays are submitted with
+        :param str path: The database file, created if it does not exist.  None keeps the spool in memory. Defaults to None
+        :param int batch_size: The maximum number of plays sent in one request. Defaults to 50
+        :param int max_attempts: The number of times a play is sent before it is dropped. Defaults to 10
+        :param float backoff: Seconds to wait before retrying after the first failure, doubled after each failure. Defaults to 5
+        :param float max_backoff: The longest wait between retries in seconds. Defaults to 900
+        :param float dedup_window: Seconds within which a repeated play of the same track is ignored. Defaults to 30
+        :return: None
+        """
+
+        self.logger = logging.getLogger(__name__)
+
+        self.connection = connection
+        self.batch_size = max(1, int(batch_size))
+        self.max_attempts = max(1, int(max_attempts))
+        self.backoff = float(backoff)
+        self.max_backoff = float(max_backoff)
+        self.dedup_window = float(dedup_window)
+
+        self.submitted: int = 0
+        """Number of plays scrobbled"""
+
+        self.duplicates: int = 0
+        """Number of repeated plays ignored"""
+
+        self.failures: int = 0
+        """Number of failed scrobble requests"""
+
+        self.dropped: int = 0
+        """Number of plays dropped after max_attempts failures or rejected by the media server"""
+
+        if path:
+            directory = os.path.dirname(path)
+
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+
+        # One connection is shared by the request handlers and the worker, guarded by the lock
+        self._db = sqlite3.connect(path or ':memory:', check_same_thread=False, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS plays ('
+                         'track_id TEXT NOT NULL, '
+                         'played_at REAL NOT NULL, '
+                         'attempts INTEGER NOT NULL DEFAULT 0, '
+                         'next_attempt REAL NOT NULL DEFAULT 0, '
+                         'sent INTEGER NOT NULL DEFAULT 0)')
+        self._db.execute('CREATE INDEX IF NOT EXISTS plays_pending ON plays (sent, next_attempt)')
+        self._db.execute('CREATE INDEX IF NOT EXISTS plays_track ON plays (track_id, played_at)')
+        self._lock = threading.Lock()
+
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def record(self, track_id: str, played_at: float) -> bool:
+        """Add a play to the spool
+
+        :param str track_id: The ID of the track which was played
+        :param float played_at: UNIX timestamp in seconds of the play
+        :return: True if the play was added, False if it repeats an earlier play
+        :rtype: bool
+        """
+
+        with self._lock:
+            repeated = self._db.execute('SELECT 1 FROM plays WHERE track_id = ? AND played_at BETWEEN ? AND ? LIMIT 1',
+                                        (track_id, played_at - self.dedup_window,
+                                         played_at + self.dedup_window)).fetchone()
+
+            if repeated:
+                self.duplicates += 1
+                self.logger.debug(f'Ignoring repeated play of {track_id}')
+
+                return False
+
+            self._db.execute('INSERT INTO plays (track_id, played_at) VALUES (?, ?)', (track_id, played_at))
+
+        self._wake.set()
+
+        return True
+
+    def submit(self, force: bool = False) -> int:
+        """Send the next batch of plays which are due
+
+        :param bool force: Send plays waiting for a retry without waiting for their backoff. Defaults to False
+        :return: The number of plays scrobbled
+        :rtype: int
+        """
+
+        now = time.time()
+
+        with self._lock:
+            batch = self._db.execute('SELECT rowid, track_id, played_at, attempts FROM plays '
+                                     'WHERE sent = 0 AND next_attempt <= ? ORDER BY played_at LIMIT ?',
+                                     (float('inf') if force else now, self.batch_size)).fetchall()
+
+        if not batch:
+            return 0
+
+        return self._send(batch, now)
+
+    def _send(self, batch: list, now: float) -> int:
+        """Scrobble a batch of plays, splitting it to find the plays the media server rejects
+
+        :param list batch: Rows of the rowid, track ID, time played and attempts of each play
+        :param float now: The time the batch was read
+        :return: The number of plays scrobbled
+        :rtype: int
+        """
+
+        try:
+            # The request is made without the lock so that plays can be recorded while it is sent
+            self.connection.scrobble_batch([(track_id, played_at) for _, track_id, played_at, _ in batch])
+
+        except (DataNotFoundError, ParameterError) as e:
+            if len(batch) > 1:
+                # One play, such as a track deleted since it was played, fails the whole request
+                middle = len(batch) // 2
+
+                return self._send(batch[:middle], now) + self._send(batch[middle:], now)
+
+            self.logger.error(f'Dropping the play of {batch[0][1]}, the media server rejected it: {e}')
+            self._delete(batch)
+            self.dropped += 1
+
+            return 0
+
+        except Exception as e:
+            self.failures += 1
+            self.logger.warning(f'Could not scrobble {len(batch)} plays: {e}')
+            self._retry(batch, now)
+
+            return 0
+
+        with self._lock:
+            self._db.executemany('UPDATE plays SET sent = 1 WHERE rowid = ?', [(row[0],) for row in batch])
+            # Sent plays are only needed to find repeated plays
+            self._db.execute('DELETE FROM plays WHERE sent = 1 AND played_at < ?', (now - self.dedup_window,))
+
+        self.submitted += len(batch)
+        self.logger.debug(f'Scrobbled {len(batch)} plays')
+
+        return len(batch)
+
+    def flush(self) -> int:
+        """Send every waiting play, stopping at the first failure
+
+        :return: The number of plays scrobbled
+        :rtype: int
+        """
+
+        total = 0
+        pending = self.pending()
+
+        while pending:
+            total += self.submit(force=True)
+            remaining = self.pending()
+
+            if remaining >= pending:
+                # Nothing was sent or dropped, the media server cannot be reached
+                break
+
+            pending = remaining
+
+        return total
+
+    def pending(self) -> int:
+        """Get the number of plays waiting to be scrobbled
+
+        :return: The number of plays
+        :rtype: int
+        """
+
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM plays WHERE sent = 0').fetchone()[0]
+
+    def start(self) -> None:
+        """Start submitting plays in a background thread
+
+        :return: None
+        """
+
+        if self._thread is not None and self._thread.is_alive():
+            return
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='scrobbles', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop the background thread and send the waiting plays
+
+        Plays which cannot be sent stay in the spool and are sent after the
+        next start when the spool is kept in a file.
+
+        :return: None
+        """
+
+        self._stop.set()
+        self._wake.set()
+
+        if self._thread is not None:
+            self._thread.join()
+
+        flushed = self.flush()
+        self.logger.info(f'Scrobble spool flushed: {flushed} plays sent, {self.pending()} waiting')
+
+    def stats(self) -> dict:
+        """Get spool statistics
+
+        :return: A dictionary containing the number of waiting, submitted, repeated and dropped plays and failed requests
+        :rtype: dict
+        """
+
+        return {'pending': self.pending(),
+                'submitted': self.submitted,
+                'duplicates': self.duplicates,
+                'failures': self.failures,
+                'dropped': self.dropped}
+
+    def _retry(self, batch: list, now: float) -> None:
+        """Schedule the plays of a failed batch to be sent again, dropping those out of attempts"""
+
+        retries = []
+        dropped = []
+
+        for rowid, track_id, _, attempts in batch:
+            attempts += 1
+
+            if attempts >= self.max_attempts:
+                dropped.append((rowid,))
+                self.logger.error(f'Dropping the play of {track_id} after {attempts} failed attempts')
+            else:
+                delay = min(self.max_backoff, self.backoff * 2 ** (attempts - 1))
+                retries.append((attempts, now + delay, rowid))
+
+        with self._lock:
+            self._db.executemany('UPDATE plays SET attempts = ?, next_attempt = ? WHERE rowid = ?', retries)
+
+        self._delete(dropped)
+        self.dropped += len(dropped)
+
+    def _delete(self, batch: list) -> None:
+        """Remove plays from the spool, each row starting with its rowid"""
+
+        with self._lock:
+            self._db.executemany('DELETE FROM plays WHERE rowid = ?', [(row[0],) for row in batch])
+
+    def _next_due(self) -> float:
+        """Get the number of seconds until the next play is due, or None if no plays are waiting"""
+
+        with self._lock:
+            next_attempt = self._db.execute('SELECT MIN(next_attempt) FROM plays WHERE sent = 0').fetchone()[0]
+
+        if next_attempt is None:
+            return None
+
+        return max(0.0, next_attempt - time.time())
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            if self.submit():
+                # Send the next batch straight away
+                continue
+
+            self._wake.wait(self._next_due())
+            self._wake.clear()
@@ -0,0 +1,353 @@
+from collections import OrderedDict
+from typing import Callable, Union
+import logging
+import threading
+import time
+
+from .media_queue import MediaQueue
+from .snapshots import SnapshotStore
+
+
+class QueueSessions:
+    """Play queues for each Alexa device
+
+    Each device, or each user of a device, has its own play queue so that
+    devices in the same household do not replace each other's music.
+
+    At most max_sessions queues are kept in memory.  When the limit is reached,
+    or a queue has not been used for idle_timeout seconds, the least recently
+    used queue is evicted.
+
+    When a SnapshotStore is given, queues which have changed are saved to it
+    every snapshot_interval seconds and when they are evicted.  A queue is
+    restored from the store the first time its device makes a request, after
+    an eviction or a restart of the skill.
+    """
+
+    def __init__(self, factory: Callable[[str], MediaQueue], max_sessions: int = 32, idle_timeout: float = 3600,
+                 store: SnapshotStore = None, per_user: bool = False, on_evict: Callable[[str], None] = None,
+                 snapshot_interval: float = 5) -> None:
+        """
+        :param Callable factory: A function creating an empty MediaQueue for a session key
+        :param int max_sessions: The maximum number of queues kept in memory. Defaults to 32
+        :param float idle_timeout: Seconds after which an unused queue is evicted, 0 disables this. Defaults to 3600
+        :param SnapshotStore store: Store queues are saved to, None discards evicted queues. Defaults to None
+        :param bool per_user: Keep a queue for each user of a device instead of each device. Defaults to False
+        :param Callable on_evict: Called with the key of a queue before it is evicted. Defaults to None
+        :param float snapshot_interval: Seconds between saving changed queues to the store. Defaults to 5
+        :return: None
+        """
+
+        self.logger = logging.getLogger(__name__)
+
+        self.factory = factory
+        self.max_sessions = max(1, int(max_sessions))
+        self.idle_timeout = float(idle_timeout)
+        self.store = store
+        self.per_user = per_user
+        self.on_evict = on_evict
+        self.snapshot_interval = float(snapshot_interval)
+
+        self.evictions: int = 0
+        """Number of queues evicted from memory"""
+
+        self.restores: int = 0
+        """Number of queues restored from the store"""
+
+        # Queues keyed by session, each held in a list with the time.monotonic() value of its last use,
+        # the version of the queue last saved and the base of its last saved state.  The least recently
+        # used queue is first.
+        self._sessions: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+        # Sessions removed from memory which are still being saved, keyed by session
+        self._evicting: dict = {}
+
+        # Events set once the queue of a session has been restored from the store, keyed by session
+        self._restoring: dict = {}
+
+        self._stop = threading.Event()
+        self._thread = None
+
+    def key_for(self, handler_input) -> str:
+        """Get the session key of a request
+
+        :param HandlerInput handler_input: The request
+        :return: The device ID, prefixed with the user ID if per_user is set
+        :rtype: str
+        """
+
+        system = handler_input.request_envelope.context.system
+        device_id = system.device.device_id if system.device is not None else 'default'
+
+        if self.per_user and system.user is not None:
+            return f'{system.user.user_id}:{device_id}'
+
+        return device_id
+
+    def get(self, key: str) -> MediaQueue:
+        """Get the queue of a session
+
+        The queue is restored from the store or created if it is not in memory.
+        The store is read without holding up requests for other sessions,
+        requests for the same session wait until the queue is restored.
+
+        :param str key: The session key
+        :return: The play queue of the session
+        :rtype: MediaQueue
+        """
+
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                victims = self._take_idle(now)
+
+                session = self._sessions.get(key)
+
+                if session is None and key in self._evicting:
+                    # The queue is still being saved after its eviction, keep it instead of restoring an older snapshot
+                    session = self._evicting.pop(key)
+                    self._sessions[key] = session
+
+                restored = self._restoring.get(key)
+                restoring = session is None and restored is None
+
+                if session is not None:
+                    self._sessions.move_to_end(key)
+                    session[1] = now
+
+                    self._trim(victims)
+
+                elif restoring:
+                    # Other requests for the session wait for this restore instead of starting another
+                    restored = self._restoring[key] = threading.Event()
+
+            # Cancelling loading and saving evicted queues waits on other locks and the disk,
+            # so it is done after the sessions are released to the other requests
+            for victim in victims:
+                self._evict(*victim)
+
+            if session is not None:
+                return session[0]
+
+            if restoring:
+                break
+
+            # Another request is restoring the queue, use it once it is ready
+            restored.wait()
+
+        # Reading the snapshot only holds up requests for the same session
+        try:
+            play_queue = self.factory(key)
+            version = self._restore(key, play_queue)
+
+            with self._lock:
+                self._sessions[key] = [play_queue, time.monotonic(), version, None]
+                victims = self._trim([])
+
+                self.logger.debug(f'Session {key} started, {len(self._sessions)} sessions in memory')
+
+        finally:
+            with self._lock:
+                del self._restoring[key]
+
+            restored.set()
+
+        for victim in victims:
+            self._evict(*victim)
+
+        return play_queue
+
+    def latest(self) -> Union[MediaQueue, None]:
+        """Get the most recently used queue
+
+        :return: The queue or None if there are no sessions
+        :rtype: MediaQueue | None
+        """
+
+        with self._lock:
+            if not self._sessions:
+                return None
+
+            return next(reversed(self._sessions.values()))[0]
+
+    def snapshot(self) -> int:
+        """Save the queues which have changed since they were last saved
+
+        :return: The number of queues saved
+        :rtype: int
+        """
+
+        if self.store is None:
+            return 0
+
+        with self._lock:
+            sessions = list(self._sessions.items())
+
+        saved = 0
+
+        for key, session in sessions:
+            if self._save(key, session):
+                saved += 1
+
+        return saved
+
+    def evict_all(self) -> None:
+        """Evict every queue, saving them to the store if it is set
+
+        :return: None
+        """
+
+        with self._lock:
+            victims = list(self._sessions.items())
+            self._sessions.clear()
+
+            self._evicting.update(victims)
+            self.evictions += len(victims)
+
+        for victim in victims:
+            self._evict(*victim)
+
+    def start(self) -> None:
+        """Start saving changed queues in a background thread
+
+        :return: None
+        """
+
+        if self.store is None or self.snapshot_interval <= 0:
+            return
+
+        if self._thread is not None and self._thread.is_alive():
+            return
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='queue-snapshots', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop the background thread and save the changed queues
+
+        :return: None
+        """
+
+        self._stop.set()
+
+        if self._thread is not None:
+            self._thread.join()
+
+        self.snapshot()
+
+    def stats(self) -> dict:
+        """Get session statistics
+
+        :return: A dictionary containing the number of sessions in memory, evictions and restores
+        :rtype: dict
+        """
+
+        with self._lock:
+            return {'sessions': len(self._sessions),
+                    'max_sessions': self.max_sessions,
+                    'evictions': self.evictions,
+                    'restores': self.restores}
+
+    def _trim(self, victims: list) -> list:
+        """Remove the least recently used queues above max_sessions, adding their sessions to victims
+
+        Called with the lock held, the victims are marked as evicting and must be passed to _evict().
+        """
+
+        while len(self._sessions) > self.max_sessions:
+            victims.append(self._sessions.popitem(last=False))
+
+        self._evicting.update(victims)
+        self.evictions += len(victims)
+
+        return victims
+
+    def _take_idle(self, now: float) -> list:
+        """Remove the queues which have been idle for idle_timeout seconds, returning their sessions"""
+
+        victims = []
+
+        if self.idle_timeout <= 0:
+            return victims
+
+        while self._sessions:
+            key, session = next(iter(self._sessions.items()))
+
+            if now - session[1] < self.idle_timeout:
+                break
+
+            del self._sessions[key]
+            victims.append((key, session))
+
+        return victims
+
+    def _evict(self, key: str, session: list) -> None:
+        """Cancel loading and save a queue removed from memory, called without the lock held"""
+
+        if self.on_evict is not None:
+            self.on_evict(key)
+
+        self._save(key, session)
+
+        with self._lock:
+            if self._evicting.get(key) is session:
+                del self._evicting[key]
+
+        self.logger.debug(f'Session {key} evicted')
+
+    def _save(self, key: str, session: list) -> bool:
+        """Save a queue to the store if it has changed since it was last saved"""
+
+        if self.store is None:
+            return False
+
+        play_queue = session[0]
+
+        try:
+            # Read the version first, a change made while the state is read is saved next time
+            version = play_queue.get_version()
+
+            if version == session[2]:
+                return False
+
+            # Only the position in the queue is saved while its entries have not changed
+            delta = play_queue.get_delta(session[3]) if session[3] is not None else None
+
+            if delta is not None:
+                self.store.save_delta(key, delta)
+            else:
+                state = play_queue.get_state()
+                self.store.save(key, state)
+                session[3] = state['base']
+
+            session[2] = version
+
+            return True
+
+        except (OSError, ValueError) as e:
+            self.logger.error(f'Could not save the queue of session {key}: {e}')
+
+            return False
+
+    def _restore(self, key: str, play_queue: MediaQueue) -> int:
+        """Restore a queue from the store, returning the version of the restored queue"""
+
+        if self.store is not None:
+            try:
+                state = self.store.load(key)
+
+                if state is not None:
+                    play_queue.set_state(state)
+                    self.restores += 1
+                    self.logger.debug(f'Session {key} restored')
+
+            except (OSError, ValueError, KeyError, TypeError) as e:
+                self.logger.error(f'Could not restore the queue of session {key}: {e}')
+
+        return play_queue.get_version()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.snapshot_interval):
+            self.snapshot()
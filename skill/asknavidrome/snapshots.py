@@ -0,0 +1,241 @@
+from typing import Union
+import json
+import logging
+import os
+import threading
+
+
+class SnapshotStore:
+    """Append only journal of play queue snapshots
+
+    Each snapshot is written as a line holding the session key and the state
+    of its queue, a later line for the same key replaces the earlier one.
+    The whole queue is only written when its entries change, as playback
+    moves through the queue a small delta line is written instead, and a
+    later delta replaces the earlier one.  Only the positions of the latest
+    state and delta lines of each key are read when the store is opened,
+    snapshots are parsed when a session is restored.
+
+    The journal is compacted, rewritten with only the latest snapshot of each
+    session, when less than half of it is in use.
+    """
+
+    def __init__(self, path: str, compact_min_bytes: int = 1048576) -> None:
+        """
+        :param str path: The journal file, created if it does not exist
+        :param int compact_min_bytes: The journal is not compacted until it is larger than this. Defaults to 1 MiB
+        :return: None
+        """
+
+        self.logger = logging.getLogger(__name__)
+
+        self.path = path
+        self.compact_min_bytes = compact_min_bytes
+
+        self.compactions: int = 0
+        """Number of times the journal has been compacted"""
+
+        # Offset and length of the latest state line for each session key, followed by the
+        # offset and length of the latest delta line after it if there is one
+        self._records: dict = {}
+        self._live_bytes: int = 0
+        self._size: int = 0
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(self.path)
+
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._index()
+
+    def keys(self) -> list:
+        """Get the keys of the saved sessions
+
+        :return: A list of session keys
+        :rtype: list
+        """
+
+        with self._lock:
+            return list(self._records)
+
+    def save(self, key: str, state: dict) -> None:
+        """Save the state of a session
+
+        :param str key: The session key
+        :param dict state: The state of the queue, as returned by MediaQueue.get_state()
+        :return: None
+        """
+
+        self._append(key, json.dumps(state, separators=(',', ':')))
+
+    def save_delta(self, key: str, delta: dict) -> None:
+        """Save the changes made to a session since its state was saved
+
+        :param str key: The session key
+        :param dict delta: The changes to the queue, as returned by MediaQueue.get_delta()
+        :return: None
+        """
+
+        self._append(key, json.dumps({'delta': delta}, separators=(',', ':')))
+
+    def load(self, key: str) -> Union[dict, None]:
+        """Load the latest state of a session
+
+        :param str key: The session key
+        :return: The state of the queue, with the latest delta under the delta key, or None if the session has not been saved
+        :rtype: dict | None
+        """
+
+        with self._lock:
+            record = self._records.get(key)
+
+            if record is None:
+                return None
+
+            lines = [self._read(offset, length) for offset, length in zip(record[::2], record[1::2])]
+
+        state = json.loads(lines[0].split(b'\t', 1)[1])
+
+        if len(lines) > 1:
+            state['delta'] = json.loads(lines[1].split(b'\t', 1)[1])['delta']
+
+        return state
+
+    def delete(self, key: str) -> None:
+        """Remove a session from the store
+
+        :param str key: The session key
+        :return: None
+        """
+
+        self._append(key, 'null')
+
+    def compact(self) -> None:
+        """Rewrite the journal with only the latest snapshot of each session
+
+        :return: None
+        """
+
+        with self._lock:
+            self._compact()
+
+    def stats(self) -> dict:
+        """Get journal statistics
+
+        :return: A dictionary containing the number of sessions, journal size, bytes in use and compactions
+        :rtype: dict
+        """
+
+        with self._lock:
+            return {'sessions': len(self._records),
+                    'journal_bytes': self._size,
+                    'live_bytes': self._live_bytes,
+                    'compactions': self.compactions}
+
+    def _index(self) -> None:
+        """Find the latest line for each key in the journal"""
+
+        if not os.path.exists(self.path):
+            return
+
+        offset = 0
+
+        with open(self.path, 'rb') as f:
+            for line in f:
+                if not line.endswith(b'\n'):
+                    # The last write was interrupted, it is overwritten by the next snapshot
+                    break
+
+                key, _, state = line.partition(b'\t')
+                self._set_record(key.decode('utf-8'), offset, len(line), self._kind(state))
+                offset += len(line)
+
+        self._size = offset
+
+        with open(self.path, 'rb+') as f:
+            f.truncate(self._size)
+
+        self.logger.debug(f'Snapshot journal indexed: {len(self._records)} sessions, {self._size} bytes')
+
+    @staticmethod
+    def _kind(state: bytes) -> str:
+        """Get the kind of a journal line from its state, state, delta or deleted"""
+
+        if state.startswith(b'{"delta":'):
+            return 'delta'
+
+        if state.strip() == b'null':
+            return 'deleted'
+
+        return 'state'
+
+    def _set_record(self, key: str, offset: int, length: int, kind: str) -> None:
+        previous = self._records.get(key)
+
+        if kind == 'delta':
+            if previous is None:
+                # A delta without a state to apply it to
+                return
+
+            # A delta replaces the previous delta, the state is kept
+            self._live_bytes -= sum(previous[3::2])
+            self._records[key] = previous[:2] + (offset, length)
+            self._live_bytes += length
+
+            return
+
+        if previous is not None:
+            del self._records[key]
+            self._live_bytes -= sum(previous[1::2])
+
+        if kind == 'state':
+            self._records[key] = (offset, length)
+            self._live_bytes += length
+
+    def _append(self, key: str, state: str) -> None:
+        line = f'{key}\t{state}\n'.encode('utf-8')
+
+        with self._lock:
+            with open(self.path, 'ab') as f:
+                f.write(line)
+
+            self._set_record(key, self._size, len(line), self._kind(state.encode('utf-8')))
+            self._size += len(line)
+
+            if self._size > self.compact_min_bytes and self._size > 2 * self._live_bytes:
+                self._compact()
+
+    def _read(self, offset: int, length: int) -> bytes:
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+
+            return f.read(length)
+
+    def _compact(self) -> None:
+        records = {}
+        offset = 0
+
+        # Write to a temporary file so an interrupted compaction never loses the journal
+        with open(self.path, 'rb') as source, open(self.path + '.tmp', 'wb') as target:
+            for key, record in self._records.items():
+                records[key] = ()
+
+                for start, length in zip(record[::2], record[1::2]):
+                    source.seek(start)
+                    target.write(source.read(length))
+
+                    records[key] += (offset, length)
+                    offset += length
+
+            target.flush()
+            os.fsync(target.fileno())
+
+        os.replace(self.path + '.tmp', self.path)
+
+        self._records = records
+        self._live_bytes = offset
+        self._size = offset
+        self.compactions += 1
+
+        self.logger.debug(f'Snapshot journal compacted: {len(records)} sessions, {offset} bytes')
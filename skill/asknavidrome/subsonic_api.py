@@ -1,17 +1,91 @@
+from concurrent.futures import ThreadPoolExecutor
 from hashlib import md5
-from typing import Union
+from typing import Callable, Iterable, Union
+import contextvars
+from urllib.parse import quote, urlencode
+from urllib.request import Request
+import json
 import logging
 import random
 import secrets
 
 import libsonic
+from libsonic.errors import getExcByCode
+
+from . import fuzzy
+from .cache import TTLCache
+from .transport import PooledHTTPTransport
+
+
+def normalise_term(term: str) -> str:
+    """Normalise a search term
+
+    Search terms are case folded and surrounding and repeated whitespace
+    is removed, so that terms which return the same results share a cache entry.
+
+    :param str term: The search term
+    :return: The normalised search term
+    :rtype: str
+    """
+
+    return ' '.join(term.casefold().split())
+
+
+class StreamSigner:
+    """Create authenticated stream URIs
+
+    The part of the URI shared by every song is built once, signing a song
+    only adds a fresh salt and token and the song ID.  If an API key is given
+    the OpenSubsonic apiKey authentication is used and no hashing is needed.
+    """
+
+    def __init__(self, server_url: str, user: str, passwd: str, port: int, api_location: str, api_version: str,
+                 api_key: str = None) -> None:
+        """
+        :param str server_url: The URL of the Subsonic API compatible media server
+        :param str user: Username to authenticate against the API
+        :param str passwd: Password to authenticate against the API
+        :param int port: Port the Subsonic compatible server is listening on
+        :param str api_location: Path to the API, this is appended to server_url
+        :param str api_version: The version of the Subsonic API that is in use
+        :param str api_key: An OpenSubsonic API key, used instead of the username and password. Defaults to None
+        :return: None
+        """
+
+        self.api_key = api_key
+        self._passwd = passwd.encode()
+
+        prefix = f'{server_url}:{port}{api_location}/stream.view?f=json&v={api_version}&c=AskNavidrome&'
+
+        if api_key:
+            self.prefix = f'{prefix}apiKey={quote(api_key, safe="")}&id='
+        else:
+            self.prefix = f'{prefix}u={quote(user, safe="")}&s='
+
+    def sign(self, id: str) -> str:
+        """Create a URI for a given song
+
+        :param str id: A song ID
+        :return: A properly formatted URI with the authentication details embedded
+        :rtype: str
+        """
+
+        if self.api_key:
+            return f'{self.prefix}{quote(str(id), safe="")}'
+
+        salt = secrets.token_hex(16)
+        auth_token = md5(self._passwd + salt.encode()).hexdigest()
+
+        return f'{self.prefix}{salt}&t={auth_token}&id={quote(str(id), safe="")}'
 
 
 class SubsonicConnection:
     """Class with methods to interact with Subsonic API compatible media servers
     """
 
-    def __init__(self, server_url: str, user: str, passwd: str, port: int, api_location: str, api_version: str) -> None:
+    def __init__(self, server_url: str, user: str, passwd: str, port: int, api_location: str, api_version: str,
+                 max_concurrency: int = 8, transport: object = None, search_cache_size: int = 256,
+                 search_cache_ttl: float = 300, api_key: str = None) -> None:
         """
         :param str server_url: The URL of the Subsonic API compatible media server
         :param str user: Username to authenticate against the API
@@ -19,6 +93,12 @@ class SubsonicConnection:
         :param int port: Port the Subsonic compatible server is listening on
         :param str api_location: Path to the API, this is appended to server_url
         :param str api_version: The version of the Subsonic API that is in use
+        :param int max_concurrency: The maximum number of requests fan_out() will make at the same time. Defaults to 8
+        :param object transport: The HTTP transport used for API requests, this must provide the open() method of
+                                 urllib.request.OpenerDirector.  Defaults to a PooledHTTPTransport
+        :param int search_cache_size: The maximum number of search results to cache. Defaults to 256
+        :param float search_cache_ttl: The number of seconds search results are cached for. Defaults to 300
+        :param str api_key: An OpenSubsonic API key used to authenticate stream URIs. Defaults to None
         :return: None
         """
 
@@ -30,6 +110,17 @@ class SubsonicConnection:
         self.port = port
         self.api_location = api_location
         self.api_version = api_version
+        self.max_concurrency = max(1, int(max_concurrency))
+
+        if transport is None:
+            transport = PooledHTTPTransport(pool_size=self.max_concurrency)
+
+        self.transport = transport
+        self.search_cache = TTLCache(search_cache_size, search_cache_ttl)
+        self.api_key = api_key
+
+        self.signer = StreamSigner(server_url, user, passwd, port, api_location, api_version, api_key)
+        """Creates the stream URIs sent to Alexa"""
 
         self.conn = libsonic.Connection(self.server_url,
                                         self.user,
@@ -40,8 +131,52 @@ class SubsonicConnection:
                                         self.api_version,
                                         False)
 
+        # libsonic makes all of its HTTP requests through its opener, replace it with
+        # the transport so that connections are reused between API calls
+        self.conn._opener = self.transport
+
         self.logger.debug('Connecting to Navidrome.....')
 
+    def __getstate__(self) -> dict:
+        # Allow the connection to be passed to other processes, a new libsonic
+        # connection and search cache are created from the settings
+        return {'server_url': self.server_url,
+                'user': self.user,
+                'passwd': self.passwd,
+                'port': self.port,
+                'api_location': self.api_location,
+                'api_version': self.api_version,
+                'max_concurrency': self.max_concurrency,
+                'transport': self.transport,
+                'search_cache_size': self.search_cache.maxsize,
+                'search_cache_ttl': self.search_cache.ttl,
+                'api_key': self.api_key}
+
+    def __setstate__(self, state: dict) -> None:
+        self.__init__(**state)
+
+    def _request(self, method: str, params: dict = None) -> dict:
+        """Make a request to the Subsonic API
+
+        :param str method: The name of the API method, for example ping
+        :param dict params: Query parameters, list values are sent as repeated parameters. Defaults to None
+        :return: The subsonic-response dictionary
+        :rtype: dict
+        """
+
+        salt = secrets.token_hex(16)
+        auth_token = md5(self.passwd.encode() + salt.encode())
+
+        query = {'f': 'json', 'v': self.api_version, 'c': 'AskNavidrome',
+                 'u': self.user, 's': salt, 't': auth_token.hexdigest()}
+        query.update(params or {})
+
+        http_request = Request(f'{self.server_url}:{self.port}{self.api_location}/{method}.view',
+                               urlencode(query, doseq=True).encode('utf-8'))
+        http_response = self.transport.open(http_request)
+
+        return json.loads(http_response.read().decode('utf-8'))['subsonic-response']
+
     def ping(self) -> bool:
         """Ping a Subsonic API server
 
@@ -55,9 +190,8 @@ class SubsonicConnection:
         """
 
         self.logger.debug('In function ping()')
-        http_request = self.conn._getRequest('ping.view')
         try:
-            http_request_result = self.conn._doInfoReq(http_request)
+            http_request_result = self._request('ping')
         except Exception as e:
             self.logger.error('Failed to connect to Navidrome: %s', e, exc_info=True)
             return False
@@ -76,11 +210,56 @@ class SubsonicConnection:
             self.logger.error('Unexpected error when connecting to Navidrome: %r', status)
             return False
 
-    def scrobble(self, track_id: str, time: int) -> None:
+    def fan_out(self, func: Callable, items: Iterable) -> 'list[tuple]':
+        """Call a function for each item concurrently
+
+        Requests are made on a pool of at most max_concurrency threads so that
+        a list of N API calls completes in roughly the time of the slowest call
+        instead of the sum of all of them.  A failing call does not stop the
+        others from completing.
+
+        :param Callable func: The function to call, it is passed a single item
+        :param Iterable items: The items to process
+        :return: A list of (result, exception) tuples in the same order as items.
+                 exception is None when the call succeeded, result is None when it failed.
+        :rtype: list[tuple]
+        """
+
+        self.logger.debug('In function fan_out()')
+
+        items = list(items)
+
+        if len(items) == 0:
+            return []
+
+        def call(item):
+            try:
+                return (func(item), None)
+            except Exception as e:
+                return (None, e)
+
+        if len(items) == 1 or self.max_concurrency == 1:
+            # Nothing to gain from a thread pool
+            return [call(item) for item in items]
+
+        with ThreadPoolExecutor(max_workers=min(self.max_concurrency, len(items))) as executor:
+            # Run each call in a copy of the caller's context so that the deadline of the
+            # current request also applies to the requests made by the pool
+            futures = [executor.submit(contextvars.copy_context().run, call, item) for item in items]
+            results = [future.result() for future in futures]
+
+        failures = [error for (_, error) in results if error is not None]
+
+        if failures:
+            self.logger.error(f'{len(failures)} of {len(items)} requests failed, first error: {failures[0]}')
+
+        return results
+
+    def scrobble(self, track_id: str, time: float) -> None:
         """Scrobble the given track
 
         :param str track_id: The ID of the track to scrobble
-        :param int time: UNIX timestamp of track play time
+        :param float time: UNIX timestamp in seconds of track play time, libsonic converts this to milliseconds
         :return: None
         """
         self.logger.debug('In function scrobble()')
@@ -89,6 +268,27 @@ class SubsonicConnection:
 
         return None
 
+    def scrobble_batch(self, plays: 'list[tuple]') -> None:
+        """Scrobble several tracks in one request
+
+        :param list[tuple] plays: Tuples of the ID of a track and the UNIX timestamp in seconds it was played
+        :raises SonicError: If the media server rejects the scrobbles, the subclass matching the error code
+        :return: None
+        """
+        self.logger.debug('In function scrobble_batch()')
+
+        # The API takes repeated id and time parameters, times are in milliseconds
+        result = self._request('scrobble', {'id': [track_id for track_id, _ in plays],
+                                            'time': [int(played_at * 1000) for _, played_at in plays],
+                                            'submission': 'true'})
+
+        if result.get('status') != 'ok':
+            error = result.get('error', {})
+
+            raise getExcByCode(error.get('code', 0))(f'Scrobble failed: {error.get("message")}')
+
+        return None
+
     def search_playlist(self, term: str) -> Union[str, None]:
         """Search the media server for the given playlist
 
@@ -102,7 +302,13 @@ class SubsonicConnection:
         playlist_dict = self.conn.getPlaylists()
 
         # Search the list of dictionaries for a playlist with a name that matches the search term
-        playlist_id_list = [item.get('id') for item in playlist_dict['playlists']['playlist'] if item.get('name').lower() == term.lower()]
+        playlist_list = playlist_dict['playlists'].get('playlist', [])
+        playlist_id_list = [item.get('id') for item in playlist_list if item.get('name').lower() == term.lower()]
+
+        if not playlist_id_list:
+            # Use the closest name, allowing for differences in how Alexa transcribes the name
+            match = fuzzy.best_match(term, playlist_list, lambda item: item.get('name'))
+            playlist_id_list = [match.get('id')] if match is not None else []
 
         if len(playlist_id_list) == 1:
             # We have matched the playlist return it
@@ -121,6 +327,61 @@ class SubsonicConnection:
 
             return None
 
+    def search(self, term: str, artist_count: int = 0, album_count: int = 0, song_count: int = 0) -> dict:
+        """Search the media server
+
+        Only the entity types with a count greater than 0 are requested.  Results
+        are cached using the normalised search term, so repeated searches do not
+        make requests to the media server.  If the media server does not respond
+        in time an expired result is used when one is available.
+
+        :param str term: The search term
+        :param int artist_count: The maximum number of artists to return. Defaults to 0
+        :param int album_count: The maximum number of albums to return. Defaults to 0
+        :param int song_count: The maximum number of songs to return. Defaults to 0
+        :return: A dictionary containing lists of artists, albums and songs
+        :rtype: dict
+        """
+
+        self.logger.debug('In function search()')
+
+        term = normalise_term(term)
+        key = (term, artist_count, album_count, song_count)
+
+        result = self.search_cache.get(key)
+
+        if result is None:
+            try:
+                result_dict = self.conn.search3(term, artistCount=artist_count, albumCount=album_count, songCount=song_count)
+
+            except TimeoutError:
+                result = self.search_cache.get(key, allow_expired=True)
+
+                if result is None:
+                    raise
+
+                self.logger.warning(f'Search for {term} timed out, using an expired result')
+
+                return result
+
+            result = result_dict.get('searchResult3', {})
+
+            self.search_cache.set(key, result)
+            self.logger.debug(f'Search cache miss for term: {term}')
+        else:
+            self.logger.debug(f'Search cache hit for term: {term}')
+
+        return result
+
+    def search_cache_stats(self) -> dict:
+        """Get search cache statistics
+
+        :return: A dictionary containing the size, hits, misses, stale hits and hit ratio of the search cache
+        :rtype: dict
+        """
+
+        return self.search_cache.stats()
+
     def search_artist(self, term: str) -> Union[dict, None]:
         """Search the media server for the given artist
 
@@ -131,17 +392,13 @@ class SubsonicConnection:
 
         self.logger.debug('In function search_artist()')
 
-        result_dict = self.conn.search3(term)
-
-        if len(result_dict['searchResult3']) > 0:
-            # Results found
-            result_count = len(result_dict['searchResult3']['artist'])
+        # Put the results most similar to the search term first
+        result_list = fuzzy.rank(term, self.search(term, artist_count=20).get('artist', []), lambda artist: artist.get('name'), 0)
+        self.logger.debug(f'Searching artists for term: {term} found {len(result_list)} entries.')
 
-            self.logger.debug(f'Searching artists for term: {term} found {result_count} entries.')
-
-            if result_count > 0:
-                # Results were found
-                return result_dict['searchResult3']['artist']
+        if len(result_list) > 0:
+            # Results were found
+            return result_list
 
         # No results were found
         return None
@@ -156,17 +413,13 @@ class SubsonicConnection:
 
         self.logger.debug('In function search_album()')
 
-        result_dict = self.conn.search3(term)
-
-        if len(result_dict['searchResult3']) > 0:
-            # Results found
-            result_count = len(result_dict['searchResult3']['album'])
+        # Put the results most similar to the search term first
+        result_list = fuzzy.rank(term, self.search(term, album_count=20).get('album', []), lambda album: album.get('name'), 0)
+        self.logger.debug(f'Searching albums for term: {term} found {len(result_list)} entries.')
 
-            self.logger.debug(f'Searching albums for term: {term} found {result_count} entries.')
-
-            if result_count > 0:
-                # Results were found
-                return result_dict['searchResult3']['album']
+        if len(result_list) > 0:
+            # Results were found
+            return result_list
 
         # No results were found
         return None
@@ -181,17 +434,13 @@ class SubsonicConnection:
 
         self.logger.debug('In function search_song()')
 
-        result_dict = self.conn.search3(term)
-
-        if len(result_dict['searchResult3']) > 0:
-            # Results found
-            result_count = len(result_dict['searchResult3']['song'])
-
-            self.logger.debug(f'Searching songs for term: {term}, found {result_count} entries.')
+        # Put the results most similar to the search term first
+        result_list = fuzzy.rank(term, self.search(term, song_count=20).get('song', []), lambda song: song.get('title'), 0)
+        self.logger.debug(f'Searching songs for term: {term}, found {len(result_list)} entries.')
 
-            if result_count > 0:
-                # Results were found
-                return result_dict['searchResult3']['song']
+        if len(result_list) > 0:
+            # Results were found
+            return result_list
 
         # No results were found
         return None
@@ -222,13 +471,13 @@ class SubsonicConnection:
 
         :param list[dict] albums: A list of dictionaries containing album information
         :param int length: The minimum number of songs that should be returned, if -1 there is no limit
-        :return: A list of song IDs
-        :rtype: list
+        :return: A list of song dictionaries
+        :rtype: list[dict]
         """
 
         self.logger.debug('In function build_song_list_from_albums()')
 
-        song_id_list = []
+        song_list = []
 
         if length != -1:
             song_count = 0
@@ -247,48 +496,56 @@ class SubsonicConnection:
             # The list of songs should not be limited
             album_id_list = [album.get('id') for album in albums]
 
-        # Get a song listing for each album
-        for album_id in album_id_list:
-            album_details = self.conn.getAlbum(album_id)
+        timed_out = None
+
+        # Get a song listing for each album, the albums are requested concurrently
+        for album_id, (album_details, error) in zip(album_id_list, self.fan_out(self.conn.getAlbum, album_id_list)):
+            if error is not None:
+                # Return what we have rather than failing the whole request
+                self.logger.error(f'Could not get the songs for album {album_id}: {error}')
+
+                if isinstance(error, TimeoutError):
+                    timed_out = error
 
-            for song_detail in album_details['album']['song']:
-                # Capture the song ID
-                song_id_list.append(song_detail.get('id'))
+                continue
 
-        return song_id_list
+            # Keep the full song details, these contain everything needed to
+            # build a Track object without calling getSong for each song
+            song_list.extend(album_details['album'].get('song', []))
+
+        if not song_list and timed_out is not None:
+            # Nothing arrived before the deadline, let the caller respond accordingly
+            raise timed_out
+
+        return song_list
 
     def build_song_list_from_playlist(self, id: str) -> list:
         """Build a list of songs from a given playlist
 
         :param str id: The playlist ID
-        :return: A list of song IDs
-        :rtype: list
+        :return: A list of song dictionaries
+        :rtype: list[dict]
         """
 
         self.logger.debug('In function build_song_list_from_playlist()')
 
-        song_id_list = []
-        playlist_details = self.conn.getPlaylist(id)
-
-        song_id_list = [song_detail.get('id') for song_detail in playlist_details.get('playlist').get('entry')]
+        song_list = self.get_playlist(id).get('entry', [])
 
-        return song_id_list
+        return song_list
 
     def build_song_list_from_favourites(self) -> Union[list, None]:
         """Build a shuffled list favourite songs
 
-        :return: A list of song IDs or None if no favourite tracks are found.
-        :rtype: list | None
+        :return: A list of song dictionaries or None if no favourite tracks are found.
+        :rtype: list[dict] | None
         """
 
         self.logger.debug('In function build_song_list_from_favourites()')
 
-        favourite_songs = self.conn.getStarred2().get('starred2').get('song')
+        favourite_songs = self.conn.getStarred2().get('starred2').get('song', [])
 
         if len(favourite_songs) > 0:
-            song_id_list = [song.get('id') for song in favourite_songs]
-
-            return song_id_list
+            return favourite_songs
 
         else:
             return None
@@ -298,8 +555,8 @@ class SubsonicConnection:
 
         :param str genre: The genre, acceptable values are with the getGenres Subsonic API call.
         :param int count: The number of songs to return
-        :return: A list of song IDs or None if no tracks are found.
-        :rtype: list | None
+        :return: A list of song dictionaries or None if no tracks are found.
+        :rtype: list[dict] | None
         """
 
         self.logger.debug('In function build_song_list_from_genre()')
@@ -307,12 +564,10 @@ class SubsonicConnection:
         # Note the use of title() to capitalise the first letter of each word in the genre
         # without this the genres do not match the strings returned by the API.
         self.logger.debug(f'Searching for {genre.title()} music')
-        songs_from_genre = self.conn.getSongsByGenre(genre.title(), count).get('songsByGenre').get('song')
+        songs_from_genre = self.conn.getSongsByGenre(genre.title(), count).get('songsByGenre').get('song', [])
 
         if len(songs_from_genre) > 0:
-            song_id_list = [song.get('id') for song in songs_from_genre]
-
-            return song_id_list
+            return songs_from_genre
 
         else:
             return None
@@ -321,17 +576,15 @@ class SubsonicConnection:
         """Build a shuffled list of random songs
 
         :param int count: The number of songs to return
-        :return: A list of song IDs or None if no tracks are found.
-        :rtype: list | None
+        :return: A list of song dictionaries or None if no tracks are found.
+        :rtype: list[dict] | None
         """
 
         self.logger.debug('In function build_random_song_list()')
-        random_songs = self.conn.getRandomSongs(count).get('randomSongs').get('song')
+        random_songs = self.conn.getRandomSongs(count).get('randomSongs').get('song', [])
 
         if len(random_songs) > 0:
-            song_id_list = [song.get('id') for song in random_songs]
-
-            return song_id_list
+            return random_songs
 
         else:
             return None
@@ -350,6 +603,138 @@ class SubsonicConnection:
 
         return song_details
 
+    def get_song_details_list(self, id_list: list) -> 'list[dict]':
+        """Get details about each of the given song IDs
+
+        The songs are requested concurrently, songs which could not be
+        retrieved are left out of the returned list.
+
+        :param list id_list: A list of song IDs
+        :return: A list of song dictionaries in the same order as id_list
+        :rtype: list[dict]
+        """
+
+        self.logger.debug('In function get_song_details_list()')
+
+        song_list = []
+
+        for song_id, (song_details, error) in zip(id_list, self.fan_out(self.conn.getSong, id_list)):
+            if error is not None:
+                self.logger.error(f'Could not get the details of song {song_id}: {error}')
+                continue
+
+            song_list.append(song_details.get('song'))
+
+        return song_list
+
+    def get_artists(self) -> 'list[dict]':
+        """Get all artists in the collection
+
+        :return: A list of artist dictionaries
+        :rtype: list[dict]
+        """
+
+        self.logger.debug('In function get_artists()')
+
+        indexes = self.conn.getArtists().get('artists', {}).get('index', [])
+
+        return [artist for index in indexes for artist in index.get('artist', [])]
+
+    def get_album_page(self, offset: int, size: int = 500) -> 'list[dict]':
+        """Get a page of albums in alphabetical order
+
+        :param int offset: The position of the first album to return
+        :param int size: The number of albums to return, Navidrome returns at most 500. Defaults to 500
+        :return: A list of album dictionaries
+        :rtype: list[dict]
+        """
+
+        self.logger.debug('In function get_album_page()')
+
+        return self.conn.getAlbumList2('alphabeticalByName', size, offset).get('albumList2', {}).get('album', [])
+
+    def get_song_page(self, offset: int, size: int = 500) -> 'list[dict]':
+        """Get a page of all songs in the collection
+
+        Uses a search3 request with an empty query, which Navidrome and other
+        OpenSubsonic servers answer with every song in the collection.
+
+        :param int offset: The position of the first song to return
+        :param int size: The number of songs to return. Defaults to 500
+        :return: A list of song dictionaries
+        :rtype: list[dict]
+        """
+
+        self.logger.debug('In function get_song_page()')
+
+        result_dict = self.conn.search3('', artistCount=0, albumCount=0, songCount=size, songOffset=offset)
+
+        return result_dict.get('searchResult3', {}).get('song', [])
+
+    def get_scan_status(self) -> dict:
+        """Get the status of the media library scan
+
+        :return: A dictionary containing scanning (bool) and count (int) keys
+        :rtype: dict
+        """
+
+        self.logger.debug('In function get_scan_status()')
+
+        return self.conn.getScanStatus().get('scanStatus', {})
+
+    def get_indexes_modified(self, since: float = 0) -> 'tuple[float, bool]':
+        """Check if the artist indexes have changed
+
+        Uses the ifModifiedSince parameter of getIndexes, the server only returns the
+        artist indexes if they have changed since the given time.
+
+        :param float since: UNIX timestamp in seconds of the last known modification. Defaults to 0
+        :return: A tuple of the last modification time in seconds and True if it is later than since
+        :rtype: tuple[float, bool]
+        """
+
+        self.logger.debug('In function get_indexes_modified()')
+
+        indexes = self.conn.getIndexes(ifModifiedSince=since).get('indexes', {})
+        last_modified = float(indexes.get('lastModified', 0))
+
+        return last_modified, last_modified > since
+
+    def get_album(self, id: str) -> dict:
+        """Get an album and its songs
+
+        :param str id: The album ID
+        :return: An album dictionary, the songs are listed under the song key
+        :rtype: dict
+        """
+
+        self.logger.debug('In function get_album()')
+
+        return self.conn.getAlbum(id).get('album')
+
+    def get_playlists(self) -> 'list[dict]':
+        """Get all playlists
+
+        :return: A list of playlist dictionaries
+        :rtype: list[dict]
+        """
+
+        self.logger.debug('In function get_playlists()')
+
+        return self.conn.getPlaylists().get('playlists', {}).get('playlist', [])
+
+    def get_playlist(self, id: str) -> dict:
+        """Get a playlist and its entries
+
+        :param str id: The playlist ID
+        :return: A playlist dictionary, the songs are listed under the entry key
+        :rtype: dict
+        """
+
+        self.logger.debug('In function get_playlist()')
+
+        return self.conn.getPlaylist(id).get('playlist', {})
+
     def get_song_uri(self, id: str) -> str:
         """Create a URI for a given song
 
@@ -363,17 +748,7 @@ class SubsonicConnection:
 
         self.logger.debug('In function get_song_uri()')
 
-        salt = secrets.token_hex(16)
-        auth_token = md5(self.passwd.encode() + salt.encode())
-
-        # This creates a multiline f string, uri contains a single line with both
-        # f strings.
-        uri = (
-            f'{self.server_url}:{self.port}{self.api_location}/stream.view?f=json&v={self.api_version}&c=AskNavidrome&u='
-            f'{self.user}&s={salt}&t={auth_token.hexdigest()}&id={id}'
-        )
-
-        return uri
+        return self.signer.sign(id)
 
     def star_entry(self, id: str, mode: str) -> None:
         """Add a star to the given entity
@@ -0,0 +1,139 @@
+import logging
+import threading
+import time
+
+from . import transport
+
+
+class SyncReport:
+    """The result of a synchronisation cycle
+    """
+
+    def __init__(self, artists: int = 0, albums: int = 0, playlists: int = 0, skipped: bool = False) -> None:
+        """
+        :param int artists: Number of artists added, changed or removed. Defaults to 0
+        :param int albums: Number of albums added, changed or removed. Defaults to 0
+        :param int playlists: Number of playlists added, changed or removed. Defaults to 0
+        :param bool skipped: True if the cycle was skipped, for example while the server is scanning. Defaults to False
+        :return: None
+        """
+
+        self.artists: int = artists
+        self.albums: int = albums
+        self.playlists: int = playlists
+        self.skipped: bool = skipped
+
+        self.bytes_fetched: int = 0
+        """Number of bytes received from the media server by the requests of the cycle"""
+
+        self.duration: float = 0
+        """Length of the cycle in seconds"""
+
+    def merge(self, other: 'SyncReport') -> None:
+        """Add the counts of another report to this one
+
+        :param SyncReport other: The report to merge
+        :return: None
+        """
+
+        self.artists += other.artists
+        self.albums += other.albums
+        self.playlists += other.playlists
+        self.skipped = self.skipped and other.skipped
+
+    def __str__(self) -> str:
+        if self.skipped:
+            return f'skipped, {self.bytes_fetched} bytes fetched in {self.duration:.2f}s'
+
+        return (f'{self.artists} artists, {self.albums} albums and {self.playlists} playlists updated, '
+                f'{self.bytes_fetched} bytes fetched in {self.duration:.2f}s')
+
+
+class SyncScheduler:
+    """Keep local views of the library up to date
+
+    Calls sync_changes() on each target at a fixed interval in a background
+    thread.  Targets are objects such as LibraryCatalog which use the change
+    markers provided by the media server to fetch only what has changed, and
+    return a SyncReport.
+    """
+
+    def __init__(self, targets: list, interval: float = 300) -> None:
+        """
+        :param list targets: Objects with a sync_changes() method returning a SyncReport
+        :param float interval: Seconds between synchronisation cycles. Defaults to 300
+        :return: None
+        """
+
+        self.logger = logging.getLogger(__name__)
+
+        self.targets = list(targets)
+        self.interval = float(interval)
+
+        self.last_report: SyncReport = None
+        """The report from the most recent cycle"""
+
+        self._stop = threading.Event()
+        self._thread = None
+
+    def run_cycle(self) -> SyncReport:
+        """Run a single synchronisation cycle
+
+        :return: The combined report of all targets
+        :rtype: SyncReport
+        """
+
+        self.logger.debug('In run_cycle()')
+
+        started = time.monotonic()
+
+        # Only the requests of this cycle are counted, not those made by other threads at the same time
+        counter = transport.count_bytes()
+
+        report = SyncReport(skipped=True)
+
+        try:
+            for target in self.targets:
+                try:
+                    report.merge(target.sync_changes())
+                except Exception as e:
+                    self.logger.error(f'Synchronising {type(target).__name__} failed: {e}')
+
+        finally:
+            transport.stop_counting()
+
+        report.bytes_fetched = counter.bytes_received
+        report.duration = time.monotonic() - started
+
+        self.last_report = report
+        self.logger.info(f'Library synchronisation: {report}')
+
+        return report
+
+    def start(self) -> None:
+        """Start running synchronisation cycles in a background thread
+
+        :return: None
+        """
+
+        if self._thread is not None and self._thread.is_alive():
+            return
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='library-sync', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop the background thread
+
+        :return: None
+        """
+
+        self._stop.set()
+
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.run_cycle()
@@ -1,7 +1,37 @@
+import sys
+
+
+def intern_string(value):
+    """Intern a string so that equal strings share one object
+
+    Tracks from the same album repeat the artist, album and genre, interning
+    these keeps one copy of each in memory.
+
+    :param value: A string, other values are returned unchanged
+    :return: The interned string or the value
+    """
+
+    if isinstance(value, str):
+        return sys.intern(value)
+
+    return value
+
+
 class Track:
     """An object that represents an audio track
+
+    Tracks use __slots__ instead of an attribute dictionary and share the
+    strings repeated between tracks, such as the artist and album, to keep
+    large play queues small.
     """
 
+    __slots__ = ('id', 'artist', 'artist_id', 'title', 'album', 'album_id', 'track_no',
+                 'year', 'genre', 'duration', 'bitrate', 'uri', 'offset', 'previous_id')
+
+    # Attributes in the order of the __init__ parameters, used to copy and pickle tracks
+    _fields = ('id', 'title', 'artist', 'artist_id', 'album', 'album_id', 'track_no', 'year',
+               'genre', 'duration', 'bitrate', 'uri', 'offset', 'previous_id')
+
     def __init__(self,
                  id: str = '', title: str = '', artist: str = '', artist_id: str = '',
                  album: str = '', album_id: str = '', track_no: int = 0, year: int = 0,
@@ -26,16 +56,47 @@ class Track:
         """
 
         self.id: str = id
-        self.artist: str = artist
-        self.artist_id: str = artist_id
+        self.artist: str = intern_string(artist)
+        self.artist_id: str = intern_string(artist_id)
         self.title: str = title
-        self.album: str = album
-        self.album_id: str = album_id
+        self.album: str = intern_string(album)
+        self.album_id: str = intern_string(album_id)
         self.track_no: int = track_no
         self.year: int = year
-        self.genre: str = genre
+        self.genre: str = intern_string(genre)
         self.duration: int = duration
         self.bitrate: int = bitrate
         self.uri: str = uri
         self.offset: int = offset
         self.previous_id: str = previous_id
+
+    def to_dict(self) -> dict:
+        """Get the details of the track as a dictionary
+
+        :return: A dictionary of the track attributes, accepted by from_dict()
+        :rtype: dict
+        """
+
+        return {field: getattr(self, field) for field in self._fields}
+
+    @classmethod
+    def from_dict(cls, details: dict) -> 'Track':
+        """Create a Track from a dictionary created by to_dict()
+
+        :param dict details: A dictionary of track attributes
+        :return: A Track object
+        :rtype: Track
+        """
+
+        return cls(**details)
+
+    def __reduce__(self) -> tuple:
+        # Pickle the attribute values as a tuple, they are interned again when unpickled
+        return (Track, tuple(getattr(self, field) for field in self._fields))
+
+    def __copy__(self) -> 'Track':
+        return Track(*(getattr(self, field) for field in self._fields))
+
+    def __deepcopy__(self, memo: dict) -> 'Track':
+        # The attributes are immutable
+        return self.__copy__()
@@ -0,0 +1,369 @@
+from contextvars import ContextVar
+from email.message import Message
+from http.client import HTTPConnection, HTTPSConnection, HTTPException, RemoteDisconnected
+from urllib.error import HTTPError
+from urllib.parse import urljoin, urlsplit
+import gzip
+import io
+import logging
+import ssl
+import threading
+
+from . import deadline
+
+
+class TransportResponse:
+    """A fully read HTTP response
+
+    Provides the parts of the response interface returned by urllib which
+    are used by libsonic.
+    """
+
+    def __init__(self, url: str, status: int, reason: str, headers: Message, body: bytes) -> None:
+        """
+        :param str url: The URL that was requested
+        :param int status: The HTTP status code
+        :param str reason: The HTTP reason phrase
+        :param Message headers: The response headers
+        :param bytes body: The decoded response body
+        :return: None
+        """
+
+        self.url = url
+        self.status = status
+        self.reason = reason
+        self.msg = reason
+        self.headers = headers
+        self.body = io.BytesIO(body)
+
+    def read(self, amt: int = -1) -> bytes:
+        return self.body.read(amt)
+
+    def info(self) -> Message:
+        return self.headers
+
+    def getcode(self) -> int:
+        return self.status
+
+    def geturl(self) -> str:
+        return self.url
+
+    def close(self) -> None:
+        self.body.close()
+
+
+class ByteCounter:
+    """Count the bytes received by the requests of one task
+
+    PooledHTTPTransport.bytes_received counts every request made through the
+    transport, including those of concurrent requests from Alexa and of the
+    scrobble spool.  A ByteCounter started with count_bytes() only counts the
+    requests made in the current context, which includes the threads used by
+    SubsonicConnection.fan_out().
+    """
+
+    def __init__(self) -> None:
+        """
+        :return: None
+        """
+
+        self.bytes_received: int = 0
+        """Number of response body bytes received from the server"""
+
+        self.request_count: int = 0
+        """Number of HTTP requests made"""
+
+        self._lock = threading.Lock()
+
+    def add(self, byte_count: int) -> None:
+        """Count a request
+
+        :param int byte_count: The number of response body bytes received
+        :return: None
+        """
+
+        with self._lock:
+            self.bytes_received += byte_count
+            self.request_count += 1
+
+
+_counter: ContextVar = ContextVar('byte_counter', default=None)
+
+
+def count_bytes() -> ByteCounter:
+    """Start counting the bytes received by requests made in the current context
+
+    :return: The new counter
+    :rtype: ByteCounter
+    """
+
+    counter = ByteCounter()
+    _counter.set(counter)
+
+    return counter
+
+
+def stop_counting() -> None:
+    """Stop counting the bytes received in the current context
+
+    :return: None
+    """
+
+    _counter.set(None)
+
+
+class PooledHTTPTransport:
+    """HTTP transport with persistent keep-alive connections
+
+    libsonic opens a new connection, including the TCP and TLS handshakes, for
+    every API call.  This transport keeps connections open between requests
+    and asks the server to gzip responses.  It provides the open() method of
+    urllib.request.OpenerDirector so that it can be used in its place.
+    """
+
+    redirect_codes = (301, 302, 303, 307, 308)
+    """HTTP status codes which are followed as redirects"""
+
+    max_redirects = 5
+    """The maximum number of redirects followed for a single request"""
+
+    def __init__(self, pool_size: int = 8, connect_timeout: float = 5, read_timeout: float = 30,
+                 use_gzip: bool = True) -> None:
+        """
+        :param int pool_size: The maximum number of idle connections kept open for each server. Defaults to 8
+        :param float connect_timeout: Seconds to wait for a connection to be established. Defaults to 5
+        :param float read_timeout: Seconds to wait for data from the server. Defaults to 30
+        :param bool use_gzip: Request gzip compressed responses. Defaults to True
+        :return: None
+        """
+
+        self.logger = logging.getLogger(__name__)
+
+        self.pool_size = max(1, int(pool_size))
+        self.connect_timeout = float(connect_timeout)
+        self.read_timeout = float(read_timeout)
+        self.use_gzip = use_gzip
+
+        self.bytes_received: int = 0
+        """Number of response body bytes received from the server"""
+
+        self.request_count: int = 0
+        """Number of HTTP requests made"""
+
+        self._lock = threading.Lock()
+        self._idle: dict = {}
+        self._ssl_context = ssl.create_default_context()
+
+    def __getstate__(self) -> dict:
+        # Connections and locks cannot be shared with other processes, only the settings are copied
+        return {'pool_size': self.pool_size,
+                'connect_timeout': self.connect_timeout,
+                'read_timeout': self.read_timeout,
+                'use_gzip': self.use_gzip}
+
+    def __setstate__(self, state: dict) -> None:
+        self.__init__(**state)
+
+    def open(self, req, data=None, timeout: float = None) -> TransportResponse:
+        """Make an HTTP request
+
+        :param urllib.request.Request req: The request to make
+        :param bytes data: Request body, overrides the body of req. Defaults to None
+        :param float timeout: Read timeout in seconds, overrides read_timeout and the deadline of the current
+                              request. Defaults to None
+        :raises HTTPError: If the server returns an error status
+        :raises DeadlineExceeded: If the deadline of the current request has expired
+        :return: The response
+        :rtype: TransportResponse
+        """
+
+        url = req.full_url
+        body = data if data is not None else req.data
+        method = req.get_method() if data is None else 'POST'
+        headers = dict(req.header_items())
+
+        for _ in range(self.max_redirects + 1):
+            response = self._request(method, url, body, headers, self._timeout(timeout))
+
+            if response.status not in self.redirect_codes:
+                break
+
+            # Follow the redirect, 303 and POST to 301 / 302 become a GET as urllib does
+            url = urljoin(url, response.headers.get('Location'))
+
+            if response.status in (301, 302, 303) and method == 'POST':
+                method = 'GET'
+                body = None
+        else:
+            # urllib gives up in the same way rather than returning the redirect
+            raise HTTPError(response.url, response.status,
+                            f'Redirected more than {self.max_redirects} times, the last redirect was to {url}',
+                            response.headers, response.body)
+
+        if response.status >= 400:
+            raise HTTPError(url, response.status, response.reason, response.headers, response.body)
+
+        return response
+
+    def close(self) -> None:
+        """Close all idle connections
+
+        :return: None
+        """
+
+        with self._lock:
+            idle, self._idle = self._idle, {}
+
+        for connections in idle.values():
+            for connection in connections:
+                connection.close()
+
+    def _timeout(self, timeout: float) -> float:
+        """Get the timeout for a request, limited by the deadline of the current request"""
+
+        if timeout is not None:
+            return timeout
+
+        request_deadline = deadline.current()
+
+        if request_deadline is None:
+            return self.read_timeout
+
+        return request_deadline.timeout(self.read_timeout)
+
+    def _request(self, method: str, url: str, body: bytes, headers: dict, timeout: float) -> TransportResponse:
+        """Make a single HTTP request on a pooled connection
+
+        A connection taken from the pool may have been closed by the server
+        while it was idle, in that case the request is retried once on a new
+        connection.  Only a failure to send the request, or a connection
+        closed before the status line arrives, is treated as a stale
+        connection.  Once the server has started to respond the request may
+        have been acted on, so it is never repeated.
+        """
+
+        parts = urlsplit(url)
+        origin = (parts.scheme, parts.hostname, parts.port)
+        path = parts.path or '/'
+
+        if parts.query:
+            path = f'{path}?{parts.query}'
+
+        request_headers = {'Connection': 'keep-alive'}
+
+        if self.use_gzip:
+            request_headers['Accept-Encoding'] = 'gzip'
+
+        if body is not None:
+            request_headers['Content-Type'] = 'application/x-www-form-urlencoded'
+
+        request_headers.update(headers)
+
+        connection, reused = self._get_connection(origin, timeout)
+
+        try:
+            response = self._send(connection, method, path, body, request_headers)
+
+        except (RemoteDisconnected, BrokenPipeError, ConnectionResetError) as e:
+            connection.close()
+
+            # Only a connection closed while idle is retried, a new connection failing the same way is an error
+            if not reused:
+                raise
+
+            self.logger.debug(f'Pooled connection to {parts.hostname} was closed ({e!r}), retrying')
+            connection, _ = self._get_connection(origin, timeout, fresh=True)
+
+            try:
+                response = self._send(connection, method, path, body, request_headers)
+
+            except (HTTPException, OSError):
+                connection.close()
+                raise
+
+        except (HTTPException, OSError):
+            connection.close()
+            raise
+
+        try:
+            raw = response.read()
+
+        except (HTTPException, OSError):
+            connection.close()
+            raise
+
+        with self._lock:
+            self.bytes_received += len(raw)
+            self.request_count += 1
+
+        counter = _counter.get()
+
+        if counter is not None:
+            counter.add(len(raw))
+
+        if response.getheader('Content-Encoding', '').lower() == 'gzip':
+            raw = gzip.decompress(raw)
+
+        if response.will_close:
+            connection.close()
+        else:
+            self._release_connection(origin, connection)
+
+        return TransportResponse(url, response.status, response.reason, response.msg, raw)
+
+    @staticmethod
+    def _send(connection: HTTPConnection, method: str, path: str, body: bytes, headers: dict):
+        """Send a request and read the status line and headers of the response
+
+        :return: The response, with the body still to be read
+        :rtype: http.client.HTTPResponse
+        """
+
+        connection.request(method, path, body=body, headers=headers)
+
+        return connection.getresponse()
+
+    def _get_connection(self, origin: tuple, timeout: float, fresh: bool = False) -> tuple:
+        """Get a connection for the given origin
+
+        :return: A tuple of the connection and True if it was taken from the pool
+        :rtype: tuple
+        """
+
+        read_timeout = self.read_timeout if timeout is None else timeout
+
+        if not fresh:
+            with self._lock:
+                idle = self._idle.get(origin)
+                connection = idle.pop() if idle else None
+
+            if connection is not None:
+                connection.sock.settimeout(read_timeout)
+
+                return connection, True
+
+        scheme, host, port = origin
+        connect_timeout = min(self.connect_timeout, read_timeout)
+
+        if scheme == 'https':
+            connection = HTTPSConnection(host, port, timeout=connect_timeout, context=self._ssl_context)
+        else:
+            connection = HTTPConnection(host, port, timeout=connect_timeout)
+
+        # The connect timeout only applies while the connection is established
+        connection.connect()
+        connection.sock.settimeout(read_timeout)
+
+        return connection, False
+
+    def _release_connection(self, origin: tuple, connection: HTTPConnection) -> None:
+        """Return a connection to the pool, or close it if the pool is full"""
+
+        with self._lock:
+            idle = self._idle.setdefault(origin, [])
+
+            if len(idle) < self.pool_size:
+                idle.append(connection)
+                return
+
+        connection.close()
@@ -0,0 +1 @@
+# Makes the skill directory importable by the tests in tests/
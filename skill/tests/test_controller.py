@@ -0,0 +1,33 @@
+from ask_sdk_core.handler_input import HandlerInput
+from ask_sdk_model import RequestEnvelope
+from ask_sdk_model.interfaces.audioplayer import PlayBehavior
+
+from asknavidrome import controller
+from asknavidrome.subsonic_api import StreamSigner
+from asknavidrome.track import Track
+
+
+def _play(mode: str) -> object:
+    """Run start_playback() for a track following track 1 and return its play directive"""
+
+    signer = StreamSigner('https://example.com', 'user', 'password', 443, '/rest', '1.16.1')
+    track = Track(id='2', title='Song', artist='Artist', previous_id='1')
+    response = controller.start_playback(mode, '', None, track, HandlerInput(request_envelope=RequestEnvelope()), signer)
+
+    return response.directives[0]
+
+
+def test_next_replaces_enqueued_without_expected_previous_token():
+    directive = _play('next')
+
+    assert directive.play_behavior == PlayBehavior.REPLACE_ENQUEUED
+    assert directive.audio_item.stream.token == '2'
+    assert directive.audio_item.stream.url.startswith('https://example.com:443/rest/stream.view?')
+    assert directive.audio_item.stream.expected_previous_token is None
+
+
+def test_continue_enqueues_after_previous_token():
+    directive = _play('continue')
+
+    assert directive.play_behavior == PlayBehavior.ENQUEUE
+    assert directive.audio_item.stream.expected_previous_token == '1'
@@ -0,0 +1,58 @@
+import random
+
+from asknavidrome.indexed_list import IndexedList
+
+
+class Entry:
+    """An entry object, IndexedList finds positions by object identity"""
+
+
+def test_matches_a_list_after_random_edits():
+    rng = random.Random(1)
+    expected = [Entry() for _ in range(100)]
+    entries = IndexedList(expected, block_size=8)
+
+    for _ in range(2000):
+        action = rng.random()
+
+        if action < 0.3 and expected:
+            position = rng.randrange(len(expected))
+            assert entries.pop(position) is expected.pop(position)
+
+        elif action < 0.5 and expected:
+            assert entries.popleft() is expected.pop(0)
+
+        elif action < 0.7:
+            new_entries = [Entry() for _ in range(rng.randrange(1, 12))]
+            position = rng.randrange(len(expected) + 1)
+            entries.insert_many(position, new_entries)
+            expected[position:position] = new_entries
+
+        elif action < 0.85:
+            entry = Entry()
+            entries.append(entry)
+            expected.append(entry)
+
+        else:
+            entry = Entry()
+            entries.appendleft(entry)
+            expected.insert(0, entry)
+
+        assert len(entries) == len(expected)
+
+        if expected:
+            position = rng.randrange(len(expected))
+            assert entries[position] is expected[position]
+            assert entries.index_of(expected[position]) == position
+
+    assert list(entries) == expected
+
+
+def test_popleft_keeps_block_offsets():
+    entries = IndexedList([Entry() for _ in range(1000)], block_size=100)
+    entries[0]
+
+    entries.popleft()
+
+    assert not entries._dirty
+    assert entries.index_of(entries[500]) == 500
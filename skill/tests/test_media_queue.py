@@ -0,0 +1,35 @@
+from asknavidrome.media_queue import MediaQueue
+from asknavidrome.track import Track
+
+
+def _queue(count: int = 5) -> MediaQueue:
+    """Create a queue of tracks with the IDs 1 to count, with track 1 playing"""
+
+    play_queue = MediaQueue()
+    play_queue.add_tracks([Track(id=str(number), title=f'Song {number}') for number in range(1, count + 1)])
+    play_queue.get_next_track()
+
+    return play_queue
+
+
+def test_skip_failed_current_track_plays_the_next_track():
+    play_queue = _queue()
+
+    assert play_queue.skip_failed('1').id == '2'
+
+
+def test_skip_failed_enqueued_track_plays_the_track_after_it():
+    play_queue = _queue()
+
+    # Tracks 2 and 3 have been sent to the device, track 3 fails while track 1 is still the current track
+    play_queue.enqueue_next_track()
+    play_queue.enqueue_next_track()
+
+    assert play_queue.skip_failed('3').id == '4'
+    assert [track.id for track in play_queue.get_history()][-2:] == ['2', '3']
+
+
+def test_skip_failed_unknown_track_keeps_the_current_track():
+    play_queue = _queue()
+
+    assert play_queue.skip_failed('5').id == '1'